@@ -1,10 +1,27 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory, send_file
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory, send_file, g
 import os
+import re
+import time
 import uuid
 import logging
-import subprocess
 import shutil
-import browser_downloader  # Import the browser downloader
+import threading
+import artifact_cache
+import cancellation
+import driver_pool
+import formats
+import media_cache
+import metrics
+import pipelines
+import playlists
+import profiling
+import jobs
+import progress
+import scoreboard
+import singleflight
+import tracing
+import transcode
+import workspace
 
 # Set up logging
 logging.basicConfig(
@@ -21,10 +38,118 @@ app = Flask(__name__,
     template_folder=os.path.join(frontend_dir, 'templates'))
 app.config['TITLE'] = 'NeoByte Downloader'
 
-# Path to ffmpeg from the YoutubeDownloaderApp folder
-FFMPEG_PATH = os.path.join(os.getcwd(), 'YoutubeDownloaderApp', 'ffmpeg.exe')
-if not os.path.exists(FFMPEG_PATH):
-    FFMPEG_PATH = 'ffmpeg'  # Use system ffmpeg if not found
+# Admin routes require this token in an X-Admin-Token header; without one they only answer local requests
+ADMIN_TOKEN = os.environ.get('NEOBYTE_ADMIN_TOKEN')
+
+@app.before_request
+def start_timer():
+    g.started_at = time.time()
+
+@app.after_request
+def record_latency(response):
+    # For streamed downloads this is the time to the first byte, not the whole transfer
+    started_at = getattr(g, 'started_at', None)
+    if started_at is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.REQUEST_DURATION.observe(time.time() - started_at, route=route, method=request.method, status=str(response.status_code))
+    return response
+
+# Download routes get a stage-by-stage trace (see tracing.SAMPLE_RATE)
+TRACED_ENDPOINTS = {'download', 'instagram_download', 'twitter_download'}
+
+@app.before_request
+def start_trace():
+    if request.endpoint in TRACED_ENDPOINTS:
+        # Stage timings reveal backend order and internals, so only admins may force or see them
+        g.trace_visible = admin_denied() is None
+        forced = g.trace_visible and request.headers.get('X-Trace') == '1'
+        tracing.activate(tracing.start(request.path, force=forced))
+
+@app.after_request
+def add_server_timing(response):
+    trace = tracing.current()
+    if trace is None:
+        return response
+    if g.get('trace_visible'):
+        response.headers['Server-Timing'] = trace.server_timing()
+        response.headers['X-Trace-Id'] = trace.id
+    # The trace is logged once the body has been sent, so it includes the transfer and ffmpeg
+    sent_at = time.perf_counter()
+    status = response.status_code
+    def finish():
+        trace.add('transfer', sent_at, time.perf_counter())
+        trace.finish(status=status)
+    response.call_on_close(finish)
+    return response
+
+@app.teardown_request
+def end_trace(exc):
+    tracing.activate(None)
+
+# Download routes are followed by an on-demand profiling session, if one is running
+@app.before_request
+def start_profile():
+    if request.endpoint in TRACED_ENDPOINTS:
+        g.profile = profiling.request_started(request.path)
+
+@app.after_request
+def finish_profile(response):
+    handle = g.pop('profile', None)
+    if handle is not None:
+        # Streamed bodies are generated after this point, so stop once the response is closed
+        response.call_on_close(handle.finish)
+    return response
+
+@app.teardown_request
+def abandon_profile(exc):
+    # Requests that raised never reached finish_profile
+    handle = g.pop('profile', None)
+    if handle is not None:
+        handle.finish()
+
+def admin_denied():
+    """Error response for requests not allowed to use admin routes, else None"""
+    if ADMIN_TOKEN:
+        if request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+            return jsonify({'error': 'Admin token required'}), 403
+    elif request.remote_addr not in ('127.0.0.1', '::1'):
+        return jsonify({'error': 'Admin routes are only available locally unless NEOBYTE_ADMIN_TOKEN is set'}), 403
+    return None
+
+def register_metrics():
+    """Expose state the other modules already track as gauges read at scrape time"""
+    def chrome_sessions():
+        stats = driver_pool.get_pool().stats()
+        return [({'state': 'idle'}, stats['idle']), ({'state': 'in_use'}, stats['in_use'])]
+
+    def ffmpeg_processes():
+        stats = transcode.get_scheduler().stats()
+        return [({'state': 'running'}, stats['running']), ({'state': 'queued'}, stats['queued'])]
+
+    caches = {
+        'artifact': lambda: artifact_cache.get_cache().stats(),
+        'video_info': media_cache.video_info_cache.stats,
+        'download_link': media_cache.download_link_cache.stats,
+    }
+
+    def cache_field(field):
+        return lambda: [({'cache': name}, stats()[field]) for name, stats in caches.items()]
+
+    metrics.collect('neobyte_chrome_sessions', 'Chrome sessions in the driver pool by state', chrome_sessions)
+    metrics.collect('neobyte_ffmpeg_processes', 'ffmpeg work running or waiting for a scheduler slot', ffmpeg_processes)
+    metrics.collect('neobyte_ffmpeg_cpu_seconds_total', 'CPU seconds used by finished ffmpeg work', lambda: transcode.get_scheduler().stats()['cpu_seconds'], kind='counter')
+    metrics.collect('neobyte_scratch_bytes', 'Scratch space counted against the quota: reservations of active workspaces plus measured leftovers', lambda: workspace.get_manager().usage())
+    metrics.collect('neobyte_scratch_quota_bytes', 'Disk budget for scratch directories (0 means unlimited)', lambda: workspace.get_manager().quota or 0)
+    metrics.collect('neobyte_workspaces_active', 'Scratch directories currently in use', lambda: workspace.get_manager().active_count())
+    metrics.collect('neobyte_artifact_cache_bytes', 'Disk used by the artifact cache', lambda: artifact_cache.get_cache().stats()['bytes'])
+    metrics.collect('neobyte_cache_hits_total', 'Cache lookups that were served, per cache', cache_field('hits'), kind='counter')
+    metrics.collect('neobyte_cache_misses_total', 'Cache lookups that missed, per cache', cache_field('misses'), kind='counter')
+    metrics.collect('neobyte_cache_hit_ratio', 'Share of lookups served since startup, per cache', cache_field('hit_ratio'))
+    metrics.collect('neobyte_shared_downloads_in_flight', 'Upstream fetches currently shared between requests', singleflight.in_flight)
+    metrics.collect('neobyte_jobs_queued', 'Background jobs waiting for a worker', lambda: jobs.get_manager().pending())
+    metrics.collect('neobyte_playlists_active', 'Playlists being expanded or downloaded', lambda: playlists.get_manager().active())
+
+register_metrics()
 
 @app.route('/')
 def index():
@@ -45,679 +170,423 @@ def twitter():
     logger.info("X download page accessed")
     return render_template('twitter.html')
 
+def validate_instagram_url(url):
+    if not url:
+        return 'Please enter an Instagram URL'
+    
+    # Check if the URL is from Instagram
+    if not ('instagram.com' in url or 'instagr.am' in url):
+        return 'Please enter a valid Instagram URL'
+    return None
+
+def normalize_twitter_url(url):
+    """Return (url, error) with x.com links converted to twitter.com"""
+    if not url:
+        return url, 'Please enter an X (Twitter) URL'
+    
+    # Normalize URL (handle both x.com and twitter.com)
+    if 'x.com' in url and 'twitter.com' not in url:
+        logger.info(f"Converting X URL to Twitter format: {url}")
+        url = url.replace('x.com', 'twitter.com')
+    
+    # Validate URL format
+    if not ('twitter.com' in url or 'x.com' in url):
+        return url, 'Please enter a valid X or Twitter post URL'
+    return url, None
+
+def requested_audio_format():
+    """Audio format from the form, else inferred from what the client says it can play"""
+    audio_format = request.form.get('audio_format')
+    if audio_format:
+        return audio_format.lower()
+    # Clients that only accept MP3 get a re-encode where ffmpeg can do one; everyone else gets the source codec
+    accept = request.headers.get('Accept', '')
+    if 'audio/mpeg' in accept and not any(t in accept for t in ('audio/mp4', 'audio/webm', 'audio/ogg', 'audio/*')) and transcode.ffmpeg_available():
+        return 'mp3'
+    return formats.NATIVE_AUDIO
+
+# Client-chosen progress IDs: UUIDs, hex or similar tokens of bounded length
+PROGRESS_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{8,64}')
+
+def start_progress(download_id):
+    """Return (tracker, error_response) for a request, honouring a client-chosen ID
+
+    A client ID may not take over a tracker that already exists, such as a
+    job's, a playlist entry's or another client's download.
+    """
+    progress_id = request.form.get('progress_id')
+    if not progress_id:
+        return progress.create(download_id), None
+    if not PROGRESS_ID_PATTERN.fullmatch(progress_id):
+        return None, (jsonify({'error': 'progress_id must be 8-64 letters, digits, dashes or underscores'}), 400)
+    try:
+        return progress.create(progress_id, exclusive=True), None
+    except progress.TrackerExistsError as e:
+        return None, (jsonify({'error': str(e)}), 409)
+
+def with_progress_header(response, tracker):
+    response.headers['X-Progress-Id'] = tracker.id
+    return response
+
+def open_workspace(download_id):
+    """Return (workspace, error_response) for a new per-request scratch directory"""
+    try:
+        return workspace.get_manager().create(download_id), None
+    except workspace.QuotaExceededError as e:
+        logger.error(f"Refusing download {download_id}: {str(e)}")
+        return None, (jsonify({'error': str(e)}), 503)
+
+def send_result(result, tracker, scratch):
+    """Turn a pipeline result into a response that releases the workspace when done"""
+    response = result.to_response()
+    response.call_on_close(scratch.release)
+    return with_progress_header(response, tracker)
+
+def save_cookie_file(temp_dir, download_id):
+    """Persist an uploaded cookies.txt for yt-dlp, returning its path or None"""
+    if 'cookie_file' in request.files and request.files['cookie_file'].filename:
+        cookie_file = os.path.join(temp_dir, f'cookies_{download_id}.txt')
+        request.files['cookie_file'].save(cookie_file)
+        logger.info(f"Cookie file uploaded for download ID: {download_id}")
+        return cookie_file
+    return None
+
 @app.route('/download', methods=['POST'])
 def download():
     url = request.form.get('url')
     download_type = request.form.get('download_type')
     resolution = request.form.get('resolution')
+    audio_format = requested_audio_format()
+    # Optionally race a second backend against a slow first one
+    hedge = request.form.get('hedge', '').lower() in ('1', 'true', 'yes', 'on') or pipelines.HEDGE_BY_DEFAULT
     
     if not url:
         return jsonify({'error': 'Please enter a YouTube URL'}), 400
     
-    # Create a temporary download directory that will be cleaned after each download
-    # This directory will only temporarily hold files during processing
-    temp_dir = os.path.join(os.getcwd(), 'downloads')
-    os.makedirs(temp_dir, exist_ok=True)
+    if '/playlist?' in url:
+        return jsonify({'error': 'This is a playlist; use /playlists to download every video in it'}), 400
     
-    # Clean any existing files in the directory to prevent accumulation
-    for filename in os.listdir(temp_dir):
-        file_path = os.path.join(temp_dir, filename)
-        try:
-            if os.path.isfile(file_path):
-                os.unlink(file_path)
-        except Exception as e:
-            logger.error(f"Error cleaning temporary file {file_path}: {e}")
+    if audio_format not in formats.AUDIO_FORMATS:
+        return jsonify({'error': f'Unsupported audio format: {audio_format}'}), 400
     
     # Generate a unique ID for this download
     download_id = str(uuid.uuid4())
     
+    # Every download gets its own scratch directory, removed once the response is closed
+    scratch, error_response = open_workspace(download_id)
+    if error_response:
+        return error_response
+    
+    tracker, error_response = start_progress(download_id)
+    if error_response:
+        scratch.release()
+        return error_response
+    
     try:
-        # First try with browser downloader which bypasses bot detection
-        try:
-            logger.info(f"Attempting to download with browser downloader: {url}")
-            
-            is_audio = download_type == 'audio'
-            # Modified to use streaming download instead of temp files
-            stream, filename, error = browser_downloader.stream_with_quality(
-                url, 
-                resolution,
-                is_audio
-            )
-            
-            if stream and filename:
-                # Get original filename from the browser downloader
-                video_info = browser_downloader.get_video_info(url)
-                if video_info:
-                    title = video_info["title"]
-                    # Clean filename
-                    title = title.replace('/', '_').replace('\\', '_').replace(':', '_').replace('*', '_').replace('?', '_').replace('"', '_').replace('<', '_').replace('>', '_').replace('|', '_')
-                    original_filename = f"{title}.{'mp3' if is_audio else 'mp4'}"
-                else:
-                    original_filename = f"youtube_{download_id}.{'mp3' if is_audio else 'mp4'}"
-                
-                # Serve the file
-                response = send_file(
-                    file_path,
-                    as_attachment=True,
-                    download_name=original_filename,
-                    conditional=False
-                )
-                
-                # Clean up temp file immediately after sending
-                @response.call_on_close
-                def cleanup():
-                    try:
-                        if os.path.exists(file_path):
-                            os.remove(file_path)
-                            logger.info(f"Removed temporary file: {file_path}")
-                    except Exception as e:
-                        logger.error(f"Error removing temporary file: {e}")
-                
-                logger.info(f"Successfully downloaded with browser downloader: {original_filename}")
-                return response
-            else:
-                logger.error(f"Browser downloader failed: {error}")
-                # Fall through to other methods
-        except Exception as browser_error:
-            logger.error(f"Browser downloader error: {str(browser_error)}")
-            # Fall through to other methods
-        
-        # If browser downloader failed, try with pytube
-        try:
-            from pytube import YouTube
-            import re
-            
-            # Fix for pytube age-restricted videos
-            def bypass_age_gate(url):
-                try:
-                    url = url.replace("watch?v=", "embed/")
-                    return url
-                except:
-                    return url
-                    
-            # Try to process with pytube
-            logger.info(f"Attempting to download with pytube: {url}")
-            
-            # Bypass age gate if needed
-            embed_url = bypass_age_gate(url)
-            
-            # Initialize pytube YouTube object
-            yt = YouTube(url)
-            
-            # Get video title for filename
-            video_title = yt.title
-            # Clean filename
-            video_title = re.sub(r'[\\/*?:"<>|]', "", video_title)
-            
-            # Determine file path
-            if download_type == 'audio':
-                # Audio download
-                output_file = os.path.join(temp_dir, f"{download_id}.mp3")
-                stream = yt.streams.filter(only_audio=True).first()
-                
-                # Download the file
-                file_path = stream.download(output_path=temp_dir, filename=f"{download_id}.mp4")
-                
-                # Convert to mp3 if ffmpeg is available
-                if os.path.exists(FFMPEG_PATH):
-                    try:
-                        subprocess.run([
-                            FFMPEG_PATH, '-i', file_path, 
-                            '-vn', '-ab', '192k', '-ar', '44100', '-y', 
-                            output_file
-                        ], check=True, capture_output=True)
-                        
-                        # Remove the original mp4 file
-                        if os.path.exists(file_path):
-                            os.remove(file_path)
-                            
-                        filename = output_file
-                        original_filename = f"{video_title}.mp3"
-                    except Exception as e:
-                        logger.error(f"Error converting to MP3: {str(e)}")
-                        # If conversion fails, just use the mp4
-                        filename = file_path
-                        original_filename = f"{video_title}.mp4"
-                else:
-                    # No ffmpeg, just rename the file
-                    filename = file_path
-                    original_filename = f"{video_title}.mp4" 
-            else:
-                # Video download
-                if resolution == "highest":
-                    stream = yt.streams.get_highest_resolution()
-                elif resolution == "lowest":
-                    stream = yt.streams.filter(progressive=True).order_by('resolution').first()
-                elif resolution in ["2160p", "1440p", "1080p", "720p", "480p", "360p"]:
-                    # Extract the numeric value
-                    res_value = resolution[:-1]  # Remove 'p'
-                    # Find the closest matching resolution
-                    stream = yt.streams.filter(res=resolution, file_extension='mp4').first()
-                    if not stream:
-                        stream = yt.streams.get_highest_resolution()
-                else:
-                    stream = yt.streams.get_highest_resolution()
-                
-                # Download the file
-                filename = stream.download(output_path=temp_dir, filename=f"{download_id}.mp4")
-                original_filename = f"{video_title}.mp4"
-            
-            # Replace invalid characters in filename
-            original_filename = original_filename.replace('/', '_').replace('\\', '_').replace(':', '_').replace('*', '_').replace('?', '_').replace('"', '_').replace('<', '_').replace('>', '_').replace('|', '_')
-            
-            # Serve the file
-            response = send_file(
-                filename,
-                as_attachment=True,
-                download_name=original_filename,
-                conditional=False
-            )
-            
-            # Clean up temp file immediately after sending
-            @response.call_on_close
-            def cleanup():
-                try:
-                    if os.path.exists(filename):
-                        os.remove(filename)
-                        logger.info(f"Removed temporary file: {filename}")
-                except Exception as e:
-                    logger.error(f"Error removing temporary file: {e}")
-            
-            logger.info(f"Successfully downloaded with pytube: {original_filename}")
-            return response
-            
-        except Exception as pytube_error:
-            logger.error(f"Pytube download failed: {str(pytube_error)}")
-            logger.info("Falling back to yt-dlp with alternative options...")
-            
-            # Fallback to yt-dlp with special options to bypass bot detection
-            import yt_dlp
-            
-            # Configure yt-dlp options with bypass settings
-            output_template = os.path.join(temp_dir, f'{download_id}.%(ext)s')
-            
-            ydl_opts = {
-                'outtmpl': output_template,
-                'quiet': True,
-                'no_warnings': True,
-                'ffmpeg_location': FFMPEG_PATH,
-                # Try to bypass bot detection
-                'extractor_args': {
-                    'youtube': {
-                        'player_client': ['android', 'web'],
-                        'player_skip': ['js', 'configs', 'webpage']
-                    }
-                },
-                # Use a mobile user agent
-                'http_headers': {
-                    'User-Agent': 'Mozilla/5.0 (Android 12; Mobile; rv:68.0) Gecko/68.0 Firefox/96.0',
-                    'Accept-Language': 'en-US,en;q=0.5'
-                }
-            }
-            
-            # Add format options
-            if download_type == 'audio':
-                ydl_opts.update({
-                    'format': 'bestaudio/best',
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': '192',
-                    }],
-                })
-            else:
-                # Video download with resolution selection
-                if resolution == "highest":
-                    ydl_opts['format'] = 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'
-                elif resolution == "lowest":
-                    ydl_opts['format'] = 'worstvideo[ext=mp4]+worstaudio[ext=m4a]/worst[ext=mp4]/worst'
-                elif resolution == "2160p":
-                    ydl_opts['format'] = 'bestvideo[height<=2160][ext=mp4]+bestaudio[ext=m4a]/best[height<=2160][ext=mp4]/best'
-                elif resolution == "1440p":
-                    ydl_opts['format'] = 'bestvideo[height<=1440][ext=mp4]+bestaudio[ext=m4a]/best[height<=1440][ext=mp4]/best'
-                elif resolution == "1080p":
-                    ydl_opts['format'] = 'bestvideo[height<=1080][ext=mp4]+bestaudio[ext=m4a]/best[height<=1080][ext=mp4]/best'
-                else:
-                    ydl_opts['format'] = f'bestvideo[height<={resolution[:-1]}][ext=mp4]+bestaudio[ext=m4a]/best[height<={resolution[:-1]}][ext=mp4]/best'
-            
-            # Extract and download
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                # Get information and download the video
-                info = ydl.extract_info(url, download=True)
-                logger.info(f"Downloaded with yt-dlp to temporary location for immediate delivery to user")
-                
-                # Determine the output filename
-                if download_type == 'audio':
-                    filename = os.path.join(temp_dir, f"{download_id}.mp3")
-                else:
-                    filename = ydl.prepare_filename(info)
-                
-                # Ensure the file exists
-                if not os.path.exists(filename):
-                    # Try with different extension if needed
-                    possible_files = [os.path.join(temp_dir, f) for f in os.listdir(temp_dir) if f.startswith(download_id)]
-                    if possible_files:
-                        filename = possible_files[0]
-                    else:
-                        return jsonify({'error': 'Failed to download file'}), 500
-                
-                # Get original filename
-                original_filename = f"{info.get('title', 'video')}"
-                if download_type == 'audio':
-                    original_filename = f"{original_filename}.mp3"
-                else:
-                    original_filename = f"{original_filename}.mp4"
-                
-                # Replace invalid characters in filename
-                original_filename = original_filename.replace('/', '_').replace('\\', '_').replace(':', '_').replace('*', '_').replace('?', '_').replace('"', '_').replace('<', '_').replace('>', '_').replace('|', '_')
-                
-                # Serve the file directly to the user
-                response = send_file(
-                    filename,
-                    as_attachment=True,
-                    download_name=original_filename,
-                    conditional=False
-                )
-                
-                # Clean up temp file after sending (schedule deletion)
-                @response.call_on_close
-                def cleanup():
-                    try:
-                        if os.path.exists(filename):
-                            os.remove(filename)
-                    except:
-                        pass
-                
-                return response
-
-    except Exception as e:
-        error_message = f"Error downloading {url}: {str(e)}"
-        logger.error(error_message)
-        return jsonify({'error': error_message}), 500
-
-@app.route('/instagram_download', methods=['POST'])
-def instagram_download():
-    url = request.form.get('url')
-    
-    if not url:
-        return jsonify({'error': 'Please enter an Instagram URL'}), 400
-    
-    # Check if the URL is from Instagram
-    if not ('instagram.com' in url or 'instagr.am' in url):
-        return jsonify({'error': 'Please enter a valid Instagram URL'}), 400
-    
-    # Create temp directory if it doesn't exist
-    temp_dir = os.path.join(os.getcwd(), 'temp')
-    os.makedirs(temp_dir, exist_ok=True)
-    
-    # Generate a unique ID for this download
-    download_id = str(uuid.uuid4())
-    
-    try:
-        # Try browser downloader first (more reliable for Instagram)
-        try:
-            logger.info(f"Attempting Instagram download with browser method: {url}")
-            
-            # Use browser downloader for Instagram content
-            file_path, error = browser_downloader.download_instagram_content(
-                url, 
-                temp_dir,
-                f"{download_id}.mp4"
-            )
-            
-            if file_path and os.path.exists(file_path):
-                # Get content info
-                content_info = browser_downloader.get_instagram_info(url)
-                if content_info and content_info.get('title'):
-                    title = content_info['title']
-                    # Clean filename
-                    title = title.replace('/', '_').replace('\\', '_').replace(':', '_').replace('*', '_').replace('?', '_').replace('"', '_').replace('<', '_').replace('>', '_').replace('|', '_')
-                    original_filename = f"{title}.mp4"
-                else:
-                    # Generate filename based on URL type
-                    if 'reel' in url.lower():
-                        original_filename = f"Instagram_Reel_{download_id[:8]}.mp4"
-                    elif 'stories' in url.lower():
-                        original_filename = f"Instagram_Story_{download_id[:8]}.mp4"
-                    else:
-                        original_filename = f"Instagram_Post_{download_id[:8]}.mp4"
-                
-                # Serve the file
-                response = send_file(
-                    file_path,
-                    as_attachment=True,
-                    download_name=original_filename,
-                    conditional=False
-                )
-                
-                # Clean up temp file after sending
-                @response.call_on_close
-                def cleanup():
-                    try:
-                        if os.path.exists(file_path):
-                            os.remove(file_path)
-                    except:
-                        pass
-                
-                logger.info(f"Successfully downloaded Instagram content: {original_filename}")
-                return response
-            
-        except Exception as browser_error:
-            logger.warning(f"Browser downloader failed: {str(browser_error)}")
-        
-        # Fallback to yt-dlp with enhanced options
-        import yt_dlp
-        
-        # Configure yt-dlp options for Instagram download with authentication support
-        output_template = os.path.join(temp_dir, f'{download_id}.%(ext)s')
-        
-        ydl_opts = {
-            'outtmpl': output_template,
-            'quiet': True,
-            'no_warnings': True,
-            'ffmpeg_location': FFMPEG_PATH,
-            'format': 'best[height<=1080]/best',  # Limit to 1080p to avoid issues
-            'extract_flat': False,
-            'ignoreerrors': True,
-            'no_check_certificate': True,
-            'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'referer': 'https://www.instagram.com/',
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                'Accept-Language': 'en-us,en;q=0.5',
-                'Accept-Encoding': 'gzip,deflate',
-                'Accept-Charset': 'ISO-8859-1,utf-8;q=0.7,*;q=0.7',
-                'Keep-Alive': '300',
-                'Connection': 'keep-alive',
-            }
-        }
-        
-        # Extract info first to get metadata
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            logger.info(f"Downloading Instagram content from: {url}")
-            
-            try:
-                info = ydl.extract_info(url, download=True)
-            except yt_dlp.utils.ExtractorError as e:
-                if 'login' in str(e).lower() or 'private' in str(e).lower():
-                    return jsonify({
-                        'error': 'This Instagram content is private or requires login. Please try with a public post/reel.'
-                    }), 400
-                else:
-                    raise e
-            
-            if not info:
-                return jsonify({
-                    'error': 'Could not download content. The post may be private, deleted, or not accessible.'
-                }), 400
-            
-            # Determine the output filename
-            filename = ydl.prepare_filename(info)
-            
-            # Ensure the file exists
-            if not os.path.exists(filename):
-                # Try with different extension if needed
-                possible_files = [os.path.join(temp_dir, f) for f in os.listdir(temp_dir) if f.startswith(download_id)]
-                if possible_files:
-                    filename = possible_files[0]
-                else:
-                    return jsonify({'error': 'Failed to download file. Content may be protected or unavailable.'}), 500
-            
-            # Get original filename and content type
-            if 'title' in info and info['title']:
-                content_title = info['title']
-            else:
-                # Generate a title based on the type of content
-                if 'reel' in url.lower():
-                    content_title = f"Instagram_Reel_{download_id[:8]}"
-                elif 'stories' in url.lower():
-                    content_title = f"Instagram_Story_{download_id[:8]}"
-                else:
-                    content_title = f"Instagram_Post_{download_id[:8]}"
-            
-            # Get extension
-            _, ext = os.path.splitext(filename)
-            if not ext:
-                ext = '.mp4'  # Default to mp4 if no extension
-            
-            # Ensure proper extension
-            original_filename = f"{content_title}{ext}"
-            
-            # Replace invalid characters in filename
-            original_filename = original_filename.replace('/', '_').replace('\\', '_').replace(':', '_').replace('*', '_').replace('?', '_').replace('"', '_').replace('<', '_').replace('>', '_').replace('|', '_')
-            
-            # Serve the file directly to the user
-            response = send_file(
-                filename,
-                as_attachment=True,
-                download_name=original_filename,
-                conditional=False
-            )
-            
-            # Clean up temp file after sending
-            @response.call_on_close
-            def cleanup():
-                try:
-                    if os.path.exists(filename):
-                        os.remove(filename)
-                except:
-                    pass
-            
-            logger.info(f"Successfully downloaded Instagram content: {original_filename}")
-            return response
-            
-    except Exception as e:
-        error_message = f"Error downloading Instagram content from {url}: {str(e)}"
-        logger.error(error_message)
-        
-        # Provide more specific error messages
-        if 'login' in str(e).lower():
-            return jsonify({
-                'error': 'This Instagram content requires authentication. Please try with a public post or reel.'
-            }), 400
-        elif 'private' in str(e).lower():
-            return jsonify({
-                'error': 'This Instagram account or post is private and cannot be downloaded.'
-            }), 400
-        elif 'not found' in str(e).lower():
-            return jsonify({
-                'error': 'Instagram content not found. The post may have been deleted or the URL is incorrect.'
-            }), 404
-        else:
-            return jsonify({
-                'error': 'Failed to download Instagram content. Please try again or check if the content is publicly accessible.'
-            }), 500
+        # Extraction gets a fixed time budget; the transfer itself is not limited
+        with cancellation.deadline(pipelines.REQUEST_BUDGET), tracing.span('extract'):
+            result = pipelines.fetch_youtube(url, download_type, resolution, scratch.path, download_id, progress=tracker, audio_format=audio_format, hedge=hedge)
+        logger.info(f"Successfully prepared download: {result.download_name}")
+        return send_result(result, tracker, scratch)
+    except pipelines.PipelineError as e:
+        logger.error(f"Error downloading {url}: {e.message}")
+        tracker.finish(e.message)
+        scratch.release()
+        return jsonify({'error': e.message}), e.status
 
-@app.route('/twitter_download', methods=['POST'])
-def twitter_download():
+@app.route('/instagram_download', methods=['POST'])
+def instagram_download():
     url = request.form.get('url')
     
-    if not url:
-        return jsonify({'error': 'Please enter an X (Twitter) URL'}), 400
+    error = validate_instagram_url(url)
+    if error:
+        return jsonify({'error': error}), 400
     
-    # Normalize URL (handle both x.com and twitter.com)
-    if 'x.com' in url and 'twitter.com' not in url:
-        logger.info(f"Converting X URL to Twitter format: {url}")
-        url = url.replace('x.com', 'twitter.com')
+    # Generate a unique ID for this download
+    download_id = str(uuid.uuid4())
     
-    # Validate URL format
-    if not ('twitter.com' in url or 'x.com' in url):
-        return jsonify({'error': 'Please enter a valid X or Twitter post URL'}), 400
+    scratch, error_response = open_workspace(download_id)
+    if error_response:
+        return error_response
     
-    # Create temp directory if it doesn't exist
-    temp_dir = os.path.join(os.getcwd(), 'temp')
-    os.makedirs(temp_dir, exist_ok=True)
+    tracker, error_response = start_progress(download_id)
+    if error_response:
+        scratch.release()
+        return error_response
+    
+    try:
+        with cancellation.deadline(pipelines.REQUEST_BUDGET), tracing.span('extract'):
+            result = pipelines.fetch_instagram(url, scratch.path, download_id, progress=tracker)
+        logger.info(f"Successfully downloaded Instagram content: {result.download_name}")
+        return send_result(result, tracker, scratch)
+    except pipelines.PipelineError as e:
+        tracker.finish(e.message)
+        scratch.release()
+        return jsonify({'error': e.message}), e.status
+
+@app.route('/twitter_download', methods=['POST'])
+def twitter_download():
+    url, error = normalize_twitter_url(request.form.get('url'))
+    if error:
+        return jsonify({'error': error}), 400
     
     # Generate a unique ID for this download
     download_id = str(uuid.uuid4())
     
-    # Handle cookie file upload if provided
-    cookie_file = None
-    if 'cookie_file' in request.files and request.files['cookie_file'].filename:
-        try:
-            cookie_file = os.path.join(temp_dir, f'cookies_{download_id}.txt')
-            request.files['cookie_file'].save(cookie_file)
-            logger.info(f"Cookie file uploaded for download ID: {download_id}")
-        except Exception as e:
-            logger.error(f"Error saving cookie file: {str(e)}")
-            return jsonify({'error': 'Failed to process cookie file. Please try again.'}), 500
+    scratch, error_response = open_workspace(download_id)
+    if error_response:
+        return error_response
     
+    # Handle cookie file upload if provided
     try:
-        # Initialize yt-dlp for Twitter download
-        import yt_dlp
-        
-        # Configure yt-dlp options for Twitter download
-        output_template = os.path.join(temp_dir, f'{download_id}.%(ext)s')
-        
-        ydl_opts = {
-            'outtmpl': output_template,
-            'quiet': False,  # Enable some output for better debugging
-            'no_warnings': False,  # Show warnings for better debugging
-            'ffmpeg_location': FFMPEG_PATH,
-            'format': 'best',  # Get the best quality for Twitter
-            'cookiefile': cookie_file,  # Use cookie file if uploaded
-            'extract_flat': False,
-            'ignoreerrors': True,  # Skip any errors
-            'verbose': True  # Enable verbose output for debugging
-        }
-        
-        # Extract info first to get metadata
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            logger.info(f"Downloading X content from: {url}")
-            info = ydl.extract_info(url, download=True)
-            
-            if not info:
-                # Clean up cookie file
-                if cookie_file and os.path.exists(cookie_file):
-                    try:
-                        os.remove(cookie_file)
-                    except:
-                        pass
-                return jsonify({'error': 'Could not download content. The post may be private, not exist, or contain no media.'}), 400
-            
-            # Determine the output filename
-            filename = ydl.prepare_filename(info)
-            
-            # Ensure the file exists
-            if not os.path.exists(filename):
-                # Try with different extension if needed
-                possible_files = [os.path.join(temp_dir, f) for f in os.listdir(temp_dir) if f.startswith(download_id) and not f.startswith('cookies_')]
-                if possible_files:
-                    filename = possible_files[0]
-                else:
-                    # Clean up cookie file
-                    if cookie_file and os.path.exists(cookie_file):
-                        try:
-                            os.remove(cookie_file)
-                        except:
-                            pass
-                    return jsonify({'error': 'Failed to download file. The post may not contain downloadable media.'}), 500
-            
-            # Get original filename and content type
-            if 'title' in info and info['title']:
-                content_title = info['title']
-            else:
-                # Generate a title based on the account name if available
-                if 'uploader' in info and info['uploader']:
-                    content_title = f"X_Video_{info['uploader']}_{download_id[:6]}"
-                else:
-                    content_title = f"X_Video_{download_id[:8]}"
-            
-            # Get extension
-            _, ext = os.path.splitext(filename)
-            if not ext:
-                ext = '.mp4'  # Default to mp4 if no extension
-            
-            # Ensure proper extension
-            original_filename = f"{content_title}{ext}"
-            
-            # Replace invalid characters in filename
-            original_filename = original_filename.replace('/', '_').replace('\\', '_').replace(':', '_').replace('*', '_').replace('?', '_').replace('"', '_').replace('<', '_').replace('>', '_').replace('|', '_')
-            
-            # Log file information
-            file_size = os.path.getsize(filename)
-            logger.info(f"X content downloaded: {original_filename} ({file_size} bytes)")
-            
-            # Serve the file directly to the user
-            response = send_file(
-                filename,
-                as_attachment=True,
-                download_name=original_filename,
-                conditional=False
-            )
-            
-            # Clean up temp files after sending (schedule deletion)
-            @response.call_on_close
-            def cleanup():
-                try:
-                    # Clean up downloaded file
-                    if os.path.exists(filename):
-                        os.remove(filename)
-                    
-                    # Clean up cookie file
-                    if cookie_file and os.path.exists(cookie_file):
-                        os.remove(cookie_file)
-                        
-                except Exception as e:
-                    logger.error(f"Error cleaning up temporary files: {str(e)}")
-            
-            logger.info(f"Successfully downloaded X content: {original_filename}")
-            return response
-            
-    except yt_dlp.utils.DownloadError as e:
-        error_message = str(e)
-        logger.error(f"yt-dlp download error for {url}: {error_message}")
-        
-        # Clean up cookie file if there was an error
-        if cookie_file and os.path.exists(cookie_file):
-            try:
-                os.remove(cookie_file)
-            except:
-                pass
-        
-        # Handle common error cases with more user-friendly messages
-        if "Unsupported URL" in error_message:
-            return jsonify({'error': 'This URL is not supported or does not contain media content'}), 400
-        elif "requires authentication" in error_message:
-            return jsonify({'error': 'This content is private and requires authentication. Please try uploading a cookies.txt file from a browser where you are logged in.'}), 403
-        elif "not exist" in error_message or "404" in error_message:
-            return jsonify({'error': 'The requested content does not exist'}), 404
-        else:
-            return jsonify({'error': f'Error downloading content: {error_message}'}), 500
+        cookie_file = save_cookie_file(scratch.path, download_id)
     except Exception as e:
-        error_message = f"Error downloading X content from {url}: {str(e)}"
-        logger.error(error_message)
+        logger.error(f"Error saving cookie file: {str(e)}")
+        scratch.release()
+        return jsonify({'error': 'Failed to process cookie file. Please try again.'}), 500
+    
+    tracker, error_response = start_progress(download_id)
+    if error_response:
+        scratch.release()
+        return error_response
+    
+    try:
+        with cancellation.deadline(pipelines.REQUEST_BUDGET), tracing.span('extract'):
+            result = pipelines.fetch_twitter(url, scratch.path, download_id, cookie_file, progress=tracker)
+        logger.info(f"Successfully downloaded X content: {result.download_name}")
+        return send_result(result, tracker, scratch)
+    except pipelines.PipelineError as e:
+        tracker.finish(e.message)
+        scratch.release()
+        return jsonify({'error': e.message}), e.status
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Queue a download and return immediately with a job ID"""
+    platform = request.form.get('platform', 'youtube')
+    url = request.form.get('url')
+    manager = jobs.get_manager()
+    
+    if platform == 'youtube':
+        if not url:
+            return jsonify({'error': 'Please enter a YouTube URL'}), 400
+        download_type = request.form.get('download_type')
+        resolution = request.form.get('resolution')
+        audio_format = requested_audio_format()
+        if audio_format not in formats.AUDIO_FORMATS:
+            return jsonify({'error': f'Unsupported audio format: {audio_format}'}), 400
+        run = lambda job: pipelines.fetch_youtube(url, download_type, resolution, job.work_dir, job.id, progress=job.progress, audio_format=audio_format)
+    elif platform == 'instagram':
+        error = validate_instagram_url(url)
+        if error:
+            return jsonify({'error': error}), 400
+        run = lambda job: pipelines.fetch_instagram(url, job.work_dir, job.id, progress=job.progress)
+    elif platform == 'twitter':
+        url, error = normalize_twitter_url(url)
+        if error:
+            return jsonify({'error': error}), 400
+        # Cookie files are small; keep the upload in memory until the job has a workspace
+        cookies = None
+        if 'cookie_file' in request.files and request.files['cookie_file'].filename:
+            cookies = request.files['cookie_file'].read()
         
-        # Clean up cookie file if there was an error
-        if cookie_file and os.path.exists(cookie_file):
-            try:
-                os.remove(cookie_file)
-            except:
-                pass
-                
-        return jsonify({'error': error_message}), 500
-
-@app.route('/cleanup', methods=['GET'])
+        def run(job):
+            cookie_file = None
+            if cookies:
+                cookie_file = os.path.join(job.work_dir, f'cookies_{job.id}.txt')
+                with open(cookie_file, 'wb') as f:
+                    f.write(cookies)
+            return pipelines.fetch_twitter(url, job.work_dir, job.id, cookie_file, progress=job.progress)
+    else:
+        return jsonify({'error': f'Unsupported platform: {platform}'}), 400
+    
+    try:
+        job = manager.submit(platform, run, {'url': url})
+    except (jobs.QueueFullError, workspace.QuotaExceededError) as e:
+        return jsonify({'error': str(e)}), 503
+    
+    return jsonify({'job_id': job.id, 'status_url': f"/jobs/{job.id}", 'progress_url': f"/progress/{job.id}"}), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = jobs.get_manager().get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/artifact', methods=['GET'])
+def job_artifact(job_id):
+    job = jobs.get_manager().get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.state == jobs.FAILED:
+        return jsonify({'error': job.error}), job.status_code or 500
+    if job.state != jobs.FINISHED:
+        return jsonify({'error': 'Job is not finished yet', 'state': job.state}), 409
+    
+    return send_file(
+        job.artifact_path,
+        as_attachment=True,
+        download_name=job.download_name,
+        conditional=True
+    )
+
+@app.route('/playlists', methods=['POST'])
+def create_playlist():
+    """Expand a YouTube playlist and download its videos in the background"""
+    url = request.form.get('url')
+    if not pipelines.is_playlist_url(url):
+        return jsonify({'error': 'Please enter a YouTube playlist URL'}), 400
+    
+    audio_format = requested_audio_format()
+    if audio_format not in formats.AUDIO_FORMATS:
+        return jsonify({'error': f'Unsupported audio format: {audio_format}'}), 400
+    try:
+        concurrency = int(request.form['concurrency']) if request.form.get('concurrency') else None
+    except ValueError:
+        return jsonify({'error': 'concurrency must be a number'}), 400
+    
+    try:
+        playlist = playlists.get_manager().submit(url, request.form.get('download_type'), request.form.get('resolution'), audio_format, concurrency)
+    except (playlists.PlaylistLimitError, workspace.QuotaExceededError) as e:
+        return jsonify({'error': str(e)}), 503
+    
+    return jsonify({'playlist_id': playlist.id, 'status_url': f"/playlists/{playlist.id}"}), 202
+
+@app.route('/playlists/<playlist_id>', methods=['GET'])
+def playlist_status(playlist_id):
+    """State of the playlist and of every entry, with each entry's live progress"""
+    playlist = playlists.get_manager().get(playlist_id)
+    if not playlist:
+        return jsonify({'error': 'Playlist not found'}), 404
+    return jsonify(playlist.to_dict())
+
+@app.route('/playlists/<playlist_id>/cancel', methods=['POST'])
+def cancel_playlist(playlist_id):
+    playlist = playlists.get_manager().cancel(playlist_id)
+    if not playlist:
+        return jsonify({'error': 'Playlist not found'}), 404
+    return jsonify(playlist.to_dict())
+
+@app.route('/playlists/<playlist_id>/items/<int:index>/artifact', methods=['GET'])
+def playlist_item_artifact(playlist_id, index):
+    playlist = playlists.get_manager().get(playlist_id)
+    if not playlist:
+        return jsonify({'error': 'Playlist not found'}), 404
+    if not 1 <= index <= len(playlist.items):
+        return jsonify({'error': 'No such playlist entry'}), 404
+    item = playlist.items[index - 1]
+    if item.state != jobs.FINISHED:
+        return jsonify({'error': item.error or 'Entry is not finished yet', 'state': item.state}), item.status_code or 409
+    
+    return send_file(
+        item.artifact_path,
+        as_attachment=True,
+        download_name=item.download_name,
+        conditional=True
+    )
+
+@app.route('/progress/<progress_id>', methods=['GET'])
+def progress_events(progress_id):
+    """Server-Sent Events stream of byte counts, speed, ETA and stage"""
+    tracker = progress.get(progress_id)
+    if not tracker:
+        return jsonify({'error': 'Unknown download'}), 404
+    
+    response = Response(progress.event_stream(tracker), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/backends', methods=['GET'])
+def backend_scores():
+    """Rolling success rate, latency and circuit breaker state of every backend"""
+    return jsonify(scoreboard.get_scoreboard().snapshot())
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Counters, histograms and gauges in the Prometheus text format"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/admin/profile', methods=['POST'])
+def start_profile_session():
+    """Profile the next N download requests and/or the next T seconds"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    
+    mode = request.form.get('mode', 'sample')
+    if mode not in profiling.MODES:
+        return jsonify({'error': f'Unsupported profiling mode: {mode}'}), 400
+    try:
+        requests_limit = int(request.form['requests']) if request.form.get('requests') else None
+        seconds = float(request.form['seconds']) if request.form.get('seconds') else None
+        interval = float(request.form['interval']) if request.form.get('interval') else None
+    except ValueError:
+        return jsonify({'error': 'requests, seconds and interval must be numbers'}), 400
+    allocations = request.form.get('allocations', '').lower() in ('1', 'true', 'yes', 'on')
+    
+    try:
+        session = profiling.start(mode, requests_limit, seconds, interval, allocations)
+    except profiling.ProfilerBusyError as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify(session.to_dict()), 202
+
+@app.route('/admin/profile', methods=['GET'])
+def profile_session_status():
+    denied = admin_denied()
+    if denied:
+        return denied
+    session = profiling.current()
+    if session is None:
+        return jsonify({'error': 'No profiling session has run'}), 404
+    return jsonify(session.to_dict())
+
+@app.route('/admin/profile/stop', methods=['POST'])
+def stop_profile_session():
+    denied = admin_denied()
+    if denied:
+        return denied
+    session = profiling.stop()
+    if session is None:
+        return jsonify({'error': 'No profiling session is running'}), 409
+    return jsonify(session.to_dict())
+
+@app.route('/admin/profile/<session_id>/<name>', methods=['GET'])
+def profile_output(session_id, name):
+    """Download a file a session wrote (stacks.folded, profile.pstats, allocation reports)"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    path = profiling.output_path(session_id, name)
+    if not path:
+        return jsonify({'error': 'Profile output not found'}), 404
+    return send_file(path, as_attachment=True, download_name=f'{session_id}-{name}')
+
+@app.route('/cleanup', methods=['POST'])
 def cleanup_temp_files():
-    """Admin route to clean all temporary files"""
-    temp_dir = os.path.join(os.getcwd(), 'temp')
-    if os.path.exists(temp_dir):
-        cleaned = 0
-        for filename in os.listdir(temp_dir):
-            file_path = os.path.join(temp_dir, filename)
-            try:
-                if os.path.isfile(file_path):
-                    os.unlink(file_path)
-                    cleaned += 1
-            except Exception as e:
-                logger.error(f"Error cleaning file {file_path}: {e}")
-        return jsonify({'message': f'Cleaned {cleaned} temporary files'})
-    return jsonify({'message': 'No temporary directory found'})
+    """Admin route to run the scratch-space janitor immediately"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    reaped = workspace.get_manager().sweep()
+    return jsonify({'message': f'Cleaned {reaped} temporary files'})
 
 if __name__ == '__main__':
-    # Ensure temp directory exists
-    os.makedirs('temp', exist_ok=True)
+    # Set up scratch space and start the background janitor
+    workspace.get_manager()
+    
+    # Resolve chromedriver once before any request needs it
+    try:
+        driver_pool.resolve_driver_path()
+    except Exception as e:
+        logger.error(f"Could not resolve chromedriver: {str(e)}")
+    
+    # "kill -USR2 <pid>" starts or stops a sampling profile
+    profiling.install_signal_handler()
+    
+    # Pre-launch headless Chrome sessions in the background
+    threading.Thread(target=driver_pool.get_pool().warm, daemon=True).start()
     
     # Log application start
     logger.info("NeoByte Downloader application started")
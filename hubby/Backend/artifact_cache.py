@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger("artifact_cache")
+
+# Artifact cache settings (can be overridden through the environment)
+CACHE_DIR = os.environ.get('NEOBYTE_CACHE_DIR', os.path.join(os.getcwd(), 'cache'))
+CACHE_BYTES = int(os.environ.get('NEOBYTE_CACHE_BYTES', 2 * 1024 * 1024 * 1024))
+CACHE_POLICY = os.environ.get('NEOBYTE_CACHE_POLICY', 'lru').lower()
+
+def make_key(media_id, quality, is_audio):
+    """Content address for one rendition of one media item"""
+    raw = f"{media_id}|{quality or ''}|{'audio' if is_audio else 'video'}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+class TeeStream:
+    """Passes an upstream byte stream through while copying it into the cache
+
+    The copy is only admitted once the whole stream was read; aborted
+    transfers leave nothing behind.
+    """
+
+    def __init__(self, cache, key, stream, download_name):
+        self.cache = cache
+        self.key = key
+        self.stream = stream
+        self.download_name = download_name
+        self.content_type = getattr(stream, 'content_type', None)
+        self.content_length = getattr(stream, 'content_length', None)
+        self.part_path = cache._data_path(key) + f'.{threading.get_ident()}.part'
+
+    def __iter__(self):
+        completed = False
+        try:
+            with open(self.part_path, 'wb') as f:
+                for chunk in self.stream:
+                    f.write(chunk)
+                    yield chunk
+            completed = True
+        finally:
+            if completed and self.content_length and os.path.getsize(self.part_path) != int(self.content_length):
+                logger.warning(f"Not caching truncated transfer for {self.download_name}")
+                completed = False
+            if completed:
+                self.cache.store_file(self.key, self.part_path, self.download_name, move=True)
+            elif os.path.exists(self.part_path):
+                os.remove(self.part_path)
+
+    def close(self):
+        close = getattr(self.stream, 'close', None)
+        if close:
+            close()
+
+class ArtifactCache:
+    """Size-bounded on-disk cache of finished downloads with LRU or LFU eviction"""
+
+    def __init__(self, directory=CACHE_DIR, budget=CACHE_BYTES, policy=CACHE_POLICY):
+        self.directory = directory
+        self.budget = budget
+        self.policy = policy
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self._load()
+
+    def _data_path(self, key):
+        return os.path.join(self.directory, f"{key}.bin")
+
+    def _meta_path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _load(self):
+        """Rebuild the index from sidecar files so the cache survives restarts"""
+        for name in os.listdir(self.directory):
+            if name.endswith('.part'):
+                os.remove(os.path.join(self.directory, name))
+                continue
+            if not name.endswith('.json'):
+                continue
+            key = name[:-5]
+            try:
+                with open(self._meta_path(key)) as f:
+                    entry = json.load(f)
+                if os.path.exists(self._data_path(key)):
+                    entry['path'] = self._data_path(key)
+                    self._entries[key] = entry
+                else:
+                    os.remove(self._meta_path(key))
+            except Exception as e:
+                logger.warning(f"Dropping unreadable cache entry {key}: {str(e)}")
+        if self._entries:
+            logger.info(f"Loaded {len(self._entries)} cached artifacts ({self.total_bytes()} bytes)")
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(entry['size'] for entry in self._entries.values())
+
+    def lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not os.path.exists(entry['path']):
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            entry['last_access'] = time.time()
+            entry['hits'] += 1
+            self.hits += 1
+            return dict(entry)
+
+    def store_file(self, key, src_path, download_name, move=False):
+        """Admit a finished file; copies unless move is set"""
+        if self.budget <= 0:
+            if move:
+                os.remove(src_path)
+            return None
+        data_path = self._data_path(key)
+        try:
+            if move:
+                os.replace(src_path, data_path)
+            else:
+                tmp_path = data_path + f'.{threading.get_ident()}.part'
+                try:
+                    os.link(src_path, tmp_path)
+                except OSError:
+                    shutil.copyfile(src_path, tmp_path)
+                os.replace(tmp_path, data_path)
+        except Exception as e:
+            logger.error(f"Error caching artifact {key}: {str(e)}")
+            return None
+
+        entry = {
+            'download_name': download_name,
+            'size': os.path.getsize(data_path),
+            'created_at': time.time(),
+            'last_access': time.time(),
+            'hits': 0
+        }
+        with open(self._meta_path(key), 'w') as f:
+            json.dump(entry, f)
+        entry['path'] = data_path
+        with self._lock:
+            self._entries[key] = entry
+        logger.info(f"Cached artifact {download_name} ({entry['size']} bytes)")
+        self._evict()
+        return entry
+
+    def tee(self, key, stream, download_name):
+        return TeeStream(self, key, stream, download_name)
+
+    def _evict(self):
+        with self._lock:
+            total = sum(entry['size'] for entry in self._entries.values())
+            if total <= self.budget:
+                return
+            if self.policy == 'lfu':
+                order = sorted(self._entries.items(), key=lambda item: (item[1]['hits'], item[1]['last_access']))
+            else:
+                order = sorted(self._entries.items(), key=lambda item: item[1]['last_access'])
+            victims = []
+            for key, entry in order:
+                if total <= self.budget:
+                    break
+                total -= entry['size']
+                victims.append(key)
+                del self._entries[key]
+
+        for key in victims:
+            for path in (self._data_path(key), self._meta_path(key)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            logger.info(f"Evicted cached artifact {key}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': sum(entry['size'] for entry in self._entries.values()),
+                'budget': self.budget,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """Return the process-wide artifact cache, creating it on first use"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ArtifactCache()
+        return _cache
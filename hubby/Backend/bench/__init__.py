@@ -0,0 +1,11 @@
+"""
+Offline benchmarks for the download pipelines.
+
+Run from the Backend directory:
+
+    python -m bench.harness --iterations 5
+
+Every upstream (9xbuddy, Instagram, the media CDNs and yt-dlp's
+extractors) is replaced by a local stand-in, so results only depend on
+this code and the machine it runs on.
+"""
@@ -0,0 +1,292 @@
+"""
+Latency, throughput and memory of every route and backend, measured
+against the local stand-ins.
+
+    python -m bench.harness --iterations 5 --media-size 8388608 --json results.json
+
+Each iteration uses a new media ID so no cache or shared download can
+answer it. Latency is measured to the first byte and to the last byte.
+Memory comes from one extra run per scenario under tracemalloc, which
+keeps its overhead out of the timings. Scenarios whose dependencies
+(Chrome, yt-dlp) are missing are reported as skipped; any scenario that
+errors makes the harness exit with status 1.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import itertools
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+def max_rss_bytes():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def prepare_environment(workdir, base_url, trace=False, cache=False):
+    """Point the backend at the stand-ins; must run before any backend module is imported"""
+    os.environ['NEOBYTE_9XBUDDY_URL'] = base_url
+    os.environ['NEOBYTE_OFFLINE'] = '1'
+    if not cache:
+        # Every run must do the full work, so the artifact cache stays off
+        os.environ['NEOBYTE_CACHE_BYTES'] = '0'
+    os.environ['NEOBYTE_WORKSPACE_DIR'] = os.path.join(workdir, 'workspaces')
+    os.environ.setdefault('NEOBYTE_TRACE_SAMPLE_RATE', '1' if trace else '0')
+    # Modules keep their spool and scratch directories under the working directory
+    os.chdir(workdir)
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    logging.basicConfig(filename=os.path.join(workdir, 'neobyte.log'), level=logging.INFO)
+
+class Outcome:
+    def __init__(self):
+        self.first_byte = None
+        self.total = None
+        self.bytes = 0
+        self.error = None
+
+def drain(result, started, outcome):
+    """Read a MediaResult to the end, noting when the first byte arrived"""
+    try:
+        if result.stream is not None:
+            for chunk in result.stream:
+                if outcome.first_byte is None:
+                    outcome.first_byte = time.perf_counter() - started
+                outcome.bytes += len(chunk)
+        else:
+            outcome.first_byte = time.perf_counter() - started
+            outcome.bytes = os.path.getsize(result.path)
+    finally:
+        close = getattr(result.stream, 'close', None)
+        if close:
+            close()
+        result.cleanup()
+
+def drain_response(response, started, outcome):
+    try:
+        if response.status_code != 200:
+            outcome.error = f"HTTP {response.status_code}: {response.get_data(as_text=True)[:200]}"
+            return
+        for chunk in response.iter_encoded():
+            if outcome.first_byte is None:
+                outcome.first_byte = time.perf_counter() - started
+            outcome.bytes += len(chunk)
+    finally:
+        response.close()
+
+class Scenario:
+    """requires lists optional features; "a|b" means either will do"""
+
+    def __init__(self, name, run, requires=()):
+        self.name = name
+        self.run = run
+        self.requires = requires
+
+def build_scenarios(base_url, workdir, ids):
+    """One Scenario per backend and per download route"""
+    import app
+    import pipelines
+
+    client = app.app.test_client()
+
+    def youtube_url():
+        return f"https://www.youtube.com/watch?v=bench{next(ids):06d}"
+
+    def instagram_url():
+        return f"{base_url}/www.instagram.com/p/bench{next(ids):06d}/"
+
+    def twitter_url():
+        return f"https://twitter.com/bench/status/{next(ids):06d}"
+
+    def scratch():
+        return tempfile.mkdtemp(dir=workdir)
+
+    def backend(call):
+        def run(outcome):
+            temp_dir = scratch()
+            try:
+                started = time.perf_counter()
+                drain(call(temp_dir), started, outcome)
+                outcome.total = time.perf_counter() - started
+            finally:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+        return run
+
+    def route(path, form):
+        def run(outcome):
+            started = time.perf_counter()
+            drain_response(client.post(path, data=form(), buffered=False), started, outcome)
+            outcome.total = time.perf_counter() - started
+        return run
+
+    def youtube(fn):
+        return backend(lambda temp_dir: fn(youtube_url(), 'video', '720', temp_dir, 'bench'))
+
+    return [
+        Scenario('youtube/browser', youtube(pipelines.youtube_via_browser), ('chrome',)),
+        Scenario('youtube/pytube', youtube(pipelines.youtube_via_pytube)),
+        Scenario('youtube/yt-dlp', youtube(pipelines.youtube_via_ytdlp), ('yt_dlp',)),
+        Scenario('instagram/browser', backend(lambda temp_dir: pipelines.instagram_via_browser(instagram_url(), temp_dir, 'bench')), ('chrome',)),
+        Scenario('instagram/yt-dlp', backend(lambda temp_dir: pipelines.instagram_via_ytdlp(instagram_url(), temp_dir, 'bench')), ('yt_dlp',)),
+        Scenario('twitter/yt-dlp', backend(lambda temp_dir: pipelines._twitter_download(twitter_url(), temp_dir, 'bench', None, None)), ('yt_dlp',)),
+        Scenario('POST /download', route('/download', lambda: {'url': youtube_url(), 'download_type': 'video', 'resolution': '720'})),
+        Scenario('POST /instagram_download', route('/instagram_download', lambda: {'url': instagram_url()}), ('chrome|yt_dlp',)),
+        Scenario('POST /twitter_download', route('/twitter_download', lambda: {'url': twitter_url()}), ('yt_dlp',)),
+    ]
+
+def available_features():
+    """Which optional dependencies the scenarios can use here"""
+    features = set()
+    try:
+        import yt_dlp  # noqa: F401
+        features.add('yt_dlp')
+    except ImportError:
+        pass
+    try:
+        import driver_pool
+        driver_pool.get_pool().warm(1)
+        if driver_pool.get_pool().stats()['created']:
+            features.add('chrome')
+    except Exception:
+        pass
+    return features
+
+def measure(scenario, iterations):
+    timings = []
+    errors = []
+    for _ in range(iterations):
+        outcome = Outcome()
+        try:
+            scenario.run(outcome)
+        except Exception as e:
+            outcome.error = f"{type(e).__name__}: {getattr(e, 'message', None) or str(e)}"
+        if outcome.error:
+            errors.append(outcome.error)
+        else:
+            timings.append(outcome)
+
+    # One more run under tracemalloc for the memory profile
+    tracemalloc.start()
+    try:
+        scenario.run(Outcome())
+    except Exception:
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    first_bytes = [o.first_byte for o in timings if o.first_byte is not None]
+    totals = [o.total for o in timings]
+    throughputs = [o.bytes / o.total for o in timings if o.total]
+    return {
+        'scenario': scenario.name,
+        'runs': iterations,
+        'ok': len(timings),
+        'errors': errors[:3],
+        'ttfb_p50': percentile(first_bytes, 0.5),
+        'ttfb_p95': percentile(first_bytes, 0.95),
+        'total_p50': percentile(totals, 0.5),
+        'total_p95': percentile(totals, 0.95),
+        'throughput_p50': percentile(throughputs, 0.5),
+        'bytes': timings[0].bytes if timings else 0,
+        'alloc_peak': peak,
+    }
+
+def format_row(row):
+    def ms(value):
+        return '-' if value is None else f"{value * 1000:.0f}"
+    if row.get('skipped'):
+        return f"{row['scenario']:<26} skipped: {row['skipped']}"
+    throughput = row['throughput_p50']
+    return (
+        f"{row['scenario']:<26} {row['ok']:>3}/{row['runs']:<3} "
+        f"{ms(row['ttfb_p50']):>7} {ms(row['ttfb_p95']):>7} {ms(row['total_p50']):>8} {ms(row['total_p95']):>8} "
+        f"{'-' if throughput is None else f'{throughput / 1024 / 1024:.1f}':>7} "
+        f"{row['alloc_peak'] / 1024 / 1024:>8.1f}"
+        + (f"  first error: {row['errors'][0].strip()}" if row['errors'] else '')
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every route and backend against local stand-ins')
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--media-size', type=int, default=8 * 1024 * 1024, help='bytes per media file')
+    parser.add_argument('--rate', type=int, default=0, help='stand-in bytes per second per connection (0 = unlimited)')
+    parser.add_argument('--latency', type=float, default=0.0, help='stand-in seconds before every response')
+    parser.add_argument('--render-delay', type=float, default=0.0, help='seconds before the fake 9xbuddy list renders')
+    parser.add_argument('--only', help='run only scenarios whose name contains this text')
+    parser.add_argument('--trace', action='store_true', help='log a stage trace for every routed request')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    from bench import standins, stubs
+
+    workdir = tempfile.mkdtemp(prefix='neobyte-bench-')
+    json_path = os.path.abspath(args.json) if args.json else None
+    server = standins.StandinServer(config=standins.Config(args.media_size, args.rate, args.latency, args.render_delay))
+    base_url = server.start()
+    prepare_environment(workdir, base_url, args.trace)
+
+    stubs.install_pytube(base_url, args.media_size)
+    features = available_features()
+    if 'yt_dlp' in features:
+        stubs.install_ytdlp(base_url, args.media_size)
+
+    ids = itertools.count(1)
+    scenarios = [s for s in build_scenarios(base_url, workdir, ids) if not args.only or args.only in s.name]
+
+    print(f"Stand-ins at {base_url}, work directory {workdir}")
+    print(f"{'scenario':<26} {'ok':>7} {'ttfb50':>7} {'ttfb95':>7} {'total50':>8} {'total95':>8} {'MB/s':>7} {'alloc MB':>8}")
+    results = []
+    try:
+        for scenario in scenarios:
+            missing = [r for r in scenario.requires if not set(r.split('|')) & features]
+            if missing:
+                row = {'scenario': scenario.name, 'skipped': f"needs {', '.join(m.replace('|', ' or ') for m in missing)}"}
+            else:
+                row = measure(scenario, args.iterations)
+            results.append(row)
+            print(format_row(row), flush=True)
+    finally:
+        server.stop()
+        try:
+            import driver_pool
+            driver_pool.get_pool().shutdown()
+        except Exception:
+            pass
+
+    summary = {'results': results, 'max_rss': max_rss_bytes(), 'media_size': args.media_size, 'iterations': args.iterations}
+    if summary['max_rss']:
+        print(f"Peak RSS: {summary['max_rss'] / 1024 / 1024:.1f} MB")
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"Wrote {json_path}")
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    failed = [row['scenario'] for row in results if row.get('errors')]
+    if failed:
+        print(f"Scenarios with errors: {', '.join(failed)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,343 @@
+"""
+Concurrent load against the download routes, with an SLO report.
+
+    python -m bench.loadgen --concurrency 1,4,16 --duration 30 --mix download=6,instagram=3,twitter=1
+
+Starts the stand-ins and a server process (bench.server) unless --target
+points at one already running. Each concurrency level runs for the given
+duration and reports p50/p95/p99 latency and error rate per route.
+It also reports the server's peak RSS, open file descriptors and Chrome
+processes, sampled from /proc on Linux. Exits with status 1 if an SLO
+given with --slo-p95/--slo-error-rate is missed.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import itertools
+import threading
+import subprocess
+
+import requests
+
+from bench import standins
+from bench.harness import percentile, BACKEND_DIR
+
+ROUTES = {
+    'download': '/download',
+    'instagram': '/instagram_download',
+    'twitter': '/twitter_download',
+}
+
+def parse_mix(text):
+    """"download=6,instagram=3" -> [(route, weight), ...]"""
+    mix = []
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ROUTES:
+            raise argparse.ArgumentTypeError(f"Unknown route {name!r}; choose from {', '.join(ROUTES)}")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+def parse_levels(text):
+    return [int(level) for level in text.split(',') if level.strip()]
+
+# ---------------------------------------------------------------------------
+# Server-side resource sampling (Linux /proc)
+# ---------------------------------------------------------------------------
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+def rss_bytes(pid):
+    status = _read(f'/proc/{pid}/status')
+    for line in (status or '').splitlines():
+        if line.startswith('VmRSS:'):
+            return int(line.split()[1]) * 1024
+    return None
+
+def open_fds(pid):
+    try:
+        return len(os.listdir(f'/proc/{pid}/fd'))
+    except OSError:
+        return None
+
+def descendants(pid):
+    """PIDs of every process below pid, with their command names"""
+    children = {}
+    names = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        stat = _read(f'/proc/{entry}/stat')
+        if not stat:
+            continue
+        # The command name is in parentheses and may itself contain spaces
+        name = stat[stat.index('(') + 1:stat.rindex(')')]
+        ppid = int(stat[stat.rindex(')') + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+        names[int(entry)] = name
+    found = {}
+    stack = [pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            found[child] = names[child]
+            stack.append(child)
+    return found
+
+def chrome_processes(pid):
+    return sum(1 for name in descendants(pid).values() if 'chrom' in name.lower() and 'driver' not in name.lower())
+
+class Sampler:
+    """Polls the server process and remembers the peaks"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.supported = pid is not None and os.path.isdir(f'/proc/{pid}')
+        self.peak_rss = 0
+        self.peak_fds = 0
+        self.peak_chrome = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        rss = rss_bytes(self.pid) or 0
+        fds = open_fds(self.pid) or 0
+        chrome = chrome_processes(self.pid)
+        self.peak_rss = max(self.peak_rss, rss)
+        self.peak_fds = max(self.peak_fds, fds)
+        self.peak_chrome = max(self.peak_chrome, chrome)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        if self.supported:
+            self.sample()
+            self._thread = threading.Thread(target=self._loop, daemon=True, name='loadgen-sampler')
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self.sample()
+
+    def summary(self):
+        if not self.supported:
+            return None
+        return {'peak_rss': self.peak_rss, 'peak_fds': self.peak_fds, 'peak_chrome': self.peak_chrome}
+
+# ---------------------------------------------------------------------------
+# Load
+# ---------------------------------------------------------------------------
+
+class Sample:
+    def __init__(self, route, status, latency, first_byte, size, error=None):
+        self.route = route
+        self.status = status
+        self.latency = latency
+        self.first_byte = first_byte
+        self.size = size
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None and self.status == 200
+
+def request_form(route, standins_url, ids):
+    media = next(ids)
+    if route == 'download':
+        return {'url': f"https://www.youtube.com/watch?v=load{media:06d}", 'download_type': 'video', 'resolution': '720'}
+    if route == 'instagram':
+        return {'url': f"{standins_url}/www.instagram.com/p/load{media:06d}/"}
+    return {'url': f"https://twitter.com/bench/status/{media:06d}"}
+
+def one_request(session, target, route, form, timeout):
+    started = time.perf_counter()
+    first_byte = None
+    size = 0
+    try:
+        with session.post(target + ROUTES[route], data=form, stream=True, timeout=timeout) as response:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                if first_byte is None:
+                    first_byte = time.perf_counter() - started
+                size += len(chunk)
+            return Sample(route, response.status_code, time.perf_counter() - started, first_byte, size)
+    except requests.RequestException as e:
+        return Sample(route, None, time.perf_counter() - started, first_byte, size, error=type(e).__name__)
+
+def run_level(target, standins_url, concurrency, duration, mix, ids, timeout, unique):
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    samples = []
+    lock = threading.Lock()
+    deadline = time.time() + duration
+    # Without --unique every request for a route asks for the same media, exercising the caches (the server keeps them on)
+    fixed = {name: request_form(name, standins_url, ids) for name in names}
+
+    def worker():
+        session = requests.Session()
+        rng = random.Random()
+        while time.time() < deadline:
+            route = rng.choices(names, weights)[0]
+            form = request_form(route, standins_url, ids) if unique else fixed[route]
+            sample = one_request(session, target, route, form, timeout)
+            with lock:
+                samples.append(sample)
+        session.close()
+
+    started = time.time()
+    threads = [threading.Thread(target=worker, daemon=True, name=f'loadgen-{i}') for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.time() - started
+
+def summarize(samples):
+    latencies = [s.latency for s in samples]
+    errors = [s for s in samples if not s.ok]
+    return {
+        'count': len(samples),
+        'error_rate': len(errors) / len(samples) if samples else 0.0,
+        'p50': percentile(latencies, 0.5),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'ttfb_p95': percentile([s.first_byte for s in samples if s.first_byte is not None], 0.95),
+        'bytes': sum(s.size for s in samples),
+        'statuses': dict(sorted((str(k), v) for k, v in _count(s.status or s.error for s in samples).items())),
+    }
+
+def _count(values):
+    counts = {}
+    for value in values:
+        counts[value] = counts.get(value, 0) + 1
+    return counts
+
+def print_level(concurrency, elapsed, overall, routes, resources):
+    def ms(value):
+        return '-' if value is None else f"{value * 1000:.0f}"
+    print(f"\nconcurrency {concurrency}: {overall['count']} requests in {elapsed:.1f}s "
+          f"({overall['count'] / elapsed:.1f} req/s, {overall['bytes'] / elapsed / 1024 / 1024:.1f} MB/s)")
+    print(f"  {'route':<12} {'count':>6} {'err%':>6} {'p50':>7} {'p95':>7} {'p99':>7} {'ttfb95':>7}  statuses")
+    for name, row in list(routes.items()) + [('all', overall)]:
+        print(f"  {name:<12} {row['count']:>6} {row['error_rate'] * 100:>6.1f} {ms(row['p50']):>7} {ms(row['p95']):>7} "
+              f"{ms(row['p99']):>7} {ms(row['ttfb_p95']):>7}  {row['statuses']}")
+    if resources:
+        print(f"  server: peak RSS {resources['peak_rss'] / 1024 / 1024:.1f} MB, "
+              f"peak open fds {resources['peak_fds']}, peak Chrome processes {resources['peak_chrome']}")
+
+def check_slo(level, overall, p95_target, error_target):
+    failures = []
+    if p95_target is not None and overall['p95'] is not None and overall['p95'] > p95_target:
+        failures.append(f"concurrency {level}: p95 {overall['p95']:.2f}s > {p95_target}s")
+    if error_target is not None and overall['error_rate'] > error_target:
+        failures.append(f"concurrency {level}: error rate {overall['error_rate']:.2%} > {error_target:.2%}")
+    return failures
+
+# ---------------------------------------------------------------------------
+# Setup
+# ---------------------------------------------------------------------------
+
+def start_server(port, standins_url, media_size, cache=False):
+    command = [sys.executable, '-m', 'bench.server', '--port', str(port), '--standins', standins_url, '--media-size', str(media_size)]
+    if cache:
+        command.append('--cache')
+    process = subprocess.Popen(command, cwd=BACKEND_DIR)
+    target = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        if process.poll() is not None:
+            raise RuntimeError(f"bench.server exited with status {process.returncode}")
+        try:
+            if requests.get(f"{target}/backends", timeout=1).status_code == 200:
+                return process, target
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("bench.server did not start within 20 seconds")
+
+def main():
+    parser = argparse.ArgumentParser(description='Drive the download routes with concurrent load and report SLOs')
+    parser.add_argument('--concurrency', type=parse_levels, default=[4], help='comma-separated concurrency levels, run in turn')
+    parser.add_argument('--duration', type=float, default=30, help='seconds per concurrency level')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('download=6,instagram=3,twitter=1'), help='route weights')
+    parser.add_argument('--unique', action='store_true', help='request new media every time instead of repeating one item per route')
+    parser.add_argument('--timeout', type=float, default=300, help='client timeout per request')
+    parser.add_argument('--target', help='load an already running server instead of starting one')
+    parser.add_argument('--pid', type=int, help='process to sample when using --target')
+    parser.add_argument('--port', type=int, default=5055, help='port for the server started by the load generator')
+    parser.add_argument('--standins', help='base URL of running stand-ins (default: start them here)')
+    parser.add_argument('--media-size', type=int, default=8 * 1024 * 1024)
+    parser.add_argument('--rate', type=int, default=0, help='stand-in bytes per second per connection (0 = unlimited)')
+    parser.add_argument('--latency', type=float, default=0.0, help='stand-in seconds before every response')
+    parser.add_argument('--render-delay', type=float, default=0.0, help='seconds before the fake 9xbuddy list renders')
+    parser.add_argument('--slo-p95', type=float, help='p95 latency target in seconds')
+    parser.add_argument('--slo-error-rate', type=float, help='highest acceptable error rate, e.g. 0.01')
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args()
+
+    standins_server = None
+    standins_url = args.standins
+    if not standins_url:
+        standins_server = standins.StandinServer(config=standins.Config(args.media_size, args.rate, args.latency, args.render_delay))
+        standins_url = standins_server.start()
+
+    process = None
+    try:
+        if args.target:
+            target, pid = args.target.rstrip('/'), args.pid
+        else:
+            # Repeated media is only worth measuring with the artifact cache in place
+            process, target = start_server(args.port, standins_url, args.media_size, cache=not args.unique)
+            pid = process.pid
+        print(f"Target {target}, stand-ins {standins_url}, mix {dict(args.mix)}")
+
+        ids = itertools.count(1)
+        report = []
+        failures = []
+        for level in args.concurrency:
+            sampler = Sampler(pid).start()
+            samples, elapsed = run_level(target, standins_url, level, args.duration, args.mix, ids, args.timeout, args.unique)
+            sampler.stop()
+
+            overall = summarize(samples)
+            routes = {name: summarize([s for s in samples if s.route == name]) for name, _ in args.mix}
+            resources = sampler.summary()
+            print_level(level, elapsed, overall, routes, resources)
+            failures += check_slo(level, overall, args.slo_p95, args.slo_error_rate)
+            report.append({'concurrency': level, 'elapsed': elapsed, 'overall': overall, 'routes': routes, 'server': resources})
+    finally:
+        if process:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if standins_server:
+            standins_server.stop()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'levels': report, 'slo_failures': failures}, f, indent=2)
+        print(f"\nWrote {args.json}")
+    if failures:
+        print("\nSLO missed:\n  " + "\n  ".join(failures))
+        sys.exit(1)
+    if args.slo_p95 is not None or args.slo_error_rate is not None:
+        print("\nAll SLOs met")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+Run the web app against the stand-ins, for load tests and manual poking.
+
+    python -m bench.server --port 5055 --standins http://127.0.0.1:8765
+
+Pool sizes and other settings are taken from the usual NEOBYTE_*
+environment variables, so one node's configuration can be varied
+between runs.
+"""
+
+import os
+import logging
+import argparse
+import tempfile
+import threading
+
+from bench import harness, stubs
+
+logger = logging.getLogger("bench.server")
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the app with every upstream replaced by the stand-ins')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--standins', required=True, help='base URL of a running bench.standins server')
+    parser.add_argument('--media-size', type=int, default=8 * 1024 * 1024, help='bytes per media file, as served by the stand-ins')
+    parser.add_argument('--no-warm', action='store_true', help='do not pre-launch Chrome sessions')
+    parser.add_argument('--cache', action='store_true', help='keep the artifact cache on (NEOBYTE_CACHE_BYTES applies) instead of disabling it')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='neobyte-serve-')
+    harness.prepare_environment(workdir, args.standins, cache=args.cache)
+    stubs.install_pytube(args.standins, args.media_size)
+    try:
+        stubs.install_ytdlp(args.standins, args.media_size)
+    except ImportError:
+        logger.warning("yt-dlp is not installed; its backends will fail")
+
+    import app
+    import driver_pool
+    from werkzeug.serving import run_simple
+
+    if not args.no_warm:
+        threading.Thread(target=driver_pool.get_pool().warm, daemon=True).start()
+
+    print(f"Serving on http://{args.host}:{args.port} (pid {os.getpid()}, work directory {workdir})", flush=True)
+    run_simple(args.host, args.port, app.app, threaded=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""
+Local HTTP stand-ins for the sites the downloaders talk to.
+
+    GET /process?url=<youtube url>        9xbuddy result page (.media-info-title, .download-item)
+    GET /www.instagram.com/p/<code>/      Instagram post with a <video> tag
+    GET /media/<name>.<ext>?size=<bytes>  media file that honours Range requests
+
+Run on its own with "python -m bench.standins --port 8765" to point a
+live server at it (set NEOBYTE_9XBUDDY_URL=http://127.0.0.1:8765).
+"""
+
+import re
+import time
+import html
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger("bench.standins")
+
+DEFAULT_MEDIA_SIZE = 8 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+# Deterministic filler; every chunk is a rotation of this block
+PATTERN = bytes(range(256)) * (CHUNK_SIZE // 256)
+
+MIMETYPES = {
+    'mp4': 'video/mp4',
+    'm4a': 'audio/mp4',
+    'webm': 'video/webm',
+}
+
+# (quality, type, height) rows offered on the fake 9xbuddy page
+NINEXBUDDY_FORMATS = [
+    ('1080p', 'MP4', 1080),
+    ('720p', 'MP4', 720),
+    ('360p', 'MP4', 360),
+    ('128 kbps', 'M4A', None),
+]
+
+class Config:
+    """Knobs shared by every request the stand-in server answers"""
+
+    def __init__(self, media_size=DEFAULT_MEDIA_SIZE, rate=0, latency=0.0, render_delay=0.0):
+        self.media_size = media_size
+        # Bytes per second per connection; 0 means as fast as possible
+        self.rate = rate
+        # Seconds before any response starts, like a distant server
+        self.latency = latency
+        # Seconds before the 9xbuddy download list appears, like its client-side rendering
+        self.render_delay = render_delay
+
+def payload(offset, length):
+    start = offset % len(PATTERN)
+    block = PATTERN[start:] + PATTERN[:start]
+    return block[:length]
+
+def parse_range(header, size):
+    """Return (start, end) for a "bytes=a-b" header, or None if it is absent or unsatisfiable"""
+    match = re.match(r'bytes=(\d*)-(\d*)$', header or '')
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    if match.group(1):
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(0, size - int(match.group(2)))
+        end = size - 1
+    if start >= size:
+        return None
+    return start, min(end, size - 1)
+
+def ninexbuddy_page(base_url, video_url, media_size, render_delay):
+    video_id = (parse_qs(urlparse(video_url).query).get('v') or [urlparse(video_url).path.strip('/')])[0]
+    items = []
+    for quality, format_type, height in NINEXBUDDY_FORMATS:
+        ext = format_type.lower()
+        name = f"{video_id}-{height or 'audio'}.{ext}"
+        items.append(
+            '<div class="download-item">'
+            f'<span class="download-quality">{quality}</span>'
+            f'<span class="download-type">{format_type}</span>'
+            f'<span class="download-size">{media_size / 1024 / 1024:.1f} MB</span>'
+            f'<a class="download-btn" href="{base_url}/media/{name}?size={media_size}">Download</a>'
+            '</div>'
+        )
+    return f"""<!DOCTYPE html>
+<html><head><title>9xbuddy stand-in</title></head>
+<body>
+<div class="media-info-title">Benchmark video {html.escape(video_id)}</div>
+<div id="downloads"></div>
+<script>
+setTimeout(function () {{
+  document.getElementById('downloads').innerHTML = {''.join(items)!r};
+}}, {int(render_delay * 1000)});
+</script>
+</body></html>"""
+
+def instagram_page(base_url, code, media_size):
+    return f"""<!DOCTYPE html>
+<html><head><title>Benchmark reel {html.escape(code)} • Instagram</title></head>
+<body><video src="{base_url}/media/ig-{html.escape(code)}.mp4?size={media_size}" autoplay muted></video></body></html>"""
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    @property
+    def config(self):
+        return self.server.config
+
+    @property
+    def base_url(self):
+        return f"http://{self.headers.get('Host') or '%s:%d' % self.server.server_address}"
+
+    def do_GET(self):
+        if self.config.latency:
+            time.sleep(self.config.latency)
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+        if parsed.path == '/process':
+            self._send_page(ninexbuddy_page(self.base_url, (query.get('url') or [''])[0], self.config.media_size, self.config.render_delay))
+        elif re.match(r'^/www\.instagram\.com/(p|reel|reels|tv)/[\w-]+/?$', parsed.path):
+            code = parsed.path.rstrip('/').split('/')[-1]
+            self._send_page(instagram_page(self.base_url, code, self.config.media_size))
+        elif parsed.path.startswith('/media/'):
+            size = int((query.get('size') or [self.config.media_size])[0])
+            self._send_media(parsed.path, size)
+        else:
+            self.send_error(404)
+
+    def _send_page(self, body):
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_media(self, path, size):
+        ext = path.rsplit('.', 1)[-1].lower()
+        requested = self.headers.get('Range')
+        byte_range = parse_range(requested, size)
+        if requested and byte_range is None:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        start, end = byte_range or (0, size - 1)
+        self.send_response(206 if byte_range else 200)
+        self.send_header('Content-Type', MIMETYPES.get(ext, 'application/octet-stream'))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        if byte_range:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+
+        position = start
+        try:
+            while position <= end:
+                length = min(CHUNK_SIZE, end - position + 1)
+                self.wfile.write(payload(position, length))
+                position += length
+                if self.config.rate:
+                    time.sleep(length / self.config.rate)
+        except (BrokenPipeError, ConnectionResetError):
+            # Clients close early on purpose (e.g. the range probe)
+            pass
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, config=None):
+        super().__init__((host, port), Handler)
+        self.config = config or Config()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve from a background thread and return the base URL"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True, name='bench-standins')
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve local stand-ins for 9xbuddy, Instagram and media CDNs')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--media-size', type=int, default=DEFAULT_MEDIA_SIZE, help='bytes per media file')
+    parser.add_argument('--rate', type=int, default=0, help='bytes per second per connection (0 = unlimited)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before every response')
+    parser.add_argument('--render-delay', type=float, default=0.0, help='seconds before the 9xbuddy list renders')
+    args = parser.parse_args()
+
+    server = StandinServer(args.host, args.port, Config(args.media_size, args.rate, args.latency, args.render_delay))
+    print(f"Stand-ins listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Offline stand-ins for the extractor libraries.
+
+install_ytdlp() puts an extractor in front of yt-dlp's own, so YouTube,
+X and Instagram URLs resolve to formats on the stand-in media server
+while yt-dlp still does its normal format processing and downloading.
+pytube only talks to youtube.com, so install_pytube() replaces its
+YouTube class with one that lists the same stand-in streams.
+"""
+
+import re
+import sys
+import types
+
+# Format IDs mirror YouTube's so format selection behaves as it does live
+YTDLP_FORMATS = [
+    ('22', 'mp4', 720, 'avc1.64001F', 'mp4a.40.2'),
+    ('18', 'mp4', 360, 'avc1.42001E', 'mp4a.40.2'),
+    ('140', 'm4a', None, 'none', 'mp4a.40.2'),
+]
+
+MEDIA_URL_RE = r'https?://(?:www\.)?(?:youtube\.com/watch\?v=|youtu\.be/|(?:twitter|x)\.com/[^/]+/status/|(?:[\w.:]+/)?www\.instagram\.com/(?:p|reel|reels|tv)/)(?P<id>[\w-]+)'
+
+def media_id(url):
+    match = re.match(MEDIA_URL_RE, url)
+    return match.group('id') if match else 'media'
+
+def install_ytdlp(base_url, media_size):
+    """Register the stand-in extractor with every YoutubeDL created from now on"""
+    import yt_dlp
+    from yt_dlp.extractor.common import InfoExtractor
+
+    class NeobyteBenchIE(InfoExtractor):
+        IE_NAME = 'neobyte:bench'
+        _VALID_URL = MEDIA_URL_RE
+
+        def _real_extract(self, url):
+            video_id = self._match_id(url)
+            formats = []
+            for format_id, ext, height, vcodec, acodec in YTDLP_FORMATS:
+                formats.append({
+                    'format_id': format_id,
+                    'url': f"{base_url}/media/{video_id}-{format_id}.{ext}?size={media_size}",
+                    'ext': ext,
+                    'height': height,
+                    'vcodec': vcodec,
+                    'acodec': acodec,
+                    'abr': 128 if height is None else None,
+                    'tbr': None if height is None else height * 2,
+                    'filesize': media_size,
+                })
+            return {
+                'id': video_id,
+                'title': f"Benchmark {video_id}",
+                'uploader': 'neobyte-bench',
+                'duration': 60,
+                'formats': formats,
+            }
+
+    if getattr(yt_dlp.YoutubeDL, '_neobyte_bench', False):
+        return
+    add_defaults = yt_dlp.YoutubeDL.add_default_info_extractors
+
+    def add_default_info_extractors(self):
+        # The first suitable extractor wins, so ours goes ahead of the real ones
+        self.add_info_extractor(NeobyteBenchIE())
+        add_defaults(self)
+
+    yt_dlp.YoutubeDL.add_default_info_extractors = add_default_info_extractors
+    yt_dlp.YoutubeDL._neobyte_bench = True
+
+class FakeStream:
+    """The attributes of a pytube Stream that formats.from_pytube() reads"""
+
+    def __init__(self, url, subtype, resolution, video, audio, abr=None, filesize=0):
+        self.url = url
+        self.subtype = subtype
+        self.resolution = resolution
+        self.includes_video_track = video
+        self.includes_audio_track = audio
+        self.abr = abr
+        self.bitrate = 0
+        self.filesize = filesize
+        self.default_filename = f"stream.{subtype}"
+
+class FakeYouTube:
+    base_url = None
+    media_size = None
+
+    def __init__(self, url, on_progress_callback=None, **kwargs):
+        self.video_id = media_id(url)
+        self.title = f"Benchmark {self.video_id}"
+        self.length = 60
+        media = f"{self.base_url}/media/{self.video_id}"
+        self.streams = [
+            FakeStream(f"{media}-720.mp4?size={self.media_size}", 'mp4', '720p', True, True, filesize=self.media_size),
+            FakeStream(f"{media}-360.mp4?size={self.media_size}", 'mp4', '360p', True, True, filesize=self.media_size),
+            FakeStream(f"{media}-audio.m4a?size={self.media_size}", 'mp4', None, False, True, abr='128kbps', filesize=self.media_size),
+        ]
+
+def install_pytube(base_url, media_size):
+    """Point pytube.YouTube at the stand-in media server, installing a bare module if pytube is missing"""
+    FakeYouTube.base_url = base_url
+    FakeYouTube.media_size = media_size
+    try:
+        import pytube
+    except ImportError:
+        pytube = types.ModuleType('pytube')
+        sys.modules['pytube'] = pytube
+    pytube.YouTube = FakeYouTube
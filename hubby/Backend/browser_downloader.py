@@ -1,23 +1,29 @@
 import os
-import time
 import logging
 import re
 import subprocess
 import json
-import requests
 from urllib.parse import urlparse, parse_qs
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
+import cancellation
+import driver_pool
+import media_cache
+import formats
+import segmented
+import tracing
+import transcode
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("browser_downloader")
 
+# Longest wait for a page element; the request deadline can cut it shorter
+ELEMENT_TIMEOUT = float(os.environ.get('NEOBYTE_ELEMENT_TIMEOUT', 30))
+# Where format listings are scraped from (the benchmark points this at a local stand-in)
+NINEXBUDDY_URL = os.environ.get('NEOBYTE_9XBUDDY_URL', 'https://9xbuddy.xyz').rstrip('/')
+
 def get_video_id(url):
     """Extract YouTube video ID from URL"""
     if "youtu.be" in url:
@@ -44,37 +50,66 @@ def get_video_info(url):
     if not video_id:
         return None
     
+    # Repeat lookups for the same video skip the browser entirely; links are
+    # only looked up once the metadata is known, so a miss does not count twice
+    cached = media_cache.video_info_cache.get(video_id)
+    if cached:
+        links = media_cache.download_link_cache.get(video_id, refresher=lambda: _refresh_links(video_id))
+        if links is not None:
+            return dict(cached, download_links=links)
+    
+    with tracing.span('9xbuddy.scrape'):
+        video_info = _scrape_video_info(video_id)
+    if video_info:
+        _store_video_info(video_info)
+    return video_info
+
+def _store_video_info(video_info):
+    """Split scraped info into the metadata cache and the expiring link cache"""
+    video_id = video_info["video_id"]
+    _store_metadata(video_info)
+    media_cache.download_link_cache.set(video_id, video_info["download_links"])
+
+def _store_metadata(video_info):
+    # Keep the title at least as long as its links, or valid cached links would go unused
+    ttl = max(media_cache.INFO_CACHE_TTL, media_cache.download_link_cache.lifetime(video_info["download_links"]))
+    media_cache.video_info_cache.set(video_info["video_id"], _metadata_only(video_info), ttl=ttl)
+
+def _metadata_only(video_info):
+    return {k: v for k, v in video_info.items() if k != "download_links"}
+
+def _refresh_links(video_id):
+    """Re-scrape a video in the background and return its fresh links"""
+    video_info = _scrape_video_info(video_id)
+    if not video_info:
+        return None
+    _store_metadata(video_info)
+    return video_info["download_links"]
+
+def _scrape_video_info(video_id):
+    """Scrape title and download links for a video ID from 9xbuddy"""
     try:
-        # Use a headless browser to get the video title
-        chrome_options = Options()
-        chrome_options.add_argument("--headless")
-        chrome_options.add_argument("--disable-gpu")
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        chrome_options.add_argument("--disable-extensions")
-        chrome_options.add_argument("--disable-infobars")
-        chrome_options.add_argument("--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36")
-        
-        service = Service(ChromeDriverManager().install())
-        driver = webdriver.Chrome(service=service, options=chrome_options)
-        
-        try:
+        # Borrow a warm headless browser from the pool
+        with driver_pool.checkout() as driver:
             # Visit 9xbuddy which doesn't have bot detection
-            driver.get(f"https://9xbuddy.xyz/process?url=https://www.youtube.com/watch?v={video_id}")
+            with tracing.span('9xbuddy.page_load'):
+                driver.get(f"{NINEXBUDDY_URL}/process?url=https://www.youtube.com/watch?v={video_id}")
             
             # Wait for the title to be loaded
-            WebDriverWait(driver, 30).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, ".media-info-title"))
-            )
+            with tracing.span('9xbuddy.title_wait'):
+                WebDriverWait(driver, cancellation.timeout(ELEMENT_TIMEOUT)).until(
+                    EC.presence_of_element_located((By.CSS_SELECTOR, ".media-info-title"))
+                )
             
             # Get video title
             title_element = driver.find_element(By.CSS_SELECTOR, ".media-info-title")
             title = title_element.text.strip()
             
             # Wait for the download links to appear
-            WebDriverWait(driver, 30).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, ".download-item"))
-            )
+            with tracing.span('9xbuddy.links_wait'):
+                WebDriverWait(driver, cancellation.timeout(ELEMENT_TIMEOUT)).until(
+                    EC.presence_of_element_located((By.CSS_SELECTOR, ".download-item"))
+                )
             
             # Get all download options
             download_items = driver.find_elements(By.CSS_SELECTOR, ".download-item")
@@ -110,14 +145,12 @@ def get_video_info(url):
                 "formats": formats,
                 "download_links": download_links
             }
-        finally:
-            driver.quit()
     
     except Exception as e:
         logger.error(f"Error getting video info: {str(e)}")
         return None
 
-def download_video(url, format_key, output_dir, output_filename=None):
+def download_video(url, format_key, output_dir, output_filename=None, progress=None):
     """Download a YouTube video using browser automation"""
     video_info = get_video_info(url)
     
@@ -139,18 +172,8 @@ def download_video(url, format_key, output_dir, output_filename=None):
     try:
         logger.info(f"Downloading from URL: {download_url}")
         
-        # Download the file using requests
-        response = requests.get(download_url, stream=True)
-        response.raise_for_status()
-        
-        # Get total file size if available
-        total_size = int(response.headers.get('content-length', 0))
-        
-        # Download the file
-        with open(output_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
+        # Fetch in parallel range segments when the CDN allows it
+        segmented.download(download_url, output_path, progress=progress)
         
         return output_path, None
     
@@ -158,7 +181,17 @@ def download_video(url, format_key, output_dir, output_filename=None):
         logger.error(f"Error downloading video: {str(e)}")
         return None, str(e)
 
-def download_with_quality(url, quality, is_audio, output_dir, filename=None):
+def negotiate_format(video_info, quality, is_audio, allow_ffmpeg=False, audio_format=formats.NATIVE_AUDIO):
+    """Negotiate how to deliver the requested quality from the scraped formats"""
+    return formats.negotiate(formats.from_9xbuddy(video_info), is_audio, quality, audio_format=audio_format, allow_ffmpeg=allow_ffmpeg)
+
+def select_format(video_info, quality, is_audio):
+    """Pick the format entry from video_info that best matches the requested quality"""
+    # Files are saved exactly as 9xbuddy serves them
+    plan = negotiate_format(video_info, quality, is_audio)
+    return plan.sources[0].ref if plan else None
+
+def download_with_quality(url, quality, is_audio, output_dir, filename=None, progress=None):
     """Download video with specified quality or audio"""
     try:
         # Get video info
@@ -166,70 +199,11 @@ def download_with_quality(url, quality, is_audio, output_dir, filename=None):
         if not video_info:
             return None, "Failed to get video information"
         
-        # Determine the format to download
-        formats = video_info["formats"]
-        target_format = None
-        
-        if is_audio:
-            # Try to find an MP3 format
-            for fmt in formats:
-                if "MP3" in fmt["format"] or "mp3" in fmt["format"]:
-                    target_format = fmt
-                    break
-            
-            # If no MP3, try to find an audio format
-            if not target_format:
-                for fmt in formats:
-                    if "audio" in fmt["format"].lower():
-                        target_format = fmt
-                        break
-        else:
-            # For video, find the closest matching quality
-            quality_map = {
-                "highest": 1080,  # Default for highest
-                "1080p": 1080,
-                "720p": 720,
-                "480p": 480,
-                "360p": 360,
-                "lowest": 144    # Default for lowest
-            }
-            
-            target_quality = quality_map.get(quality, 720)  # Default to 720p if not recognized
-            
-            # Find available video qualities
-            quality_options = {}
-            for fmt in formats:
-                if "MP4" in fmt["format"] or "mp4" in fmt["format"]:
-                    # Extract numeric quality if available
-                    quality_str = fmt["quality"]
-                    if "p" in quality_str:
-                        try:
-                            q_value = int(quality_str.split("p")[0])
-                            quality_options[q_value] = fmt
-                        except:
-                            pass
-            
-            # Find the closest matching quality
-            if quality == "highest" and quality_options:
-                target_quality = max(quality_options.keys())
-            elif quality == "lowest" and quality_options:
-                target_quality = min(quality_options.keys())
-            
-            available_qualities = sorted(quality_options.keys())
-            
-            if available_qualities:
-                # Find the closest quality that doesn't exceed the target
-                suitable_qualities = [q for q in available_qualities if q <= target_quality]
-                if suitable_qualities:
-                    closest_quality = max(suitable_qualities)
-                else:
-                    closest_quality = min(available_qualities)
-                
-                target_format = quality_options[closest_quality]
+        target_format = select_format(video_info, quality, is_audio)
         
         # If we found a suitable format, download it
         if target_format:
-            return download_video(url, target_format["key"], output_dir, filename)
+            return download_video(url, target_format["key"], output_dir, filename, progress=progress)
         else:
             return None, "No suitable format found for the requested quality"
     
@@ -237,43 +211,56 @@ def download_with_quality(url, quality, is_audio, output_dir, filename=None):
         logger.error(f"Error in download_with_quality: {str(e)}")
         return None, str(e)
 
-def download_instagram_content(url, output_dir, filename):
-    """Download Instagram content using browser automation"""
+def stream_with_quality(url, quality, is_audio, progress=None, audio_format=formats.NATIVE_AUDIO):
+    """Open the upstream media for the requested quality without touching disk
+    
+    Returns (stream, filename, error) where stream is an iterable of bytes.
+    """
     try:
-        chrome_options = Options()
-        chrome_options.add_argument("--headless")
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        chrome_options.add_argument("--disable-gpu")
-        chrome_options.add_argument("--window-size=1920,1080")
-        chrome_options.add_argument("--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
+        video_info = get_video_info(url)
+        if not video_info:
+            return None, None, "Failed to get video information"
         
-        service = Service(ChromeDriverManager().install())
-        driver = webdriver.Chrome(service=service, options=chrome_options)
+        plan = negotiate_format(video_info, quality, is_audio, allow_ffmpeg=transcode.ffmpeg_available(), audio_format=audio_format)
+        if not plan:
+            return None, None, "No suitable format found for the requested quality"
         
-        try:
-            driver.get(url)
-            time.sleep(3)
+        logger.info(f"Streaming from URL: {plan.sources[0].url}")
+        stream = transcode.open_plan(plan, progress)
+        
+        title = re.sub(r'[\\/*?:"<>|]', "", video_info["title"])
+        return stream, f"{title}.{plan.container}", None
+    
+    except formats.ConversionUnavailableError:
+        # Not a scraping failure; the caller reports it to the client
+        raise
+    except Exception as e:
+        logger.error(f"Error in stream_with_quality: {str(e)}")
+        return None, None, str(e)
+
+def download_instagram_content(url, output_dir, filename, progress=None):
+    """Download Instagram content using browser automation"""
+    try:
+        with driver_pool.checkout() as driver:
+            with tracing.span('instagram.page_load'):
+                driver.get(url)
+            with tracing.span('instagram.settle'):
+                cancellation.sleep(3)
             
             # Look for video elements
+            video_url = None
             video_elements = driver.find_elements(By.TAG_NAME, "video")
-            
             if video_elements:
                 video_url = video_elements[0].get_attribute("src")
-                if video_url:
-                    # Download the video
-                    response = requests.get(video_url, stream=True)
-                    if response.status_code == 200:
-                        output_path = os.path.join(output_dir, filename)
-                        with open(output_path, 'wb') as f:
-                            for chunk in response.iter_content(chunk_size=8192):
-                                f.write(chunk)
-                        return output_path, None
-            
-            return None, "No video content found"
-            
-        finally:
-            driver.quit()
+        
+        # The browser goes back to the pool before the transfer starts
+        if video_url and video_url.startswith("http"):
+            output_path = os.path.join(output_dir, filename)
+            with cancellation.transfer(), tracing.span('instagram.download'):
+                segmented.download(video_url, output_path, progress=progress)
+            return output_path, None
+        
+        return None, "No video content found"
             
     except Exception as e:
         return None, str(e)
@@ -281,17 +268,9 @@ def download_instagram_content(url, output_dir, filename):
 def get_instagram_info(url):
     """Get Instagram content information"""
     try:
-        chrome_options = Options()
-        chrome_options.add_argument("--headless")
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        
-        service = Service(ChromeDriverManager().install())
-        driver = webdriver.Chrome(service=service, options=chrome_options)
-        
-        try:
+        with driver_pool.checkout() as driver, tracing.span('instagram.info'):
             driver.get(url)
-            time.sleep(2)
+            cancellation.sleep(2)
             
             # Try to get title from meta tags
             title_element = driver.find_element(By.TAG_NAME, "title")
@@ -299,9 +278,6 @@ def get_instagram_info(url):
             
             return {"title": title.replace(" • Instagram", "").strip()}
             
-        finally:
-            driver.quit()
-            
     except Exception as e:
         logger.error(f"Error getting Instagram info: {str(e)}")
         return None
\ No newline at end of file
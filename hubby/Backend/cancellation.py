@@ -0,0 +1,213 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger("cancellation")
+
+# Reason given to work that is cancelled because its deadline passed
+EXPIRED = 'deadline exceeded'
+
+class Cancelled(Exception):
+    """Raised inside work whose result is no longer wanted"""
+
+class DeadlineExceeded(Cancelled):
+    """Raised inside work that has used up its time budget"""
+
+class CancelToken:
+    """Signals a running extraction to stop and releases what it holds
+
+    Resources register a callback with on_cancel() (e.g. quitting a Chrome
+    session) so cancelling also interrupts calls that are blocked on them.
+    A token created with a parent is cancelled along with it and shares its
+    deadline, if any.
+    """
+
+    def __init__(self, parent=None):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self.reason = None
+        self.parent = parent
+        # Set once the work has moved on from extraction to moving bytes
+        self.transferring = False
+        if parent is not None:
+            parent.on_cancel(lambda: self.cancel(parent.reason))
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self, reason='cancelled'):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Error running cancel callback: {str(e)}")
+
+    def on_cancel(self, callback):
+        """Run callback when the token is cancelled; returns a function that unregisters it"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._unregister(callback)
+        callback()
+        return lambda: None
+
+    def _unregister(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def check(self):
+        if self.parent is not None and not self._event.is_set():
+            self.parent.check()
+        if self._event.is_set():
+            raise (DeadlineExceeded if self.reason == EXPIRED else Cancelled)(self.reason)
+
+    def wait(self, timeout):
+        """Sleep for up to timeout seconds, returning early (True) if cancelled"""
+        return self._event.wait(timeout)
+
+    def remaining(self):
+        """Seconds left before the nearest deadline, or None if there is none"""
+        return self.parent.remaining() if self.parent is not None else None
+
+    def begin_transfer(self):
+        """Mark the work as transferring, unless it has already been cancelled"""
+        with self._lock:
+            if not self._event.is_set():
+                self.transferring = True
+        self.check()
+
+class Deadline(CancelToken):
+    """A token that cancels itself once its time budget has been spent
+
+    Stages ask for remaining() (or use the module-level timeout()) so that a
+    wait, socket or subprocess never outlives the request it serves, and the
+    expiry cancels whatever is still blocked, such as a Chrome page load.
+    Call disarm() when the work finishes early.
+    """
+
+    def __init__(self, seconds, parent=None):
+        super().__init__(parent)
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self._timer = threading.Timer(seconds, self.cancel, args=(EXPIRED,))
+        self._timer.daemon = True
+        self._timer.start()
+
+    def remaining(self):
+        left = max(0.0, self.expires_at - time.monotonic())
+        inherited = super().remaining()
+        return left if inherited is None else min(left, inherited)
+
+    def check(self):
+        # Don't rely on the timer having fired yet
+        if self.expires_at <= time.monotonic():
+            self.cancel(EXPIRED)
+        super().check()
+
+    def disarm(self):
+        self._timer.cancel()
+
+_local = threading.local()
+
+def current():
+    """The token bound to the calling thread, if any"""
+    return getattr(_local, 'token', None)
+
+@contextmanager
+def bind(token):
+    """Make token the current one for code running in this thread"""
+    previous = current()
+    _local.token = token
+    try:
+        yield token
+    finally:
+        _local.token = previous
+
+@contextmanager
+def deadline(seconds):
+    """Bind a Deadline of the given budget for the with-block (a budget of 0 or None means none)"""
+    if not seconds or seconds <= 0:
+        yield current()
+        return
+    token = Deadline(seconds, parent=current())
+    try:
+        with bind(token):
+            yield token
+    finally:
+        token.disarm()
+
+@contextmanager
+def transfer():
+    """Bind a token for moving bytes once extraction has finished within its budget
+
+    Explicit cancellation anywhere up the chain (a lost hedge race, a
+    cancelled job) still stops the transfer, but a deadline expiring does
+    not: budgets limit how long a download takes to start, not the link.
+    """
+    source = current()
+    if source is None:
+        yield None
+        return
+    source.begin_transfer()
+    token = CancelToken()
+    unregister = []
+    ancestor = source
+    while ancestor is not None:
+        # Expiry propagates down the chain with its reason, so every link is checked
+        def cancelled(ancestor=ancestor):
+            if ancestor.reason != EXPIRED:
+                token.cancel(ancestor.reason)
+        unregister.append(ancestor.on_cancel(cancelled))
+        ancestor = ancestor.parent
+    try:
+        with bind(token):
+            yield token
+    finally:
+        for callback in unregister:
+            callback()
+
+def check():
+    token = current()
+    if token:
+        token.check()
+
+def remaining():
+    token = current()
+    return token.remaining() if token else None
+
+def expired():
+    """True once the current deadline has passed"""
+    left = remaining()
+    return left is not None and left <= 0
+
+def timeout(default):
+    """default capped to what is left of the current deadline, for the next stage to use
+
+    Raises DeadlineExceeded if nothing is left, rather than handing out a
+    zero timeout that most libraries read as "wait forever".
+    """
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        raise DeadlineExceeded(EXPIRED)
+    return left if default is None else min(default, left)
+
+def sleep(seconds):
+    """time.sleep that wakes early, raising, once the current work is cancelled"""
+    token = current()
+    if token is None:
+        time.sleep(seconds)
+        return
+    token.wait(timeout(seconds))
+    check()
@@ -0,0 +1,229 @@
+import os
+import time
+import queue
+import logging
+import shutil
+import threading
+from contextlib import contextmanager
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.chrome.options import Options
+from webdriver_manager.chrome import ChromeDriverManager
+import cancellation
+import tracing
+
+logger = logging.getLogger("driver_pool")
+
+# Pool settings (can be overridden through the environment)
+POOL_SIZE = int(os.environ.get('NEOBYTE_DRIVER_POOL_SIZE', 2))
+MAX_USES_PER_DRIVER = int(os.environ.get('NEOBYTE_DRIVER_MAX_USES', 50))
+CHECKOUT_TIMEOUT = float(os.environ.get('NEOBYTE_DRIVER_CHECKOUT_TIMEOUT', 60))
+PAGE_LOAD_TIMEOUT = float(os.environ.get('NEOBYTE_PAGE_LOAD_TIMEOUT', 60))
+
+# Explicit chromedriver location and offline switch for restricted workers
+CHROMEDRIVER_PATH = os.environ.get('CHROMEDRIVER_PATH')
+OFFLINE = os.environ.get('NEOBYTE_OFFLINE', '').lower() in ('1', 'true', 'yes')
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36"
+
+def build_options():
+    """Chrome options shared by every pooled session"""
+    chrome_options = Options()
+    chrome_options.add_argument("--headless")
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument("--disable-extensions")
+    chrome_options.add_argument("--disable-infobars")
+    chrome_options.add_argument("--window-size=1920,1080")
+    chrome_options.add_argument(f"--user-agent={USER_AGENT}")
+    return chrome_options
+
+_driver_path = None
+_driver_path_lock = threading.Lock()
+
+def resolve_driver_path():
+    """Locate the chromedriver binary once and reuse the answer for the process lifetime"""
+    global _driver_path
+    with _driver_path_lock:
+        if _driver_path:
+            return _driver_path
+
+        if CHROMEDRIVER_PATH:
+            if not os.path.exists(CHROMEDRIVER_PATH):
+                raise FileNotFoundError(f"CHROMEDRIVER_PATH does not exist: {CHROMEDRIVER_PATH}")
+            path = CHROMEDRIVER_PATH
+        elif OFFLINE:
+            # Never contact the driver registry in offline mode
+            path = shutil.which('chromedriver')
+            if not path:
+                raise FileNotFoundError("Offline mode requires CHROMEDRIVER_PATH or chromedriver on PATH")
+        else:
+            path = ChromeDriverManager().install()
+
+        logger.info(f"Using chromedriver at {path}")
+        _driver_path = path
+        return _driver_path
+
+class PooledDriver:
+    """A Chrome session plus the bookkeeping the pool needs to recycle it"""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.uses = 0
+        self.created_at = time.time()
+
+    def is_healthy(self):
+        try:
+            # Any round trip to the browser proves the session is still alive
+            self.driver.execute_script("return 1")
+            return True
+        except Exception:
+            return False
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except Exception as e:
+            logger.warning(f"Error quitting driver: {str(e)}")
+
+class DriverPool:
+    """Bounded pool of pre-launched headless Chrome sessions"""
+
+    def __init__(self, size=POOL_SIZE, max_uses=MAX_USES_PER_DRIVER):
+        self.size = max(1, size)
+        self.max_uses = max_uses
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def _launch(self):
+        service = Service(resolve_driver_path())
+        driver = webdriver.Chrome(service=service, options=build_options())
+        logger.info("Launched new pooled Chrome session")
+        return PooledDriver(driver)
+
+    def _discard(self, pooled):
+        pooled.quit()
+        with self._lock:
+            self._created -= 1
+
+    def warm(self, count=None):
+        """Pre-launch sessions so the first requests skip browser startup"""
+        count = self.size if count is None else min(count, self.size)
+        for _ in range(count):
+            with self._lock:
+                if self._created >= self.size:
+                    return
+                self._created += 1
+            try:
+                self._idle.put(self._launch())
+            except Exception as e:
+                with self._lock:
+                    self._created -= 1
+                logger.error(f"Error warming driver pool: {str(e)}")
+                return
+
+    def acquire(self, timeout=CHECKOUT_TIMEOUT):
+        deadline = time.time() + timeout
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                pooled = None
+                with self._lock:
+                    can_launch = self._created < self.size
+                    if can_launch:
+                        self._created += 1
+                if can_launch:
+                    try:
+                        with tracing.span('chrome.start'):
+                            pooled = self._launch()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise TimeoutError("No Chrome session available in the pool")
+                    try:
+                        pooled = self._idle.get(timeout=remaining)
+                    except queue.Empty:
+                        raise TimeoutError("No Chrome session available in the pool")
+
+            if pooled.is_healthy():
+                pooled.uses += 1
+                return pooled
+
+            logger.warning("Discarding unhealthy Chrome session")
+            self._discard(pooled)
+
+    def release(self, pooled, broken=False):
+        if broken or pooled.uses >= self.max_uses:
+            if not broken:
+                logger.info(f"Recycling Chrome session after {pooled.uses} uses")
+            self._discard(pooled)
+            return
+        try:
+            # Leave the session on a blank page so the next user starts clean
+            pooled.driver.delete_all_cookies()
+            pooled.driver.get("about:blank")
+        except Exception:
+            self._discard(pooled)
+            return
+        self._idle.put(pooled)
+
+    @contextmanager
+    def checkout(self, timeout=CHECKOUT_TIMEOUT):
+        """Borrow a driver for the duration of a with-block
+
+        Both the wait for a free session and page loads in it are capped by
+        the caller's deadline, if one is bound.
+        """
+        with tracing.span('chrome.checkout'):
+            pooled = self.acquire(cancellation.timeout(timeout))
+        broken = False
+        # Cancelling the caller's work kills the session, which aborts any pending wait
+        token = cancellation.current()
+        unregister = token.on_cancel(pooled.quit) if token else None
+        try:
+            pooled.driver.set_page_load_timeout(cancellation.timeout(PAGE_LOAD_TIMEOUT))
+            yield pooled.driver
+        except Exception:
+            broken = not pooled.is_healthy()
+            raise
+        finally:
+            if unregister:
+                unregister()
+            if token and token.cancelled:
+                broken = True
+            self.release(pooled, broken=broken)
+
+    def stats(self):
+        with self._lock:
+            created = self._created
+        idle = self._idle.qsize()
+        return {"size": self.size, "created": created, "idle": idle, "in_use": created - idle}
+
+    def shutdown(self):
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(pooled)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Return the process-wide driver pool, creating it on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = DriverPool()
+        return _pool
+
+def checkout(timeout=CHECKOUT_TIMEOUT):
+    return get_pool().checkout(timeout)
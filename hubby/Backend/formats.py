@@ -0,0 +1,373 @@
+"""
+Format negotiation shared by every YouTube backend.
+
+Each backend describes what it can fetch as a list of Candidates; negotiate()
+picks the one that best matches the requested quality and says how it has to
+be delivered: as is (direct), repackaged without re-encoding (remux) or fully
+re-encoded (transcode). Among equal qualities the cheapest delivery wins, so
+most requests never start ffmpeg at all.
+"""
+
+import re
+import logging
+
+logger = logging.getLogger("formats")
+
+DIRECT = 'direct'
+REMUX = 'remux'
+TRANSCODE = 'transcode'
+
+# Height used when the requested resolution isn't recognised
+DEFAULT_HEIGHT = 720
+
+# Codecs each output container can carry without re-encoding
+CONTAINER_CODECS = {
+    'mp4': {'h264', 'hevc', 'av1', 'vp9', 'aac', 'mp3', 'opus'},
+    'webm': {'vp8', 'vp9', 'av1', 'opus', 'vorbis'},
+    'm4a': {'aac'},
+    'mp3': {'mp3'},
+    'opus': {'opus'},
+    'ogg': {'opus', 'vorbis'}
+}
+
+# Codecs a container usually holds, for sources that don't report them
+NATIVE_CODECS = {
+    'mp4': ('h264', 'aac'),
+    'webm': ('vp9', 'opus'),
+    'm4a': (None, 'aac'),
+    'mp3': (None, 'mp3'),
+    'opus': (None, 'opus'),
+    'ogg': (None, 'vorbis')
+}
+
+# ffmpeg muxer and flags for writing each container to a pipe
+MUXERS = {
+    'mp4': ['-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov'],
+    'm4a': ['-f', 'ipod', '-movflags', 'frag_keyframe+empty_moov'],
+    'webm': ['-f', 'webm'],
+    'mp3': ['-f', 'mp3'],
+    'opus': ['-f', 'opus'],
+    'ogg': ['-f', 'ogg']
+}
+
+ENCODERS = {
+    'mp3': ['-c:a', 'libmp3lame', '-b:a', '192k', '-ar', '44100'],
+    'aac': ['-c:a', 'aac', '-b:a', '192k'],
+    'opus': ['-c:a', 'libopus', '-b:a', '160k'],
+    'vorbis': ['-c:a', 'libvorbis', '-q:a', '5'],
+    'h264': ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23'],
+    'vp9': ['-c:v', 'libvpx-vp9', '-deadline', 'realtime', '-cpu-used', '8']
+}
+
+# Audio delivery modes: the source codec as is, or a specific format
+NATIVE_AUDIO = 'native'
+AUDIO_FORMATS = (NATIVE_AUDIO, 'm4a', 'opus', 'mp3')
+
+# What an audio-only file is called in each container it can arrive in
+AUDIO_CONTAINERS = {'m4a': 'm4a', 'mp4': 'm4a', 'mp3': 'mp3', 'webm': 'webm', 'opus': 'opus', 'ogg': 'ogg'}
+
+# Container each audio codec is copied into when it has to be split from video
+NATIVE_AUDIO_CONTAINERS = {'aac': 'm4a', 'opus': 'opus', 'vorbis': 'ogg', 'mp3': 'mp3'}
+
+# Codecs in order of how widely they play back, for picking among native sources
+AUDIO_COMPATIBILITY = ('aac', 'mp3', 'opus', 'vorbis')
+
+MIMETYPES = {
+    'mp4': 'video/mp4',
+    'webm': 'video/webm',
+    'm4a': 'audio/mp4',
+    'mp3': 'audio/mpeg',
+    'opus': 'audio/ogg',
+    'ogg': 'audio/ogg'
+}
+
+# Rough CPU seconds spent per second of media for each kind of work
+CPU_COST = {
+    DIRECT: 0.0,
+    REMUX: 0.01,
+    'audio': 0.05,
+    'video': 1.0
+}
+
+class ConversionUnavailableError(Exception):
+    """Raised when the requested audio format needs ffmpeg and this server has none"""
+
+def normalize_codec(codec):
+    """Map codec strings such as 'avc1.64001F' or 'mp4a.40.2' to a short name"""
+    if not codec or codec == 'none':
+        return None
+    codec = codec.lower()
+    for prefix, name in (('avc', 'h264'), ('h264', 'h264'), ('hev', 'hevc'), ('hvc', 'hevc'), ('av01', 'av1'), ('av1', 'av1'),
+                         ('vp09', 'vp9'), ('vp9', 'vp9'), ('vp8', 'vp8'), ('mp4a', 'aac'), ('aac', 'aac'),
+                         ('opus', 'opus'), ('vorbis', 'vorbis'), ('mp3', 'mp3')):
+        if codec.startswith(prefix):
+            return name
+    return codec
+
+class Candidate:
+    """One fetchable format as seen by a backend"""
+
+    def __init__(self, ref, container, height=None, has_video=True, has_audio=True, vcodec=None, acodec=None, bitrate=None, url=None, headers=None):
+        # ref is whatever the backend needs to fetch this format again
+        self.ref = ref
+        self.container = (container or '').lower()
+        self.height = height
+        self.has_video = has_video
+        self.has_audio = has_audio
+        native_video, native_audio = NATIVE_CODECS.get(self.container, (None, None))
+        self.vcodec = normalize_codec(vcodec) or (native_video if has_video else None)
+        self.acodec = normalize_codec(acodec) or (native_audio if has_audio else None)
+        self.bitrate = bitrate or 0
+        self.url = url
+        self.headers = headers
+
+    @property
+    def progressive(self):
+        return self.has_video and self.has_audio
+
+    def __repr__(self):
+        return f"<Candidate {self.container} {self.height or '-'}p v={self.vcodec} a={self.acodec}>"
+
+class Plan:
+    """The chosen source(s) and the work needed to deliver them"""
+
+    def __init__(self, action, sources, container, is_audio, duration=None, video_codec=None, audio_codec=None):
+        self.action = action
+        self.sources = sources
+        self.container = container
+        self.is_audio = is_audio
+        self.duration = duration
+        # Encoders used when action is TRANSCODE; None means that stream is copied
+        self.video_codec = video_codec
+        self.audio_codec = audio_codec
+
+    @property
+    def needs_ffmpeg(self):
+        return self.action != DIRECT
+
+    @property
+    def mimetype(self):
+        if self.is_audio and self.container == 'webm':
+            return 'audio/webm'
+        return MIMETYPES.get(self.container, 'application/octet-stream')
+
+    @property
+    def cost_per_second(self):
+        """Estimated CPU seconds per second of media"""
+        if self.action != TRANSCODE:
+            return CPU_COST[self.action]
+        return CPU_COST['video'] if self.video_codec else CPU_COST['audio']
+
+    @property
+    def cpu_cost(self):
+        """Estimated CPU seconds for the whole item, or None when the duration is unknown"""
+        if self.duration is None:
+            return None if self.action != DIRECT else 0.0
+        return self.cost_per_second * self.duration
+
+    def ffmpeg_args(self):
+        """Output arguments for ffmpeg; inputs are numbered in the order of self.sources"""
+        args = []
+        if len(self.sources) == 2:
+            args += ['-map', '0:v:0', '-map', '1:a:0']
+        if self.is_audio:
+            args.append('-vn')
+        if self.video_codec:
+            args += ENCODERS.get(self.video_codec, ['-c:v', self.video_codec])
+        elif not self.is_audio:
+            args += ['-c:v', 'copy']
+        if self.audio_codec:
+            args += ENCODERS.get(self.audio_codec, ['-c:a', self.audio_codec])
+        else:
+            args += ['-c:a', 'copy']
+        return args + MUXERS.get(self.container, ['-f', self.container])
+
+    def describe(self):
+        cost = self.cpu_cost
+        estimate = f"~{cost:.1f}s CPU" if cost is not None else f"~{self.cost_per_second:.2f}s CPU per media second"
+        quality = 'audio' if self.is_audio else f"{self.sources[0].height or '?'}p"
+        return f"{self.action} {quality} {self.container} from {self.sources} ({estimate})"
+
+def _fits(container, *codecs):
+    allowed = CONTAINER_CODECS.get(container, set())
+    return all(codec in allowed for codec in codecs if codec)
+
+def _wanted_height(resolution, heights):
+    if resolution == 'highest':
+        return max(heights)
+    if resolution == 'lowest':
+        return min(heights)
+    match = re.match(r'(\d+)p?$', str(resolution or ''))
+    if match:
+        return int(match.group(1))
+    return DEFAULT_HEIGHT
+
+def _closest_height(resolution, heights):
+    """Highest available height that doesn't exceed the request, else the lowest available"""
+    wanted = _wanted_height(resolution, heights)
+    suitable = [h for h in heights if h <= wanted]
+    return max(suitable) if suitable else min(heights)
+
+def _negotiate_video(candidates, resolution, container, duration, allow_ffmpeg):
+    with_video = [c for c in candidates if c.has_video and c.height]
+    if not allow_ffmpeg:
+        # Only formats that can be sent untouched are usable
+        with_video = [c for c in with_video if c.progressive]
+    if not with_video:
+        return None
+    height = _closest_height(resolution, {c.height for c in with_video})
+    at_height = [c for c in with_video if c.height == height]
+
+    progressive = [c for c in at_height if c.progressive]
+    # Natively matching containers first, then the higher bitrate
+    progressive.sort(key=lambda c: (c.container != container, -c.bitrate))
+
+    for c in progressive:
+        if c.container == container or not allow_ffmpeg:
+            return Plan(DIRECT, [c], c.container, False, duration)
+    for c in progressive:
+        if _fits(container, c.vcodec, c.acodec):
+            return Plan(REMUX, [c], container, False, duration)
+
+    audio = sorted((c for c in candidates if c.has_audio and not c.has_video), key=lambda c: -c.bitrate)
+    video_only = sorted((c for c in at_height if not c.has_audio), key=lambda c: (c.container != container, -c.bitrate))
+    if video_only and audio:
+        for v in video_only:
+            # Prefer the container's native audio codec (AAC for MP4) over a higher bitrate
+            for a in sorted(audio, key=lambda c: (not _fits(container, v.vcodec, c.acodec), c.acodec != NATIVE_CODECS[container][1])):
+                if _fits(container, v.vcodec, a.acodec):
+                    return Plan(REMUX, [v, a], container, False, duration)
+
+    # Nothing can be copied into the container, so re-encode what doesn't fit
+    if progressive:
+        sources = [progressive[0]]
+    elif video_only and audio:
+        sources = [video_only[0], audio[0]]
+    else:
+        return None
+    video_codec = None if _fits(container, sources[0].vcodec) else NATIVE_CODECS[container][0]
+    audio_codec = None if _fits(container, sources[-1].acodec) else NATIVE_CODECS[container][1]
+    return Plan(TRANSCODE, sources, container, False, duration, video_codec=video_codec, audio_codec=audio_codec)
+
+def _negotiate_native_audio(audio_only, pool, duration, allow_ffmpeg):
+    """Deliver the source audio codec untouched, in whatever proper container is cheapest"""
+    ranked = sorted(audio_only, key=lambda c: (AUDIO_COMPATIBILITY.index(c.acodec) if c.acodec in AUDIO_COMPATIBILITY else len(AUDIO_COMPATIBILITY), -c.bitrate))
+    for c in ranked:
+        if c.container in AUDIO_CONTAINERS:
+            return Plan(DIRECT, [c], AUDIO_CONTAINERS[c.container], True, duration)
+    if allow_ffmpeg:
+        # The audio only comes muxed with video, so copy the track out
+        for c in pool:
+            if c.acodec in NATIVE_AUDIO_CONTAINERS:
+                return Plan(REMUX, [c], NATIVE_AUDIO_CONTAINERS[c.acodec], True, duration)
+    c = pool[0]
+    return Plan(DIRECT, [c], AUDIO_CONTAINERS.get(c.container, c.container) if not c.has_video else c.container, True, duration)
+
+def _negotiate_audio(candidates, audio_format, duration, allow_ffmpeg):
+    audio_only = sorted((c for c in candidates if c.has_audio and not c.has_video), key=lambda c: -c.bitrate)
+    # Progressive formats are a last resort: smallest first since the video is thrown away
+    progressive = sorted((c for c in candidates if c.progressive), key=lambda c: c.height or 0)
+    pool = audio_only + progressive
+    if not pool:
+        return None
+
+    if audio_format == NATIVE_AUDIO:
+        return _negotiate_native_audio(audio_only, pool, duration, allow_ffmpeg)
+
+    for c in audio_only:
+        if AUDIO_CONTAINERS.get(c.container) == audio_format and _fits(audio_format, c.acodec):
+            return Plan(DIRECT, [c], audio_format, True, duration)
+    if not allow_ffmpeg:
+        # Sending the source audio instead would ignore what the client asked for
+        raise ConversionUnavailableError(f"{audio_format.upper()} conversion is unavailable on this server")
+    for c in pool:
+        if _fits(audio_format, c.acodec):
+            return Plan(REMUX, [c], audio_format, True, duration)
+
+    return Plan(TRANSCODE, [pool[0]], audio_format, True, duration, audio_codec=NATIVE_CODECS[audio_format][1])
+
+def negotiate(candidates, is_audio, resolution='highest', container='mp4', audio_format=NATIVE_AUDIO, duration=None, allow_ffmpeg=True):
+    """Choose how to deliver the request from the candidates a backend offers
+
+    Returns a Plan, or None if nothing usable was offered. Raises
+    ConversionUnavailableError if the requested audio format needs ffmpeg
+    and allow_ffmpeg is False.
+    """
+    candidates = list(candidates)
+    if is_audio:
+        plan = _negotiate_audio(candidates, audio_format, duration, allow_ffmpeg)
+    else:
+        plan = _negotiate_video(candidates, resolution, container, duration, allow_ffmpeg)
+    if plan:
+        logger.info(f"Negotiated {plan.describe()}")
+    return plan
+
+# ---------------------------------------------------------------------------
+# Backend adapters
+# ---------------------------------------------------------------------------
+
+def _parse_height(text):
+    match = re.search(r'(\d{3,4})p', text or '')
+    return int(match.group(1)) if match else None
+
+def from_9xbuddy(video_info):
+    """Candidates from the format list scraped off 9xbuddy"""
+    candidates = []
+    for fmt in video_info.get('formats', []):
+        label = f"{fmt.get('quality', '')} {fmt.get('format', '')}".lower()
+        container = fmt.get('format', '').strip().lower()
+        audio_only = container in ('mp3', 'm4a', 'opus') or 'audio' in label
+        if 'audio' in container:
+            container = 'm4a'
+        candidates.append(Candidate(
+            fmt,
+            container,
+            height=None if audio_only else _parse_height(fmt.get('quality')),
+            has_video=not audio_only,
+            has_audio='no audio' not in label and 'video only' not in label,
+            url=video_info.get('download_links', {}).get(fmt.get('key'))
+        ))
+    return candidates
+
+def _parse_kbps(text):
+    match = re.match(r'(\d+)', str(text or ''))
+    return int(match.group(1)) if match else 0
+
+def from_pytube(streams):
+    """Candidates from a pytube StreamQuery"""
+    candidates = []
+    for stream in streams:
+        candidates.append(Candidate(
+            stream,
+            stream.subtype,
+            height=_parse_height(stream.resolution),
+            has_video=stream.includes_video_track,
+            has_audio=stream.includes_audio_track,
+            vcodec=getattr(stream, 'video_codec', None),
+            acodec=getattr(stream, 'audio_codec', None),
+            bitrate=_parse_kbps(stream.abr) if not stream.includes_video_track else getattr(stream, 'bitrate', 0),
+            url=stream.url
+        ))
+    return candidates
+
+def from_ytdlp(formats):
+    """Candidates from yt-dlp's info['formats'], skipping fragmented protocols we can't relay"""
+    candidates = []
+    for fmt in formats:
+        if fmt.get('protocol', 'https') not in ('http', 'https'):
+            continue
+        has_video = fmt.get('vcodec') not in (None, 'none') or (fmt.get('vcodec') is None and bool(fmt.get('height')))
+        has_audio = fmt.get('acodec') not in (None, 'none') or (fmt.get('acodec') is None and not has_video)
+        candidates.append(Candidate(
+            fmt,
+            fmt.get('ext'),
+            height=fmt.get('height') if has_video else None,
+            has_video=has_video,
+            has_audio=has_audio,
+            vcodec=fmt.get('vcodec'),
+            acodec=fmt.get('acodec'),
+            bitrate=fmt.get('abr') if not has_video else fmt.get('tbr'),
+            url=fmt.get('url'),
+            headers=fmt.get('http_headers')
+        ))
+    return candidates
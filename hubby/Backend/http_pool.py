@@ -0,0 +1,62 @@
+import os
+import random
+import logging
+import threading
+import requests
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger("http_pool")
+
+# Connection pool settings (can be overridden through the environment)
+POOL_MAXSIZE = int(os.environ.get('NEOBYTE_HTTP_POOL_SIZE', 16))
+RETRIES = int(os.environ.get('NEOBYTE_HTTP_RETRIES', 3))
+BACKOFF_FACTOR = float(os.environ.get('NEOBYTE_HTTP_BACKOFF', 0.5))
+
+class JitterRetry(Retry):
+    """Retry policy whose exponential backoff is spread out with random jitter"""
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        if backoff <= 0:
+            return backoff
+        return backoff + random.uniform(0, backoff)
+
+def _build_session():
+    retry = JitterRetry(
+        total=RETRIES,
+        connect=RETRIES,
+        read=RETRIES,
+        status=RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_session(url):
+    """Return the keep-alive session shared by every request to url's host"""
+    host = urlparse(url).netloc.lower()
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = _build_session()
+            _sessions[host] = session
+        return session
+
+def get(url, **kwargs):
+    """requests.get through the pooled session for the URL's host"""
+    return get_session(url).get(url, **kwargs)
+
+def stats():
+    with _sessions_lock:
+        return {"hosts": len(_sessions)}
@@ -0,0 +1,157 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cancellation
+import progress
+import transcode
+import workspace
+
+logger = logging.getLogger("jobs")
+
+# Job settings (can be overridden through the environment)
+JOB_WORKERS = int(os.environ.get('NEOBYTE_JOB_WORKERS', 4))
+JOB_QUEUE_LIMIT = int(os.environ.get('NEOBYTE_JOB_QUEUE_LIMIT', 100))
+JOB_RETENTION = float(os.environ.get('NEOBYTE_JOB_RETENTION', 3600))
+# Jobs have no client waiting on them, so they get a longer budget than requests (0 disables)
+JOB_BUDGET = float(os.environ.get('NEOBYTE_JOB_BUDGET', 900))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+
+class QueueFullError(Exception):
+    """Raised when too many jobs are already waiting for a worker"""
+
+class Job:
+    def __init__(self, kind, params=None):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.params = params or {}
+        self.state = QUEUED
+        self.error = None
+        self.status_code = None
+        self.artifact_path = None
+        self.download_name = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.workspace = workspace.get_manager().create(self.id)
+        self.work_dir = self.workspace.path
+        self.progress = progress.create(self.id)
+
+    def to_dict(self):
+        data = {
+            'id': self.id,
+            'kind': self.kind,
+            'state': self.state,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'ffmpeg_cpu_seconds': round(transcode.get_scheduler().cpu_time(self.id), 3),
+        }
+        if self.state == FINISHED:
+            data['download_name'] = self.download_name
+            data['artifact_url'] = f"/jobs/{self.id}/artifact"
+        if self.state == FAILED:
+            data['error'] = self.error
+        data['progress_url'] = f"/progress/{self.id}"
+        return data
+
+class JobManager:
+    """Runs download jobs on a bounded worker pool and keeps their artifacts until they expire"""
+
+    def __init__(self, workers=JOB_WORKERS, queue_limit=JOB_QUEUE_LIMIT, retention=JOB_RETENTION):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='neobyte-job')
+        self.queue_limit = queue_limit
+        self.retention = retention
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._janitor = None
+
+    def pending(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.state == QUEUED)
+
+    def submit(self, kind, fn, params=None):
+        """Queue fn(job) for execution; fn must return a pipelines.MediaResult"""
+        self.expire()
+        if self.pending() >= self.queue_limit:
+            raise QueueFullError("Too many downloads are queued, please try again shortly")
+
+        job = Job(kind, params)
+        with self._lock:
+            self._jobs[job.id] = job
+        self.executor.submit(self._run, job, fn)
+        logger.info(f"Queued {kind} job {job.id}")
+        return job
+
+    def _run(self, job, fn):
+        job.state = RUNNING
+        job.started_at = time.time()
+        try:
+            with cancellation.deadline(JOB_BUDGET):
+                result = fn(job)
+            artifact_path = os.path.join(job.work_dir, 'artifact')
+            result.save(artifact_path)
+            job.artifact_path = artifact_path
+            # Only the artifact is kept until the job expires, so hold no more of the quota than it uses
+            job.workspace.unreserve(max(0, job.workspace.reserved - os.path.getsize(artifact_path)))
+            job.download_name = result.download_name
+            job.state = FINISHED
+            if not job.progress.finished:
+                job.progress.finish()
+            logger.info(f"Job {job.id} finished: {job.download_name}")
+        except Exception as e:
+            job.error = getattr(e, 'message', None) or str(e)
+            job.status_code = getattr(e, 'status', 500)
+            job.state = FAILED
+            job.progress.finish(job.error)
+            # A failed job has nothing to serve, so its scratch space goes back right away
+            job.workspace.release()
+            logger.error(f"Job {job.id} failed: {job.error}")
+        finally:
+            job.finished_at = time.time()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def expire(self):
+        """Forget finished jobs older than the retention period and release their workspaces"""
+        cutoff = time.time() - self.retention
+        with self._lock:
+            expired = [job for job in self._jobs.values() if job.finished_at and job.finished_at < cutoff]
+            for job in expired:
+                del self._jobs[job.id]
+        for job in expired:
+            job.workspace.release()
+
+    def _janitor_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.expire()
+            except Exception as e:
+                logger.error(f"Job expiry failed: {str(e)}")
+
+    def start_janitor(self, interval=workspace.JANITOR_INTERVAL):
+        """Expire finished jobs periodically, so their artifacts go even when no new jobs arrive"""
+        if self._janitor is None:
+            self._janitor = threading.Thread(target=self._janitor_loop, args=(interval,), daemon=True, name='neobyte-job-janitor')
+            self._janitor.start()
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_manager():
+    """Return the process-wide job manager, creating it on first use"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+            _manager.start_janitor()
+        return _manager
@@ -0,0 +1,213 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger("media_cache")
+
+# Metadata cache settings (can be overridden through the environment)
+INFO_CACHE_TTL = float(os.environ.get('NEOBYTE_INFO_CACHE_TTL', 600))
+INFO_CACHE_SIZE = int(os.environ.get('NEOBYTE_INFO_CACHE_SIZE', 256))
+
+# Direct link cache settings
+LINK_CACHE_SIZE = int(os.environ.get('NEOBYTE_LINK_CACHE_SIZE', 256))
+LINK_DEFAULT_TTL = float(os.environ.get('NEOBYTE_LINK_DEFAULT_TTL', 300))
+LINK_EXPIRY_MARGIN = float(os.environ.get('NEOBYTE_LINK_EXPIRY_MARGIN', 60))
+LINK_REFRESH_AHEAD = float(os.environ.get('NEOBYTE_LINK_REFRESH_AHEAD', 600))
+LINK_HOT_HITS = int(os.environ.get('NEOBYTE_LINK_HOT_HITS', 3))
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after a fixed time-to-live"""
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max(1, max_size)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0
+            }
+
+def parse_link_expiry(url):
+    """Return the expiry timestamp embedded in a signed CDN URL, if any"""
+    try:
+        query = parse_qs(urlparse(url).query)
+    except Exception:
+        return None
+
+    # googlevideo and most CDNs use a decimal unix timestamp
+    for param in ('expire', 'expires', 'Expires', 'exp'):
+        if param in query:
+            try:
+                return float(query[param][0])
+            except ValueError:
+                pass
+
+    # Instagram/Facebook CDNs use a hexadecimal "oe" parameter
+    if 'oe' in query:
+        try:
+            return float(int(query['oe'][0], 16))
+        except ValueError:
+            pass
+
+    return None
+
+class LinkCache:
+    """Caches resolved direct media URLs until shortly before they expire
+
+    Hot entries that get close to expiry are re-resolved in the background
+    while the still-valid links keep being served (stale-while-revalidate).
+    """
+
+    def __init__(self, max_size=LINK_CACHE_SIZE, default_ttl=LINK_DEFAULT_TTL,
+                 margin=LINK_EXPIRY_MARGIN, refresh_ahead=LINK_REFRESH_AHEAD, hot_hits=LINK_HOT_HITS):
+        self.max_size = max(1, max_size)
+        self.default_ttl = default_ttl
+        self.margin = margin
+        self.refresh_ahead = refresh_ahead
+        self.hot_hits = hot_hits
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    def _expiry_for(self, links):
+        now = time.time()
+        expiries = [e for e in (parse_link_expiry(u) for u in links.values()) if e]
+        if not expiries:
+            return now + self.default_ttl
+        # The whole set is only as fresh as its shortest-lived link
+        return min(expiries) - self.margin
+
+    def lifetime(self, links):
+        """Seconds a set of links would be served from the cache if stored now"""
+        return self._expiry_for(links) - time.time()
+
+    def get(self, key, refresher=None):
+        """Return cached links for key, scheduling a background refresh when hot and nearly expired"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry["expires_at"] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            entry["hits"] += 1
+            self._entries.move_to_end(key)
+            self.hits += 1
+            links = entry["links"]
+            needs_refresh = (
+                refresher is not None
+                and entry["expires_at"] - now <= self.refresh_ahead
+                and entry["hits"] >= self.hot_hits
+                and key not in self._refreshing
+            )
+            if needs_refresh:
+                self._refreshing.add(key)
+
+        if needs_refresh:
+            threading.Thread(target=self._refresh, args=(key, refresher), daemon=True).start()
+        return links
+
+    def _refresh(self, key, refresher):
+        try:
+            logger.info(f"Refreshing direct links for {key} in the background")
+            links = refresher()
+            if links:
+                self.set(key, links)
+                with self._lock:
+                    self.refreshes += 1
+        except Exception as e:
+            logger.error(f"Error refreshing direct links for {key}: {str(e)}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def set(self, key, links):
+        if not links:
+            return
+        expires_at = self._expiry_for(links)
+        if expires_at <= time.time():
+            return
+        with self._lock:
+            previous = self._entries.get(key)
+            self._entries[key] = {
+                "links": dict(links),
+                "expires_at": expires_at,
+                # Keep popularity across refreshes so hot entries stay hot
+                "hits": previous["hits"] if previous else 0
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "hit_ratio": self.hits / lookups if lookups else 0.0
+            }
+
+# Title and format listings keyed by canonical video ID
+video_info_cache = TTLCache(INFO_CACHE_TTL, INFO_CACHE_SIZE)
+
+# Signed direct media URLs keyed by canonical video ID
+download_link_cache = LinkCache()
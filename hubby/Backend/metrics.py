@@ -0,0 +1,202 @@
+"""
+Prometheus-compatible metrics without the prometheus_client dependency.
+
+Counters and histograms are updated where the work happens; gauges that
+mirror state other modules already track (Chrome sessions, scratch disk,
+caches) are registered with collect() and read at scrape time.
+render() produces the text exposition format served by GET /metrics.
+"""
+
+import math
+import logging
+import threading
+
+logger = logging.getLogger("metrics")
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+THROUGHPUT_BUCKETS = (64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple((name, labels[name]) for name in self.label_names)
+
+    def samples(self):
+        """Return (suffix, labels, value) triples for the exposition"""
+        raise NotImplementedError
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        # An unlabelled counter is exported as 0 before its first increment
+        self._values = {} if self.label_names else {(): 0}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [('', key, value) for key, value in self._values.items()]
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        result = []
+        with self._lock:
+            for key, (counts, total, count) in self._series.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    result.append(('_bucket', key + (('le', _format_value(float(bound))),), cumulative))
+                result.append(('_sum', key, total))
+                result.append(('_count', key, count))
+        return result
+
+class Collected(Metric):
+    """A metric whose value is read from elsewhere whenever it is scraped
+
+    fn returns either a number or a list of (labels dict, number) pairs.
+    """
+
+    def __init__(self, name, help_text, kind, fn):
+        super().__init__(name, help_text)
+        self.kind = kind
+        self.fn = fn
+
+    def samples(self):
+        value = self.fn()
+        if isinstance(value, (int, float)):
+            return [('', (), value)]
+        return [('', tuple(sorted(labels.items())), number) for labels, number in value]
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                # One broken collector must not take the whole scrape down
+                logger.error(f"Error collecting {metric.name}: {str(e)}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+def counter(name, help_text, labels=()):
+    return REGISTRY.register(Counter(name, help_text, labels))
+
+def histogram(name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram(name, help_text, labels, buckets))
+
+def collect(name, help_text, fn, kind='gauge'):
+    return REGISTRY.register(Collected(name, help_text, kind, fn))
+
+def render():
+    return REGISTRY.render()
+
+# Metrics updated by the pipeline modules themselves
+REQUEST_DURATION = histogram(
+    'neobyte_http_request_duration_seconds',
+    'Time until a response (or the first byte of a streamed download) is ready, per route',
+    ('route', 'method', 'status')
+)
+BACKEND_ATTEMPTS = counter(
+    'neobyte_backend_attempts_total',
+    'Extraction attempts per backend by outcome (success, failure, or released without a verdict)',
+    ('platform', 'backend', 'outcome')
+)
+BACKEND_DURATION = histogram(
+    'neobyte_backend_attempt_duration_seconds',
+    'Duration of extraction attempts that succeeded or failed',
+    ('platform', 'backend', 'outcome')
+)
+BYTES_SENT = counter(
+    'neobyte_bytes_sent_total',
+    'Media bytes sent to clients, by whether they came from a stream or a file',
+    ('source',)
+)
+UPSTREAM_BYTES = counter(
+    'neobyte_upstream_bytes_total',
+    'Media bytes fetched from upstream servers'
+)
+TRANSFER_THROUGHPUT = histogram(
+    'neobyte_transfer_throughput_bytes_per_second',
+    'Average throughput of each streamed download',
+    buckets=THROUGHPUT_BUCKETS
+)
+FFMPEG_WAIT = histogram(
+    'neobyte_ffmpeg_queue_wait_seconds',
+    'Time ffmpeg work waited for a scheduler slot'
+)
+FFMPEG_RUN = histogram(
+    'neobyte_ffmpeg_run_seconds',
+    'Wall-clock time ffmpeg work held a scheduler slot',
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800)
+)
@@ -0,0 +1,848 @@
+"""
+Download pipelines shared by the HTTP routes and the background job workers.
+
+Each fetch_* function runs the backend chain for one platform and returns a
+MediaResult, which is either a file on disk or an open upstream byte stream.
+Failures that should reach the user are raised as PipelineError.
+"""
+
+import os
+import re
+import queue
+import logging
+import shutil
+import threading
+from urllib.parse import urlparse
+from flask import send_file
+import artifact_cache
+import singleflight
+import browser_downloader
+import cancellation
+import progress as progress_events
+import formats
+import metrics
+import scoreboard
+import streaming
+import tracing
+import transcode
+from transcode import FFMPEG_PATH
+
+logger = logging.getLogger('neobyte')
+
+# Hedged extraction settings (can be overridden through the environment)
+HEDGE_BY_DEFAULT = os.environ.get('NEOBYTE_HEDGE', '0').lower() in ('1', 'true', 'yes', 'on')
+HEDGE_DELAY = float(os.environ.get('NEOBYTE_HEDGE_DELAY', 8))
+
+# Seconds a request may spend preparing a download before it is abandoned (0 disables)
+REQUEST_BUDGET = float(os.environ.get('NEOBYTE_REQUEST_BUDGET', 120))
+# yt-dlp's per-socket timeout, further capped by the remaining budget
+YTDLP_SOCKET_TIMEOUT = 20
+
+class PipelineError(Exception):
+    """A download failure with a user-facing message and HTTP status"""
+
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+class MediaResult:
+    """The output of a pipeline: a local file or a live upstream stream"""
+
+    def __init__(self, download_name, path=None, stream=None, mimetype=None, content_length=None, cleanup_paths=(), progress=None, owned=True):
+        self.download_name = clean_filename(download_name)
+        self.progress = progress
+        self.path = path
+        # Files that belong to someone else (e.g. the artifact cache) are never deleted
+        self.owned = owned
+        self.stream = stream
+        self.mimetype = mimetype
+        self.content_length = content_length
+        self.cleanup_paths = list(cleanup_paths)
+
+    def cleanup(self):
+        paths = list(self.cleanup_paths)
+        if self.path and self.owned:
+            paths.append(self.path)
+        for path in paths:
+            try:
+                if path and os.path.exists(path):
+                    os.remove(path)
+                    logger.info(f"Removed temporary file: {path}")
+            except Exception as e:
+                logger.error(f"Error removing temporary file: {e}")
+
+    def to_response(self):
+        """Send the result to the client and clean up once the response is closed"""
+        if self.stream is not None:
+            response = streaming.stream_response(self.stream, self.download_name, mimetype=self.mimetype, content_length=self.content_length)
+        else:
+            response = send_file(
+                self.path,
+                as_attachment=True,
+                download_name=self.download_name,
+                conditional=False
+            )
+            # send_file marks the response direct_passthrough, and Werkzeug then skips
+            # call_on_close callbacks, leaking the workspace and its reservation
+            response.direct_passthrough = False
+            size = os.path.getsize(self.path)
+            response.call_on_close(lambda: metrics.BYTES_SENT.inc(size, source='file'))
+        response.call_on_close(self.cleanup)
+        if self.progress and self.stream is None:
+            # Local files are fully produced by now; streams report completion themselves
+            response.call_on_close(self._finish_progress)
+        return response
+
+    def _finish_progress(self):
+        if not self.progress.finished:
+            self.progress.finish()
+
+    def save(self, dest_path):
+        """Materialize the result at dest_path (used by background jobs)"""
+        if self.stream is not None:
+            try:
+                with open(dest_path, 'wb') as f:
+                    for chunk in self.stream:
+                        f.write(chunk)
+            finally:
+                close = getattr(self.stream, 'close', None)
+                if close:
+                    close()
+        elif self.owned:
+            os.replace(self.path, dest_path)
+            self.path = None
+        else:
+            shutil.copyfile(self.path, dest_path)
+        self.cleanup()
+        return dest_path
+
+def clean_filename(name):
+    # Replace invalid characters in filename
+    return name.replace('/', '_').replace('\\', '_').replace(':', '_').replace('*', '_').replace('?', '_').replace('"', '_').replace('<', '_').replace('>', '_').replace('|', '_')
+
+def canonical_media_id(platform, url):
+    """Stable identifier for a media item regardless of how its URL was written"""
+    if platform == 'youtube':
+        video_id = browser_downloader.get_video_id(url)
+        if video_id:
+            return f"youtube:{video_id}"
+    parsed = urlparse(url)
+    parts = [p for p in parsed.path.split('/') if p]
+    if platform == 'instagram':
+        # /p/<code>/, /reel/<code>/, /stories/<user>/<id>/
+        for marker in ('p', 'reel', 'reels', 'tv', 'stories'):
+            if marker in parts and parts.index(marker) + 1 < len(parts):
+                return f"instagram:{'/'.join(parts[parts.index(marker) + 1:])}"
+    if platform == 'twitter' and 'status' in parts and parts.index('status') + 1 < len(parts):
+        return f"twitter:{parts[parts.index('status') + 1]}"
+    host = parsed.netloc.lower().replace('www.', '')
+    return f"{platform}:{host}{parsed.path.rstrip('/')}"
+
+def from_cache(cache_key, progress=None):
+    """Return a MediaResult served from the artifact cache, or None on a miss"""
+    entry = artifact_cache.get_cache().lookup(cache_key)
+    if not entry:
+        return None
+    logger.info(f"Serving cached artifact: {entry['download_name']}")
+    if progress:
+        progress.set_stage('cached')
+    return MediaResult(entry['download_name'], path=entry['path'], content_length=entry['size'], progress=progress, owned=False)
+
+def admit_to_cache(cache_key, result):
+    """Copy a fresh result into the artifact cache; streams are teed as the client reads them"""
+    cache = artifact_cache.get_cache()
+    if result.stream is not None:
+        result.stream = cache.tee(cache_key, result.stream, result.download_name)
+    elif result.path:
+        cache.store_file(cache_key, result.path, result.download_name)
+    return result
+
+def timed_out():
+    """The error reported once a download has used up its deadline"""
+    return PipelineError('The download took too long and was stopped. Please try again later.', 504)
+
+def shared_fetch(flight_key, fetch, progress=None):
+    """Coalesce concurrent identical downloads so only one upstream fetch runs"""
+    try:
+        attachment = singleflight.run(flight_key, fetch, progress)
+    except cancellation.DeadlineExceeded:
+        raise timed_out()
+    return MediaResult(
+        attachment.download_name,
+        stream=attachment.stream,
+        mimetype=attachment.mimetype,
+        content_length=attachment.content_length,
+        progress=progress
+    )
+
+def _check_cancelled(d):
+    # Raising from a progress hook is how yt-dlp lets us abort a download
+    cancellation.check()
+
+def _progress_hooks(progress=None):
+    """yt-dlp progress hooks: live progress plus an abort once the work is cancelled"""
+    hooks = [_check_cancelled]
+    if progress:
+        hooks.insert(0, progress_events.ytdlp_hook(progress))
+    return hooks
+
+def _ytdlp_timeouts(ydl_opts):
+    """Keep each yt-dlp network call within what is left of the deadline"""
+    ydl_opts['socket_timeout'] = cancellation.timeout(YTDLP_SOCKET_TIMEOUT)
+
+def _ffmpeg_gate(ydl_opts, download_id, progress=None):
+    """Queue yt-dlp's ffmpeg postprocessors behind the shared transcode scheduler"""
+    gate = transcode.PostprocessorGate(progress.id if progress else download_id)
+    ydl_opts['postprocessor_hooks'] = [gate.hook]
+    return gate
+
+def _negotiate(candidates, is_audio, resolution, audio_format, duration):
+    """formats.negotiate for this server, which may not be able to run ffmpeg"""
+    try:
+        return formats.negotiate(candidates, is_audio, resolution, audio_format=audio_format, duration=duration, allow_ffmpeg=transcode.ffmpeg_available())
+    except formats.ConversionUnavailableError as e:
+        # Every backend would fail the same way, so it is not held against this one
+        raise PipelineError(str(e), 406)
+
+def _find_output(temp_dir, download_id, filename):
+    """Locate the file yt-dlp actually wrote, which may differ in extension"""
+    if os.path.exists(filename):
+        return filename
+    possible_files = [os.path.join(temp_dir, f) for f in os.listdir(temp_dir) if f.startswith(download_id) and not f.startswith('cookies_')]
+    if possible_files:
+        return possible_files[0]
+    return None
+
+# ---------------------------------------------------------------------------
+# YouTube
+# ---------------------------------------------------------------------------
+
+def youtube_via_browser(url, download_type, resolution, temp_dir, download_id, progress=None, audio_format=formats.NATIVE_AUDIO):
+    """Relay the 9xbuddy direct link, which bypasses bot detection"""
+    logger.info(f"Attempting to download with browser downloader: {url}")
+
+    is_audio = download_type == 'audio'
+    try:
+        stream, filename, error = browser_downloader.stream_with_quality(
+            url,
+            resolution,
+            is_audio,
+            progress=progress,
+            audio_format=audio_format
+        )
+    except formats.ConversionUnavailableError as e:
+        raise PipelineError(str(e), 406)
+
+    if not (stream and filename):
+        raise PipelineError(f"Browser downloader failed: {error}")
+
+    logger.info(f"Streaming with browser downloader: {filename}")
+    return MediaResult(filename, stream=stream, progress=progress)
+
+def youtube_via_pytube(url, download_type, resolution, temp_dir, download_id, progress=None, audio_format=formats.NATIVE_AUDIO):
+    from pytube import YouTube
+
+    logger.info(f"Attempting to download with pytube: {url}")
+
+    # Initialize pytube YouTube object
+    if progress:
+        yt = YouTube(url, on_progress_callback=progress_events.pytube_callback(progress))
+    else:
+        yt = YouTube(url)
+
+    with tracing.span('pytube.metadata'):
+        # Get video title for filename
+        video_title = re.sub(r'[\\/*?:"<>|]', "", yt.title)
+        streams = yt.streams
+    # pytube takes no timeout, so the deadline can only be enforced between its calls
+    cancellation.check()
+
+    plan = _negotiate(formats.from_pytube(streams), download_type == 'audio', resolution, audio_format, yt.length)
+    if not plan:
+        raise PipelineError('No suitable format found for the requested quality', 404)
+
+    # Relay (or pipe through ffmpeg) instead of downloading it first
+    filename = f"{video_title}.{plan.container}"
+    logger.info(f"Streaming with pytube: {filename}")
+    return MediaResult(filename, stream=transcode.open_plan(plan, progress), progress=progress)
+
+def youtube_via_ytdlp(url, download_type, resolution, temp_dir, download_id, progress=None, audio_format=formats.NATIVE_AUDIO):
+    """yt-dlp with special options to bypass bot detection"""
+    import yt_dlp
+
+    # Configure yt-dlp options with bypass settings
+    output_template = os.path.join(temp_dir, f'{download_id}.%(ext)s')
+
+    ydl_opts = {
+        'outtmpl': output_template,
+        'quiet': True,
+        'no_warnings': True,
+        'ffmpeg_location': FFMPEG_PATH,
+        # Try to bypass bot detection
+        'extractor_args': {
+            'youtube': {
+                'player_client': ['android', 'web'],
+                'player_skip': ['js', 'configs', 'webpage']
+            }
+        },
+        # Use a mobile user agent
+        'http_headers': {
+            'User-Agent': 'Mozilla/5.0 (Android 12; Mobile; rv:68.0) Gecko/68.0 Firefox/96.0',
+            'Accept-Language': 'en-US,en;q=0.5'
+        }
+    }
+    ydl_opts['progress_hooks'] = _progress_hooks(progress)
+    _ytdlp_timeouts(ydl_opts)
+
+    is_audio = download_type == 'audio'
+    # Extraction only lists the formats; formats.negotiate() makes the actual choice
+    if is_audio:
+        ydl_opts['format'] = 'bestaudio/best'
+        if audio_format != formats.NATIVE_AUDIO:
+            # Only used if the negotiated plan falls back to a local download
+            ydl_opts['postprocessors'] = [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': audio_format,
+                'preferredquality': '192',
+            }]
+    else:
+        ydl_opts['format'] = 'bestvideo*+bestaudio/best'
+
+    gate = _ffmpeg_gate(ydl_opts, download_id, progress)
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl, gate:
+        with tracing.span('ytdlp.extract'):
+            info = ydl.extract_info(url, download=False)
+        title = info.get('title', 'audio' if is_audio else 'video')
+
+        plan = _negotiate(formats.from_ytdlp(info.get('formats') or []), is_audio, resolution, audio_format, info.get('duration'))
+
+        # A single source is relayed, or piped through ffmpeg, without touching disk
+        if plan and len(plan.sources) == 1:
+            original_filename = f"{title}.{plan.container}"
+            logger.info(f"Streaming with yt-dlp: {original_filename}")
+            return MediaResult(original_filename, stream=transcode.open_plan(plan, progress), progress=progress)
+
+        if plan:
+            # Separate video and audio are merged by yt-dlp, which copies the streams
+            ydl.format_selector = ydl.build_format_selector('+'.join(source.ref['format_id'] for source in plan.sources))
+            ydl.params['merge_output_format'] = plan.container
+
+        # Only extraction counts against the deadline; the download runs to completion
+        with cancellation.transfer(), tracing.span('ytdlp.download'):
+            info = ydl.process_ie_result(info, download=True)
+        logger.info(f"Downloaded with yt-dlp to temporary location for immediate delivery to user")
+
+        # Determine the output filename
+        if is_audio and audio_format != formats.NATIVE_AUDIO:
+            filename = os.path.join(temp_dir, f"{download_id}.{audio_format}")
+        else:
+            filename = ydl.prepare_filename(info)
+
+        filename = _find_output(temp_dir, download_id, filename)
+        if not filename:
+            raise PipelineError('Failed to download file', 500)
+
+        # Get original filename
+        _, ext = os.path.splitext(filename)
+        return MediaResult(f"{title}{ext or '.mp4'}", path=filename, progress=progress)
+
+YOUTUBE_BACKENDS = [
+    ('browser', youtube_via_browser),
+    ('pytube', youtube_via_pytube),
+    ('yt-dlp', youtube_via_ytdlp),
+]
+
+def fetch_youtube(url, download_type, resolution, temp_dir, download_id, progress=None, audio_format=formats.NATIVE_AUDIO, hedge=HEDGE_BY_DEFAULT):
+    """Serve from cache, or join/start the single shared fetch for this video"""
+    is_audio = download_type == 'audio'
+    cache_key = artifact_cache.make_key(canonical_media_id('youtube', url), audio_format if is_audio else resolution, is_audio)
+    cached = from_cache(cache_key, progress)
+    if cached:
+        return cached
+    
+    return shared_fetch(cache_key, lambda: _youtube_backends(url, download_type, resolution, temp_dir, download_id, cache_key, progress, audio_format, hedge), progress)
+
+def _run_backends(platform, backends, attempt, progress=None):
+    """Try backends in scoreboard order, recording each outcome
+
+    Returns (result, errors); result is None when every backend failed.
+    """
+    board = scoreboard.get_scoreboard()
+    errors = []
+    for name, backend in board.order(platform, backends):
+        if cancellation.expired():
+            break
+        if progress:
+            progress.set_stage(f'extracting ({name})')
+        started_at = board.begin(platform, name)
+        try:
+            with tracing.span(f'backend.{name}'):
+                result = attempt(backend)
+        except Exception as e:
+            message = e.message if isinstance(e, PipelineError) else str(e)
+            logger.error(f"{name} backend failed: {message}")
+            if isinstance(e, cancellation.Cancelled) or (isinstance(e, PipelineError) and 400 <= e.status < 500):
+                # Private or missing content, or a budget spent elsewhere, says nothing about the backend's health
+                board.release(platform, name)
+            else:
+                board.record(platform, name, False, started_at)
+            errors.append(e)
+            continue
+        board.record(platform, name, True, started_at)
+        return result, errors
+    return None, errors
+
+def _discard(result):
+    """Throw away a result nobody will read: close its stream and delete its files"""
+    close = getattr(result.stream, 'close', None)
+    if close:
+        close()
+    result.cleanup()
+
+def _run_hedged(platform, backends, attempt, temp_dir, progress=None, delay=HEDGE_DELAY):
+    """Like _run_backends, but race the next backend against one that is slow to answer
+
+    attempt(backend, work_dir) runs in its own thread with its own scratch
+    directory. Once an attempt wins, the others are cancelled: their Chrome
+    sessions are closed, yt-dlp downloads aborted and their files removed.
+    """
+    board = scoreboard.get_scoreboard()
+    pending = list(board.order(platform, backends))
+    outcomes = queue.Queue()
+    trace = tracing.current()
+    tokens = {}
+    lock = threading.Lock()
+    winner = []
+
+    def run(name, backend, token):
+        work_dir = os.path.join(temp_dir, name)
+        os.makedirs(work_dir, exist_ok=True)
+        started_at = board.begin(platform, name)
+        result = error = None
+        with cancellation.bind(token), tracing.bind(trace):
+            try:
+                with tracing.span(f'backend.{name}'):
+                    result = attempt(backend, work_dir)
+            except Exception as e:
+                error = e
+
+        if result is not None:
+            with lock:
+                # Expiry reaches an attempt's token even once it is transferring; only other cancels count
+                won = not winner and (not token.cancelled or token.transferring and token.reason == cancellation.EXPIRED)
+                if won:
+                    winner.append(name)
+            if won:
+                board.record(platform, name, True, started_at)
+                outcomes.put((name, result, None))
+                return
+            # Finished after another backend already won
+            logger.info(f"Discarding late {name} result")
+            board.release(platform, name)
+            _discard(result)
+        elif token.cancelled:
+            board.release(platform, name)
+        elif isinstance(error, PipelineError) and 400 <= error.status < 500:
+            board.release(platform, name)
+        else:
+            board.record(platform, name, False, started_at)
+        shutil.rmtree(work_dir, ignore_errors=True)
+        outcomes.put((name, None, error))
+
+    def launch():
+        name, backend = pending.pop(0)
+        if progress:
+            progress.set_stage(f'extracting ({name})')
+        # Each attempt's token is a child of the request's, so it shares the deadline
+        tokens[name] = cancellation.CancelToken(parent=cancellation.current())
+        threading.Thread(target=run, args=(name, backend, tokens[name]), daemon=True, name=f'neobyte-hedge-{name}').start()
+
+    errors = []
+    answered = set()
+    launch()
+    running = 1
+    while running:
+        if cancellation.expired():
+            for token in tokens.values():
+                token.cancel(cancellation.EXPIRED)
+            # An attempt that reached its download before the deadline is left to finish
+            if not any(token.transferring for other, token in tokens.items() if other not in answered):
+                break
+            wait = None
+        else:
+            # Only one attempt in flight and more to try: give it `delay` seconds before hedging
+            wait = delay if running == 1 and pending else None
+            left = cancellation.remaining()
+            if left is not None:
+                wait = left if wait is None else min(wait, left)
+        try:
+            name, result, error = outcomes.get(timeout=wait)
+        except queue.Empty:
+            if cancellation.expired():
+                continue
+            logger.info(f"{platform} extraction still running after {delay}s, hedging with {pending[0][0]}")
+            launch()
+            running += 1
+            continue
+
+        answered.add(name)
+        running -= 1
+        if result is not None:
+            for other, token in tokens.items():
+                if other != name:
+                    token.cancel(f'{name} answered first')
+            return result, errors
+
+        message = error.message if isinstance(error, PipelineError) else str(error)
+        logger.error(f"{name} backend failed: {message}")
+        errors.append(error)
+        if not running and pending:
+            launch()
+            running += 1
+    return None, errors
+
+def _youtube_backends(url, download_type, resolution, temp_dir, download_id, cache_key, progress=None, audio_format=formats.NATIVE_AUDIO, hedge=False):
+    """Try each YouTube backend, best-performing first, until one produces media"""
+    if hedge:
+        result, errors = _run_hedged(
+            'youtube',
+            YOUTUBE_BACKENDS,
+            lambda backend, work_dir: backend(url, download_type, resolution, work_dir, download_id, progress=progress, audio_format=audio_format),
+            temp_dir,
+            progress
+        )
+    else:
+        result, errors = _run_backends(
+            'youtube',
+            YOUTUBE_BACKENDS,
+            lambda backend: backend(url, download_type, resolution, temp_dir, download_id, progress=progress, audio_format=audio_format),
+            progress
+        )
+    if result:
+        return admit_to_cache(cache_key, result)
+    if cancellation.expired():
+        raise timed_out()
+
+    last_error = errors[-1] if errors else None
+    if isinstance(last_error, PipelineError):
+        raise last_error
+    raise PipelineError(f"Error downloading {url}: {str(last_error)}", 500)
+
+# ---------------------------------------------------------------------------
+# Playlists
+# ---------------------------------------------------------------------------
+
+def is_playlist_url(url):
+    return bool(url) and 'list=' in url
+
+def _playlist_via_ytdlp(url, limit):
+    import yt_dlp
+
+    # A flat extraction lists the entries with one page fetch instead of one per video
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': 'in_playlist',
+        'skip_download': True,
+        'playlistend': limit,
+    }
+    _ytdlp_timeouts(ydl_opts)
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl, tracing.span('ytdlp.playlist'):
+        info = ydl.extract_info(url, download=False)
+
+    entries = []
+    for entry in info.get('entries') or []:
+        if not entry:
+            continue
+        video_url = entry.get('url') or entry.get('id')
+        if video_url and not video_url.startswith('http'):
+            video_url = f"https://www.youtube.com/watch?v={video_url}"
+        if video_url:
+            entries.append((video_url, entry.get('title')))
+    return info.get('title') or 'playlist', entries[:limit]
+
+def _playlist_via_pytube(url, limit):
+    from pytube import Playlist
+
+    playlist = Playlist(url)
+    with tracing.span('pytube.playlist'):
+        # video_urls pages through the playlist lazily; stop once the limit is reached
+        entries = []
+        for video_url in playlist.video_urls:
+            entries.append((video_url, None))
+            if len(entries) >= limit:
+                break
+            cancellation.check()
+        title = playlist.title
+    return title or 'playlist', entries
+
+def expand_playlist(url, limit):
+    """Return (title, [(video_url, title or None), ...]) for up to limit playlist entries"""
+    errors = []
+    for name, expand in (('yt-dlp', _playlist_via_ytdlp), ('pytube', _playlist_via_pytube)):
+        try:
+            title, entries = expand(url, limit)
+        except ImportError:
+            continue
+        except cancellation.DeadlineExceeded:
+            raise timed_out()
+        except Exception as e:
+            logger.error(f"{name} could not expand playlist {url}: {str(e)}")
+            errors.append(e)
+            continue
+        if entries:
+            logger.info(f"Expanded playlist {title!r} with {name}: {len(entries)} entries")
+            return title, entries
+    if errors:
+        raise PipelineError('Could not read the playlist. Please check the URL and try again.', 502)
+    raise PipelineError('The playlist is empty or private', 404)
+
+# ---------------------------------------------------------------------------
+# Instagram
+# ---------------------------------------------------------------------------
+
+def _instagram_fallback_title(url, download_id):
+    # Generate a title based on the type of content
+    if 'reel' in url.lower():
+        return f"Instagram_Reel_{download_id[:8]}"
+    elif 'stories' in url.lower():
+        return f"Instagram_Story_{download_id[:8]}"
+    return f"Instagram_Post_{download_id[:8]}"
+
+def instagram_via_browser(url, temp_dir, download_id, progress=None):
+    """Browser downloader (more reliable for Instagram)"""
+    logger.info(f"Attempting Instagram download with browser method: {url}")
+
+    file_path, error = browser_downloader.download_instagram_content(
+        url,
+        temp_dir,
+        f"{download_id}.mp4",
+        progress=progress
+    )
+
+    if not (file_path and os.path.exists(file_path)):
+        raise PipelineError(f"Browser downloader failed: {error}")
+
+    # Get content info
+    content_info = browser_downloader.get_instagram_info(url)
+    if content_info and content_info.get('title'):
+        original_filename = f"{content_info['title']}.mp4"
+    else:
+        original_filename = f"{_instagram_fallback_title(url, download_id)}.mp4"
+
+    return MediaResult(original_filename, path=file_path, progress=progress)
+
+def instagram_via_ytdlp(url, temp_dir, download_id, progress=None):
+    import yt_dlp
+
+    # Configure yt-dlp options for Instagram download with authentication support
+    output_template = os.path.join(temp_dir, f'{download_id}.%(ext)s')
+
+    ydl_opts = {
+        'outtmpl': output_template,
+        'quiet': True,
+        'no_warnings': True,
+        'ffmpeg_location': FFMPEG_PATH,
+        'format': 'best[height<=1080]/best',  # Limit to 1080p to avoid issues
+        'extract_flat': False,
+        'ignoreerrors': True,
+        'no_check_certificate': True,
+        'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'referer': 'https://www.instagram.com/',
+        'http_headers': {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+            'Accept-Language': 'en-us,en;q=0.5',
+            'Accept-Encoding': 'gzip,deflate',
+            'Accept-Charset': 'ISO-8859-1,utf-8;q=0.7,*;q=0.7',
+            'Keep-Alive': '300',
+            'Connection': 'keep-alive',
+        }
+    }
+    ydl_opts['progress_hooks'] = _progress_hooks(progress)
+    _ytdlp_timeouts(ydl_opts)
+
+    gate = _ffmpeg_gate(ydl_opts, download_id, progress)
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl, gate:
+        logger.info(f"Downloading Instagram content from: {url}")
+
+        try:
+            with tracing.span('ytdlp.extract'):
+                info = ydl.extract_info(url, download=False)
+        except yt_dlp.utils.ExtractorError as e:
+            if 'login' in str(e).lower() or 'private' in str(e).lower():
+                raise PipelineError('This Instagram content is private or requires login. Please try with a public post/reel.', 400)
+            raise
+
+        if info:
+            with cancellation.transfer(), tracing.span('ytdlp.download'):
+                info = ydl.process_ie_result(info, download=True)
+
+        if not info:
+            raise PipelineError('Could not download content. The post may be private, deleted, or not accessible.', 400)
+
+        filename = _find_output(temp_dir, download_id, ydl.prepare_filename(info))
+        if not filename:
+            raise PipelineError('Failed to download file. Content may be protected or unavailable.', 500)
+
+        content_title = info.get('title') or _instagram_fallback_title(url, download_id)
+
+        # Get extension
+        _, ext = os.path.splitext(filename)
+        if not ext:
+            ext = '.mp4'  # Default to mp4 if no extension
+
+        return MediaResult(f"{content_title}{ext}", path=filename, progress=progress)
+
+INSTAGRAM_BACKENDS = [
+    ('browser', instagram_via_browser),
+    ('yt-dlp', instagram_via_ytdlp),
+]
+
+def fetch_instagram(url, temp_dir, download_id, progress=None):
+    cache_key = artifact_cache.make_key(canonical_media_id('instagram', url), None, False)
+    cached = from_cache(cache_key, progress)
+    if cached:
+        return cached
+    
+    return shared_fetch(cache_key, lambda: _instagram_backends(url, temp_dir, download_id, cache_key, progress), progress)
+
+def _instagram_backends(url, temp_dir, download_id, cache_key, progress=None):
+    result, errors = _run_backends(
+        'instagram',
+        INSTAGRAM_BACKENDS,
+        lambda backend: backend(url, temp_dir, download_id, progress=progress),
+        progress
+    )
+    if result:
+        return admit_to_cache(cache_key, result)
+    if cancellation.expired():
+        raise timed_out()
+
+    # A backend that could tell the content is private or gone gives the most useful answer
+    client_errors = [e for e in errors if isinstance(e, PipelineError) and 400 <= e.status < 500]
+    e = client_errors[0] if client_errors else errors[-1]
+    if isinstance(e, PipelineError):
+        raise e
+    logger.error(f"Error downloading Instagram content from {url}: {str(e)}")
+
+    # Provide more specific error messages
+    if 'login' in str(e).lower():
+        raise PipelineError('This Instagram content requires authentication. Please try with a public post or reel.', 400)
+    elif 'private' in str(e).lower():
+        raise PipelineError('This Instagram account or post is private and cannot be downloaded.', 400)
+    elif 'not found' in str(e).lower():
+        raise PipelineError('Instagram content not found. The post may have been deleted or the URL is incorrect.', 404)
+    raise PipelineError('Failed to download Instagram content. Please try again or check if the content is publicly accessible.', 500)
+
+# ---------------------------------------------------------------------------
+# X (Twitter)
+# ---------------------------------------------------------------------------
+
+def fetch_twitter(url, temp_dir, download_id, cookie_file=None, progress=None):
+    # Content fetched with a user's cookies may be private, so it is never shared
+    if cookie_file:
+        return _twitter_download(url, temp_dir, download_id, cookie_file, None, progress)
+
+    cache_key = artifact_cache.make_key(canonical_media_id('twitter', url), None, False)
+    cached = from_cache(cache_key, progress)
+    if cached:
+        return cached
+
+    return shared_fetch(cache_key, lambda: _twitter_download(url, temp_dir, download_id, None, cache_key, progress), progress)
+
+def _twitter_download(url, temp_dir, download_id, cookie_file, cache_key, progress=None):
+    import yt_dlp
+
+    cleanup_paths = [cookie_file] if cookie_file else []
+
+    def discard_cookies():
+        for path in cleanup_paths:
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except:
+                pass
+
+    # Configure yt-dlp options for Twitter download
+    output_template = os.path.join(temp_dir, f'{download_id}.%(ext)s')
+
+    ydl_opts = {
+        'outtmpl': output_template,
+        'quiet': False,  # Enable some output for better debugging
+        'no_warnings': False,  # Show warnings for better debugging
+        'ffmpeg_location': FFMPEG_PATH,
+        'format': 'best',  # Get the best quality for Twitter
+        'cookiefile': cookie_file,  # Use cookie file if uploaded
+        'extract_flat': False,
+        'ignoreerrors': True,  # Skip any errors
+        'verbose': True  # Enable verbose output for debugging
+    }
+    if progress:
+        progress.set_stage('extracting (yt-dlp)')
+    ydl_opts['progress_hooks'] = _progress_hooks(progress)
+    _ytdlp_timeouts(ydl_opts)
+
+    gate = _ffmpeg_gate(ydl_opts, download_id, progress)
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl, gate:
+            logger.info(f"Downloading X content from: {url}")
+            with tracing.span('ytdlp.extract'):
+                info = ydl.extract_info(url, download=False)
+            if info:
+                with cancellation.transfer(), tracing.span('ytdlp.download'):
+                    info = ydl.process_ie_result(info, download=True)
+
+            if not info:
+                raise PipelineError('Could not download content. The post may be private, not exist, or contain no media.', 400)
+
+            filename = _find_output(temp_dir, download_id, ydl.prepare_filename(info))
+            if not filename:
+                raise PipelineError('Failed to download file. The post may not contain downloadable media.', 500)
+
+            # Get original filename and content type
+            if info.get('title'):
+                content_title = info['title']
+            elif info.get('uploader'):
+                # Generate a title based on the account name if available
+                content_title = f"X_Video_{info['uploader']}_{download_id[:6]}"
+            else:
+                content_title = f"X_Video_{download_id[:8]}"
+
+            # Get extension
+            _, ext = os.path.splitext(filename)
+            if not ext:
+                ext = '.mp4'  # Default to mp4 if no extension
+
+            file_size = os.path.getsize(filename)
+            logger.info(f"X content downloaded: {content_title}{ext} ({file_size} bytes)")
+
+            result = MediaResult(f"{content_title}{ext}", path=filename, cleanup_paths=cleanup_paths, progress=progress)
+            return admit_to_cache(cache_key, result) if cache_key else result
+
+    except PipelineError:
+        discard_cookies()
+        raise
+    except yt_dlp.utils.DownloadError as e:
+        error_message = str(e)
+        logger.error(f"yt-dlp download error for {url}: {error_message}")
+        discard_cookies()
+        if cancellation.expired():
+            raise timed_out()
+
+        # Handle common error cases with more user-friendly messages
+        if "Unsupported URL" in error_message:
+            raise PipelineError('This URL is not supported or does not contain media content', 400)
+        elif "requires authentication" in error_message:
+            raise PipelineError('This content is private and requires authentication. Please try uploading a cookies.txt file from a browser where you are logged in.', 403)
+        elif "not exist" in error_message or "404" in error_message:
+            raise PipelineError('The requested content does not exist', 404)
+        raise PipelineError(f'Error downloading content: {error_message}', 500)
+    except Exception as e:
+        error_message = f"Error downloading X content from {url}: {str(e)}"
+        logger.error(error_message)
+        discard_cookies()
+        if cancellation.expired():
+            raise timed_out()
+        raise PipelineError(error_message, 500)
@@ -0,0 +1,273 @@
+import os
+import time
+import uuid
+import shutil
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+import cancellation
+import jobs
+import pipelines
+import progress
+import workspace
+
+logger = logging.getLogger("playlists")
+
+# Playlist settings (can be overridden through the environment)
+# Entries downloaded at once per playlist, unless the client asks for fewer or more
+PLAYLIST_CONCURRENCY = int(os.environ.get('NEOBYTE_PLAYLIST_CONCURRENCY', 4))
+PLAYLIST_MAX_CONCURRENCY = int(os.environ.get('NEOBYTE_PLAYLIST_MAX_CONCURRENCY', 8))
+# Entries downloaded at once across all playlists; with the job workers this caps
+# background downloads at NEOBYTE_JOB_WORKERS + NEOBYTE_PLAYLIST_WORKERS
+PLAYLIST_WORKERS = int(os.environ.get('NEOBYTE_PLAYLIST_WORKERS', 8))
+PLAYLIST_RETRIES = int(os.environ.get('NEOBYTE_PLAYLIST_RETRIES', 2))
+PLAYLIST_MAX_ITEMS = int(os.environ.get('NEOBYTE_PLAYLIST_MAX_ITEMS', 500))
+# Playlists expanding or downloading at once; more are refused rather than queued
+PLAYLIST_MAX_ACTIVE = int(os.environ.get('NEOBYTE_PLAYLIST_MAX_ACTIVE', 4))
+# Seconds before the first retry of an entry, doubled for each one after
+RETRY_BACKOFF = 2
+
+EXPANDING = 'expanding'
+CANCELLED = 'cancelled'
+
+class PlaylistLimitError(Exception):
+    """Raised when too many playlists are already being downloaded"""
+
+class Item:
+    """One playlist entry, downloaded into the playlist's workspace"""
+
+    def __init__(self, playlist, index, url, title=None):
+        self.playlist = playlist
+        self.index = index
+        self.url = url
+        self.title = title
+        self.id = f"{playlist.id}-{index}"
+        self.state = jobs.QUEUED
+        self.attempts = 0
+        self.error = None
+        self.status_code = None
+        self.artifact_path = None
+        self.download_name = None
+        # Created when the entry starts, so a long playlist cannot outlive its trackers
+        self.progress = None
+
+    def to_dict(self):
+        data = {
+            'index': self.index,
+            'url': self.url,
+            'title': self.title,
+            'state': self.state,
+            'attempts': self.attempts,
+        }
+        if self.progress:
+            data['progress'] = self.progress.snapshot()
+            data['progress_url'] = f"/progress/{self.progress.id}"
+        if self.state == jobs.FINISHED:
+            data['download_name'] = self.download_name
+            data['artifact_url'] = f"/playlists/{self.playlist.id}/items/{self.index}/artifact"
+        if self.error:
+            data['error'] = self.error
+        return data
+
+class Playlist:
+    def __init__(self, url, download_type, resolution, audio_format, concurrency):
+        self.id = str(uuid.uuid4())
+        self.url = url
+        self.download_type = download_type
+        self.resolution = resolution
+        self.audio_format = audio_format
+        self.concurrency = concurrency
+        self.title = None
+        self.state = EXPANDING
+        self.error = None
+        self.status_code = None
+        self.items = []
+        self.created_at = time.time()
+        self.finished_at = None
+        self.workspace = workspace.get_manager().create(self.id)
+        # Cancelling the playlist cancels every entry still running
+        self.token = cancellation.CancelToken()
+
+    def counts(self):
+        counts = {}
+        for item in list(self.items):
+            counts[item.state] = counts.get(item.state, 0) + 1
+        return counts
+
+    def to_dict(self):
+        data = {
+            'id': self.id,
+            'url': self.url,
+            'title': self.title,
+            'state': self.state,
+            'concurrency': self.concurrency,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+            'total': len(self.items),
+            'counts': self.counts(),
+            'items': [item.to_dict() for item in list(self.items)],
+        }
+        if self.error:
+            data['error'] = self.error
+        return data
+
+class PlaylistManager:
+    """Expands playlists and downloads their entries with bounded concurrency and retries"""
+
+    def __init__(self, workers=PLAYLIST_WORKERS, max_active=PLAYLIST_MAX_ACTIVE, retention=jobs.JOB_RETENTION):
+        # Shared by every playlist, so their entries together never exceed `workers`
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='neobyte-playlist-item')
+        self.max_active = max_active
+        self.retention = retention
+        self._playlists = {}
+        self._lock = threading.Lock()
+        self._janitor = None
+
+    def active(self):
+        with self._lock:
+            return sum(1 for playlist in self._playlists.values() if playlist.finished_at is None)
+
+    def submit(self, url, download_type, resolution, audio_format, concurrency=None):
+        self.expire()
+        if self.active() >= self.max_active:
+            raise PlaylistLimitError("Too many playlists are being downloaded, please try again shortly")
+        concurrency = max(1, min(concurrency or PLAYLIST_CONCURRENCY, PLAYLIST_MAX_CONCURRENCY))
+
+        playlist = Playlist(url, download_type, resolution, audio_format, concurrency)
+        with self._lock:
+            self._playlists[playlist.id] = playlist
+        threading.Thread(target=self._run, args=(playlist,), daemon=True, name=f'neobyte-playlist-{playlist.id[:8]}').start()
+        logger.info(f"Queued playlist {playlist.id}: {url} ({concurrency} at a time)")
+        return playlist
+
+    def _run(self, playlist):
+        try:
+            with cancellation.bind(playlist.token):
+                with cancellation.deadline(pipelines.REQUEST_BUDGET):
+                    playlist.title, entries = pipelines.expand_playlist(playlist.url, PLAYLIST_MAX_ITEMS)
+                playlist.items = [Item(playlist, index, url, title) for index, (url, title) in enumerate(entries, 1)]
+                playlist.state = jobs.RUNNING
+
+                # A playlist holds at most `concurrency` of the shared workers at a time
+                slots = threading.Semaphore(playlist.concurrency)
+                futures = []
+                for item in playlist.items:
+                    slots.acquire()
+                    future = self.executor.submit(self._run_item, playlist, item)
+                    future.add_done_callback(lambda future: slots.release())
+                    futures.append(future)
+                wait(futures)
+
+            playlist.state = CANCELLED if playlist.token.cancelled else jobs.FINISHED
+            logger.info(f"Playlist {playlist.id} {playlist.state}: {playlist.counts()}")
+        except Exception as e:
+            playlist.error = getattr(e, 'message', None) or str(e)
+            playlist.status_code = getattr(e, 'status', 500)
+            playlist.state = CANCELLED if playlist.token.cancelled else jobs.FAILED
+            logger.error(f"Playlist {playlist.id} failed: {playlist.error}")
+        finally:
+            playlist.finished_at = time.time()
+
+    def _run_item(self, playlist, item):
+        if playlist.token.cancelled:
+            item.state = CANCELLED
+            return
+        item.state = jobs.RUNNING
+        item.progress = progress.create(item.id)
+        scratch = os.path.join(playlist.workspace.path, f'item-{item.index}')
+        reserved = 0
+        try:
+            # Each running entry sets aside its own scratch space; the finished artifact keeps what it uses
+            playlist.workspace.reserve(workspace.RESERVATION)
+            reserved = workspace.RESERVATION
+            with cancellation.bind(playlist.token):
+                item.artifact_path = self._fetch_with_retries(playlist, item, scratch, os.path.join(playlist.workspace.path, f'{item.index}.artifact'))
+            reserved -= min(reserved, os.path.getsize(item.artifact_path))
+            item.state = jobs.FINISHED
+            if not item.progress.finished:
+                item.progress.finish()
+        except workspace.QuotaExceededError as e:
+            item.error = str(e)
+            item.status_code = 503
+            item.state = jobs.FAILED
+            item.progress.finish(item.error)
+            logger.error(f"Playlist {playlist.id} entry {item.index} refused: {item.error}")
+        except Exception as e:
+            item.error = getattr(e, 'message', None) or str(e)
+            item.status_code = getattr(e, 'status', 500)
+            item.state = CANCELLED if playlist.token.cancelled else jobs.FAILED
+            item.progress.finish(item.error)
+            logger.error(f"Playlist {playlist.id} entry {item.index} failed after {item.attempts} attempts: {item.error}")
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+            playlist.workspace.unreserve(reserved)
+
+    def _fetch_with_retries(self, playlist, item, scratch, dest_path):
+        """Download the entry to dest_path, retrying failures that may not happen again"""
+        while True:
+            item.attempts += 1
+            # Start every attempt clean, so a partial file from the last one is never taken as the output
+            shutil.rmtree(scratch, ignore_errors=True)
+            os.makedirs(scratch)
+            try:
+                # Like a background job, extraction is budgeted but the transfer is not
+                with cancellation.deadline(jobs.JOB_BUDGET):
+                    result = pipelines.fetch_youtube(item.url, playlist.download_type, playlist.resolution, scratch, item.id, progress=item.progress, audio_format=playlist.audio_format)
+                item.download_name = result.download_name
+                return result.save(dest_path)
+            except Exception as e:
+                # Missing or private videos fail the same way every time
+                permanent = isinstance(e, pipelines.PipelineError) and 400 <= e.status < 500
+                if permanent or isinstance(e, cancellation.Cancelled) or item.attempts > PLAYLIST_RETRIES:
+                    raise
+                message = getattr(e, 'message', None) or str(e)
+                logger.warning(f"Playlist {playlist.id} entry {item.index} attempt {item.attempts} failed, retrying: {message}")
+                item.progress.set_stage(f'retrying ({item.attempts})')
+                cancellation.sleep(RETRY_BACKOFF * 2 ** (item.attempts - 1))
+
+    def get(self, playlist_id):
+        with self._lock:
+            return self._playlists.get(playlist_id)
+
+    def cancel(self, playlist_id):
+        """Stop a playlist: running entries are cancelled and queued ones skipped"""
+        playlist = self.get(playlist_id)
+        if playlist and playlist.finished_at is None:
+            playlist.token.cancel()
+        return playlist
+
+    def expire(self):
+        """Forget finished playlists older than the retention period and release their workspaces"""
+        cutoff = time.time() - self.retention
+        with self._lock:
+            expired = [p for p in self._playlists.values() if p.finished_at and p.finished_at < cutoff]
+            for playlist in expired:
+                del self._playlists[playlist.id]
+        for playlist in expired:
+            playlist.workspace.release()
+
+    def _janitor_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.expire()
+            except Exception as e:
+                logger.error(f"Playlist expiry failed: {str(e)}")
+
+    def start_janitor(self, interval=workspace.JANITOR_INTERVAL):
+        """Expire finished playlists periodically, not only when another one is submitted"""
+        if self._janitor is None:
+            self._janitor = threading.Thread(target=self._janitor_loop, args=(interval,), daemon=True, name='neobyte-playlist-janitor')
+            self._janitor.start()
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_manager():
+    """Return the process-wide playlist manager, creating it on first use"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = PlaylistManager()
+            _manager.start_janitor()
+        return _manager
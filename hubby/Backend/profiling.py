@@ -0,0 +1,289 @@
+import os
+import io
+import re
+import sys
+import json
+import time
+import uuid
+import pstats
+import signal
+import cProfile
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+
+logger = logging.getLogger("profiling")
+
+# Profiling settings (can be overridden through the environment)
+PROFILE_DIR = os.environ.get('NEOBYTE_PROFILE_DIR', os.path.join(os.getcwd(), 'profiles'))
+# Seconds between stack samples in "sample" mode
+SAMPLE_INTERVAL = float(os.environ.get('NEOBYTE_PROFILE_INTERVAL', 0.005))
+# How long a session started by SIGUSR2 (or without a limit) runs
+DEFAULT_SECONDS = float(os.environ.get('NEOBYTE_PROFILE_SECONDS', 30))
+# Frames kept per allocation and lines written per allocation report
+ALLOC_FRAMES = 10
+ALLOC_TOP = 30
+
+MODES = ('sample', 'cprofile')
+
+class ProfilerBusyError(Exception):
+    """Raised when a profiling session is already running"""
+
+def _frame_name(code):
+    # ';' separates frames and ' ' ends the stack in the collapsed format
+    name = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return name.replace(';', ':').replace(' ', '_')
+
+def _thread_group(name):
+    # Request and worker threads are numbered; fold them into one flame per kind
+    return re.sub(r'\d+', 'N', name).replace(';', ':').replace(' ', '_')
+
+class RequestProfile:
+    """What one profiled request records between request_started() and finish()"""
+
+    def __init__(self, session, label, profile=None, snapshot=None):
+        self.session = session
+        self.label = label
+        self.profile = profile
+        self.snapshot = snapshot
+        self.finished = False
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        if self.profile is not None:
+            self.profile.disable()
+        after = tracemalloc.take_snapshot() if self.snapshot is not None and tracemalloc.is_tracing() else None
+        self.session._request_finished(self, after)
+
+class Session:
+    """One profiling run, ended by a request count, a time limit or stop()"""
+
+    def __init__(self, mode='sample', requests=None, seconds=None, interval=None, allocations=False):
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode: {mode}")
+        self.id = time.strftime('%Y%m%d-%H%M%S-') + uuid.uuid4().hex[:6]
+        self.dir = os.path.join(PROFILE_DIR, self.id)
+        self.mode = mode
+        self.max_requests = requests
+        self.seconds = seconds if seconds or requests else DEFAULT_SECONDS
+        self.interval = interval or SAMPLE_INTERVAL
+        self.allocations = allocations
+        self.started_at = None
+        self.finished_at = None
+        self.requests = 0
+        self.samples = 0
+        self.files = []
+        self._stacks = Counter()
+        self._stats = None
+        self._owns_tracemalloc = False
+        # cProfile can only follow one request at a time
+        self._profile_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+        self._timer = None
+
+    @property
+    def active(self):
+        return self.started_at is not None and not self._stop.is_set()
+
+    def start(self):
+        os.makedirs(self.dir, exist_ok=True)
+        self.started_at = time.time()
+        if self.allocations and not tracemalloc.is_tracing():
+            tracemalloc.start(ALLOC_FRAMES)
+            self._owns_tracemalloc = True
+        if self.mode == 'sample':
+            self._sampler = threading.Thread(target=self._sample_loop, daemon=True, name='profiler-sampler')
+            self._sampler.start()
+        if self.seconds:
+            self._timer = threading.Timer(self.seconds, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+        logger.info(f"Profiling session {self.id} started ({self.describe()})")
+        return self
+
+    def describe(self):
+        limits = []
+        if self.max_requests:
+            limits.append(f"{self.max_requests} requests")
+        if self.seconds:
+            limits.append(f"{self.seconds:g}s")
+        return f"{self.mode}, {' or '.join(limits)}" + (', allocations' if self.allocations else '')
+
+    def _sample_loop(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, frame in frames.items():
+                    if ident == me:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(_frame_name(frame.f_code))
+                        frame = frame.f_back
+                    stack.append(_thread_group(names.get(ident, 'unknown')))
+                    self._stacks[';'.join(reversed(stack))] += 1
+                self.samples += 1
+
+    def request_started(self, label):
+        """Begin recording a request, or return None if this one is not profiled"""
+        if not self.active:
+            return None
+        profile = None
+        if self.mode == 'cprofile' and self._profile_lock.acquire(blocking=False):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler (a debugger, coverage) already owns the hooks
+                self._profile_lock.release()
+                profile = None
+        snapshot = tracemalloc.take_snapshot() if self.allocations and tracemalloc.is_tracing() else None
+        return RequestProfile(self, label, profile, snapshot)
+
+    def _request_finished(self, handle, after):
+        if handle.profile is not None:
+            self._profile_lock.release()
+        with self._lock:
+            if not self.active:
+                return
+            self.requests += 1
+            number = self.requests
+            if handle.profile is not None:
+                if self._stats is None:
+                    self._stats = pstats.Stats(handle.profile)
+                else:
+                    self._stats.add(handle.profile)
+        if after is not None:
+            self._write_allocations(number, handle, after)
+        if self.max_requests and number >= self.max_requests:
+            self.stop()
+
+    def _write_allocations(self, number, handle, after):
+        name = f"allocations-{number:03d}.txt"
+        differences = after.compare_to(handle.snapshot, 'lineno')
+        growth = sum(stat.size_diff for stat in differences)
+        with open(os.path.join(self.dir, name), 'w') as f:
+            f.write(f"{handle.label}: {growth / 1024:+.1f} KiB still allocated after the response closed\n\n")
+            for stat in differences[:ALLOC_TOP]:
+                f.write(f"{stat}\n")
+        with self._lock:
+            self.files.append(name)
+
+    def stop(self):
+        """End the session and write its output; safe to call more than once"""
+        with self._lock:
+            if self._stop.is_set():
+                return
+            self._stop.set()
+            self.finished_at = time.time()
+        if self._timer:
+            self._timer.cancel()
+        if self._sampler and self._sampler is not threading.current_thread():
+            self._sampler.join()
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+        try:
+            self._write_output()
+        except OSError as e:
+            logger.error(f"Could not write profile {self.id}: {str(e)}")
+        logger.info(f"Profiling session {self.id} finished: {self.requests} requests, {self.samples} samples, files {self.files}")
+
+    def _write_output(self):
+        with self._lock:
+            stacks = dict(self._stacks)
+            stats = self._stats
+        if stacks:
+            # Collapsed stacks, as read by flamegraph.pl, speedscope and inferno
+            with open(os.path.join(self.dir, 'stacks.folded'), 'w') as f:
+                for stack, count in sorted(stacks.items()):
+                    f.write(f"{stack} {count}\n")
+            self.files.append('stacks.folded')
+        if stats is not None:
+            stats.dump_stats(os.path.join(self.dir, 'profile.pstats'))
+            summary = io.StringIO()
+            stats.stream = summary
+            stats.sort_stats('cumulative').print_stats(40)
+            with open(os.path.join(self.dir, 'profile.txt'), 'w') as f:
+                f.write(summary.getvalue())
+            self.files += ['profile.pstats', 'profile.txt']
+        with open(os.path.join(self.dir, 'session.json'), 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'mode': self.mode,
+            'active': self.active,
+            'max_requests': self.max_requests,
+            'seconds': self.seconds,
+            'interval': self.interval,
+            'allocations': self.allocations,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'requests': self.requests,
+            'samples': self.samples,
+            'files': sorted(self.files),
+        }
+
+_session = None
+_session_lock = threading.Lock()
+
+def start(mode='sample', requests=None, seconds=None, interval=None, allocations=False):
+    """Start a profiling session; only one runs at a time"""
+    global _session
+    with _session_lock:
+        if _session is not None and _session.active:
+            raise ProfilerBusyError(f"Profiling session {_session.id} is still running")
+        _session = Session(mode, requests, seconds, interval, allocations)
+        return _session.start()
+
+def stop():
+    """Stop the running session, returning it (or None if nothing was running)"""
+    session = _session
+    if session is None or not session.active:
+        return None
+    session.stop()
+    return session
+
+def current():
+    """The running session, or the last one to finish"""
+    return _session
+
+def request_started(label):
+    session = _session
+    if session is None:
+        return None
+    return session.request_started(label)
+
+def output_path(session_id, name):
+    """Path of a file a session wrote, or None if there is no such file"""
+    if os.path.basename(session_id) != session_id or os.path.basename(name) != name:
+        return None
+    path = os.path.join(PROFILE_DIR, session_id, name)
+    return path if os.path.isfile(path) else None
+
+def install_signal_handler(signum=getattr(signal, 'SIGUSR2', None)):
+    """Toggle a sampling session with a signal (kill -USR2 <pid>); must run on the main thread"""
+    if signum is None:
+        return False
+
+    def toggle():
+        if stop() is None:
+            try:
+                start('sample')
+            except ProfilerBusyError:
+                pass
+
+    def handler(signum, frame):
+        # Stopping joins threads and writes files, which is no work for a signal handler
+        threading.Thread(target=toggle, daemon=True, name='profiler-toggle').start()
+
+    signal.signal(signum, handler)
+    return True
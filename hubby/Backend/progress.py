@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger("progress")
+
+# Progress settings (can be overridden through the environment)
+UPDATE_INTERVAL = float(os.environ.get('NEOBYTE_PROGRESS_INTERVAL', 0.5))
+STALL_TIMEOUT = float(os.environ.get('NEOBYTE_PROGRESS_STALL_TIMEOUT', 30))
+TRACKER_RETENTION = float(os.environ.get('NEOBYTE_PROGRESS_RETENTION', 600))
+KEEPALIVE_INTERVAL = 15
+# Unfinished trackers that have not moved for this long belong to work that died without finishing them
+ABANDONED_AFTER = 6 * 3600
+
+class TrackerExistsError(Exception):
+    """Raised when an exclusive create() asks for an ID that is already being tracked"""
+
+class Tracker:
+    """Byte counts, speed and stage of one in-flight download
+
+    Updates from download hooks can arrive for every chunk; subscribers are
+    only woken at most once per UPDATE_INTERVAL unless the stage changes.
+    """
+
+    def __init__(self, tracker_id):
+        self.id = tracker_id
+        self.stage = 'queued'
+        self.bytes_done = 0
+        self.total_bytes = None
+        self.speed = None
+        self.eta = None
+        self.error = None
+        self.finished = False
+        self.created_at = time.time()
+        self.finished_at = None
+        self.last_progress_at = self.created_at
+        self.version = 0
+        self._published_at = 0
+        self._speed_sample = (self.created_at, 0)
+        self._cond = threading.Condition()
+
+    def _publish(self, force=False):
+        now = time.time()
+        if not force and now - self._published_at < UPDATE_INTERVAL:
+            return
+        self._published_at = now
+        self.version += 1
+        self._cond.notify_all()
+
+    def set_stage(self, stage):
+        with self._cond:
+            if stage != self.stage:
+                self.stage = stage
+                self._publish(force=True)
+
+    def update(self, bytes_done, total_bytes=None):
+        """Record the absolute number of bytes transferred so far"""
+        with self._cond:
+            now = time.time()
+            if bytes_done > self.bytes_done:
+                self.last_progress_at = now
+            self.bytes_done = bytes_done
+            if total_bytes:
+                self.total_bytes = total_bytes
+
+            sample_time, sample_bytes = self._speed_sample
+            elapsed = now - sample_time
+            if elapsed >= UPDATE_INTERVAL:
+                self.speed = (bytes_done - sample_bytes) / elapsed
+                self._speed_sample = (now, bytes_done)
+                if self.speed and self.total_bytes:
+                    self.eta = max(0.0, (self.total_bytes - bytes_done) / self.speed)
+            self._publish()
+
+    def add_bytes(self, count, total_bytes=None):
+        self.update(self.bytes_done + count, total_bytes)
+
+    def finish(self, error=None):
+        with self._cond:
+            self.finished = True
+            self.finished_at = time.time()
+            self.error = error
+            self.stage = 'failed' if error else 'done'
+            self._publish(force=True)
+
+    def is_stalled(self):
+        return not self.finished and time.time() - self.last_progress_at > STALL_TIMEOUT
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                'id': self.id,
+                'stage': self.stage,
+                'bytes_done': self.bytes_done,
+                'total_bytes': self.total_bytes,
+                'speed': self.speed,
+                'eta': self.eta,
+                'stalled': self.is_stalled(),
+                'finished': self.finished,
+                'error': self.error
+            }
+
+    def wait(self, version, timeout):
+        """Block until the tracker publishes past version or timeout elapses"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.version != version, timeout=timeout)
+            return self.version
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+def create(tracker_id, exclusive=False):
+    """Start tracking tracker_id; exclusive refuses an ID that is already taken instead of replacing it"""
+    _expire()
+    tracker = Tracker(tracker_id)
+    with _trackers_lock:
+        if exclusive and tracker_id in _trackers:
+            raise TrackerExistsError(f"Progress ID {tracker_id} is already in use")
+        _trackers[tracker_id] = tracker
+    return tracker
+
+def get(tracker_id):
+    with _trackers_lock:
+        return _trackers.get(tracker_id)
+
+def _expire():
+    # Retention counts from when a download finished, so a long one stays visible while it runs
+    now = time.time()
+    with _trackers_lock:
+        expired = [
+            t.id for t in _trackers.values()
+            if (t.finished and t.finished_at < now - TRACKER_RETENTION)
+            or (not t.finished and t.last_progress_at < now - ABANDONED_AFTER)
+        ]
+        for tracker_id in expired:
+            del _trackers[tracker_id]
+
+def stalled():
+    """IDs of downloads that have not moved a byte within STALL_TIMEOUT"""
+    with _trackers_lock:
+        return [t.id for t in _trackers.values() if t.is_stalled()]
+
+def event_stream(tracker):
+    """Yield Server-Sent Events for a tracker until its download finishes"""
+    version = -1
+    while True:
+        new_version = tracker.wait(version, KEEPALIVE_INTERVAL)
+        if new_version == version:
+            # Comment lines keep proxies from closing an idle connection
+            yield ": keepalive\n\n"
+            continue
+        version = new_version
+        snapshot = tracker.snapshot()
+        yield f"event: progress\ndata: {json.dumps(snapshot)}\n\n"
+        if snapshot['finished']:
+            return
+
+# Adapters for the callback styles used by each backend
+
+def ytdlp_hook(tracker):
+    def hook(d):
+        if d.get('status') == 'downloading':
+            tracker.set_stage('downloading')
+            tracker.update(d.get('downloaded_bytes') or 0, d.get('total_bytes') or d.get('total_bytes_estimate'))
+        elif d.get('status') == 'finished':
+            tracker.set_stage('processing')
+    return hook
+
+def pytube_callback(tracker):
+    def callback(stream, chunk, bytes_remaining):
+        tracker.set_stage('downloading')
+        total_size = stream.filesize
+        tracker.update(total_size - bytes_remaining, total_size)
+    return callback
@@ -0,0 +1,171 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+import metrics
+
+logger = logging.getLogger("scoreboard")
+
+# Scoreboard settings (can be overridden through the environment)
+SCORE_WINDOW = float(os.environ.get('NEOBYTE_SCORE_WINDOW', 1800))
+SCORE_SAMPLES = int(os.environ.get('NEOBYTE_SCORE_SAMPLES', 100))
+MIN_SAMPLES = int(os.environ.get('NEOBYTE_SCORE_MIN_SAMPLES', 5))
+# Expected seconds to success assumed for a backend we have no recent data on
+PRIOR_SECONDS = float(os.environ.get('NEOBYTE_BACKEND_PRIOR_SECONDS', 15))
+BREAKER_FAILURES = int(os.environ.get('NEOBYTE_BREAKER_FAILURES', 5))
+BREAKER_COOLDOWN = float(os.environ.get('NEOBYTE_BREAKER_COOLDOWN', 120))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+class CircuitBreaker:
+    """Stops sending work to a backend after repeated failures, then lets one trial through"""
+
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.threshold = failures
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def available(self, now):
+        if self.state == OPEN and now - self.opened_at >= self.cooldown:
+            self.state = HALF_OPEN
+            self.trial_running = False
+        if self.state == HALF_OPEN:
+            return not self.trial_running
+        return self.state == CLOSED
+
+    def begin(self):
+        if self.state == HALF_OPEN:
+            self.trial_running = True
+
+    def success(self):
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.trial_running = False
+
+    def failure(self, now):
+        self.consecutive_failures += 1
+        self.trial_running = False
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.threshold:
+            self.state = OPEN
+            self.opened_at = now
+            return True
+        return False
+
+class BackendStats:
+    """Rolling outcomes for one backend on one platform"""
+
+    def __init__(self, max_samples=SCORE_SAMPLES):
+        self.samples = deque(maxlen=max_samples)
+        self.breaker = CircuitBreaker()
+
+    def prune(self, now, window):
+        while self.samples and now - self.samples[0][0] > window:
+            self.samples.popleft()
+
+    def expected_seconds(self):
+        """Median attempt time divided by the (smoothed) success rate"""
+        if len(self.samples) < MIN_SAMPLES:
+            return PRIOR_SECONDS
+        successes = sum(1 for _, ok, _ in self.samples if ok)
+        success_rate = (successes + 1) / (len(self.samples) + 2)
+        return _percentile([latency for _, _, latency in self.samples], 0.5) / success_rate
+
+    def summary(self):
+        latencies = [latency for _, _, latency in self.samples]
+        successes = sum(1 for _, ok, _ in self.samples if ok)
+        return {
+            'samples': len(self.samples),
+            'success_rate': successes / len(self.samples) if self.samples else None,
+            'p50': _percentile(latencies, 0.5),
+            'p95': _percentile(latencies, 0.95),
+            'expected_seconds': self.expected_seconds(),
+            'breaker': self.breaker.state,
+            'consecutive_failures': self.breaker.consecutive_failures
+        }
+
+class Scoreboard:
+    """Orders backends by observed speed and reliability for each platform"""
+
+    def __init__(self, window=SCORE_WINDOW):
+        self.window = window
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _get(self, platform, name):
+        key = (platform, name)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = BackendStats()
+            self._stats[key] = stats
+        return stats
+
+    def order(self, platform, backends):
+        """Return (name, fn) pairs fastest-expected first, leaving out backends whose breaker is open
+
+        If every breaker is open the full ranked list is returned, since failing
+        slowly is still better than refusing outright.
+        """
+        now = time.time()
+        with self._lock:
+            ranked = []
+            for index, (name, fn) in enumerate(backends):
+                stats = self._get(platform, name)
+                stats.prune(now, self.window)
+                ranked.append((stats.expected_seconds(), index, name, fn, stats.breaker.available(now)))
+        ranked.sort(key=lambda item: (item[0], item[1]))
+        available = [(name, fn) for _, _, name, fn, ok in ranked if ok]
+        if not available:
+            logger.warning(f"Every {platform} backend has an open circuit breaker; trying them anyway")
+            return [(name, fn) for _, _, name, fn, _ in ranked]
+        return available
+
+    def begin(self, platform, name):
+        with self._lock:
+            self._get(platform, name).breaker.begin()
+        return time.time()
+
+    def record(self, platform, name, ok, started_at):
+        now = time.time()
+        outcome = 'success' if ok else 'failure'
+        metrics.BACKEND_ATTEMPTS.inc(platform=platform, backend=name, outcome=outcome)
+        metrics.BACKEND_DURATION.observe(now - started_at, platform=platform, backend=name, outcome=outcome)
+        with self._lock:
+            stats = self._get(platform, name)
+            stats.samples.append((now, ok, now - started_at))
+            if ok:
+                stats.breaker.success()
+                return
+            tripped = stats.breaker.failure(now)
+        if tripped:
+            logger.warning(f"Circuit breaker opened for {platform}/{name} for {stats.breaker.cooldown:.0f}s")
+
+    def release(self, platform, name):
+        """Give back a half-open trial that ended without a verdict on the backend"""
+        metrics.BACKEND_ATTEMPTS.inc(platform=platform, backend=name, outcome='released')
+        with self._lock:
+            self._get(platform, name).breaker.trial_running = False
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for (platform, name), stats in self._stats.items():
+                result.setdefault(platform, {})[name] = stats.summary()
+            return result
+
+_board = Scoreboard()
+
+def get_scoreboard():
+    return _board
@@ -0,0 +1,143 @@
+import os
+import logging
+import threading
+import cancellation
+import http_pool
+import metrics
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+logger = logging.getLogger("segmented")
+
+# Segmented download settings (can be overridden through the environment)
+SEGMENTS = int(os.environ.get('NEOBYTE_SEGMENTS', 4))
+MIN_SEGMENT_SIZE = int(os.environ.get('NEOBYTE_MIN_SEGMENT_SIZE', 2 * 1024 * 1024))
+SEGMENT_RETRIES = int(os.environ.get('NEOBYTE_SEGMENT_RETRIES', 3))
+CHUNK_SIZE = 256 * 1024
+TIMEOUT = 30
+
+def probe(url, headers=None):
+    """Return (total_size, supports_ranges) for a direct media URL"""
+    probe_headers = dict(headers or {})
+    probe_headers['Range'] = 'bytes=0-0'
+    response = http_pool.get(url, headers=probe_headers, stream=True, timeout=cancellation.timeout(TIMEOUT))
+    try:
+        response.raise_for_status()
+        if response.status_code == 206:
+            # Content-Range: bytes 0-0/12345
+            content_range = response.headers.get('content-range', '')
+            total = content_range.rsplit('/', 1)[-1]
+            if total.isdigit():
+                return int(total), True
+        length = response.headers.get('content-length')
+        return (int(length) if length else None), False
+    finally:
+        response.close()
+
+class _Counter:
+    """Thread-safe running byte total shared by all segments"""
+
+    def __init__(self, total, progress):
+        self.total = total
+        self.done = 0
+        self.progress = progress
+        self._lock = threading.Lock()
+
+    def add(self, count):
+        metrics.UPSTREAM_BYTES.inc(count)
+        with self._lock:
+            self.done += count
+            done = self.done
+        if self.progress:
+            self.progress.update(done, self.total)
+
+def _fetch_segment(url, headers, output_path, start, end, counter, retries, token=None):
+    """Download bytes [start, end] into output_path, resuming after each failed attempt"""
+    with cancellation.bind(token):
+        _fetch_range(url, headers, output_path, start, end, counter, retries)
+
+def _fetch_range(url, headers, output_path, start, end, counter, retries):
+    position = start
+    attempt = 0
+    while position <= end:
+        segment_headers = dict(headers or {})
+        segment_headers['Range'] = f'bytes={position}-{end}'
+        try:
+            response = http_pool.get(url, headers=segment_headers, stream=True, timeout=cancellation.timeout(TIMEOUT))
+            try:
+                if response.status_code != 206:
+                    raise IOError(f"Expected 206 for range request, got {response.status_code}")
+                with open(output_path, 'r+b') as f:
+                    f.seek(position)
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        if chunk:
+                            f.write(chunk)
+                            position += len(chunk)
+                            counter.add(len(chunk))
+                            cancellation.check()
+            finally:
+                response.close()
+            if position <= end:
+                raise IOError(f"Segment ended early at byte {position} of {end}")
+        except cancellation.Cancelled:
+            raise
+        except Exception as e:
+            attempt += 1
+            if attempt > retries:
+                raise
+            logger.warning(f"Retrying segment {start}-{end} from byte {position} ({attempt}/{retries}): {str(e)}")
+            cancellation.sleep(min(2 ** attempt, 10))
+
+def _single_stream(url, headers, output_path, total, progress):
+    response = http_pool.get(url, headers=headers, stream=True, timeout=cancellation.timeout(TIMEOUT))
+    try:
+        response.raise_for_status()
+        counter = _Counter(total, progress)
+        with open(output_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                if chunk:
+                    f.write(chunk)
+                    counter.add(len(chunk))
+                    cancellation.check()
+    finally:
+        response.close()
+    return output_path
+
+def download(url, output_path, headers=None, segments=SEGMENTS, progress=None, retries=SEGMENT_RETRIES):
+    """Download url to output_path using parallel range requests when the server allows it"""
+    total, supports_ranges = probe(url, headers)
+    if progress:
+        progress.set_stage('downloading')
+
+    if not supports_ranges or not total or segments <= 1 or total < 2 * MIN_SEGMENT_SIZE:
+        return _single_stream(url, headers, output_path, total, progress)
+
+    count = min(segments, total // MIN_SEGMENT_SIZE)
+    segment_size = total // count
+    ranges = []
+    for i in range(count):
+        start = i * segment_size
+        end = total - 1 if i == count - 1 else start + segment_size - 1
+        ranges.append((start, end))
+
+    logger.info(f"Downloading {total} bytes in {count} segments")
+
+    # Preallocate so every segment can write at its own offset
+    with open(output_path, 'wb') as f:
+        f.truncate(total)
+
+    counter = _Counter(total, progress)
+    # Segments run on their own threads, so they are handed a token explicitly; it
+    # follows the caller's deadline and also stops the siblings once one segment fails
+    token = cancellation.CancelToken(parent=cancellation.current())
+    with ThreadPoolExecutor(max_workers=count, thread_name_prefix='neobyte-segment') as executor:
+        futures = [executor.submit(_fetch_segment, url, headers, output_path, start, end, counter, retries, token) for start, end in ranges]
+        done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+        failed = next((f for f in futures if f in done and f.exception() is not None), None)
+        if failed is not None:
+            token.cancel('segment failed')
+            for future in pending:
+                future.cancel()
+            # Report the segment that failed, not the siblings it cancelled
+            raise failed.exception()
+
+    return output_path
@@ -205,16 +205,15 @@ class YoutubeDownloader:
             self.log_message(f"Length: {yt.length} seconds")
             
             if download_type == "audio":
-                # Download audio
+                # Download the original audio track; AAC is the most widely playable
                 self.log_message("Downloading audio only...")
-                stream = yt.streams.filter(only_audio=True).first()
-                file_path = stream.download(output_path=output_dir)
+                audio_streams = yt.streams.filter(only_audio=True)
+                stream = audio_streams.filter(mime_type="audio/mp4").order_by("abr").desc().first() or audio_streams.order_by("abr").desc().first()
                 
-                # Convert to MP3
-                base, ext = os.path.splitext(file_path)
-                new_file = base + '.mp3'
-                os.rename(file_path, new_file)
-                self.log_message(f"Converted to MP3: {os.path.basename(new_file)}")
+                # Name the file after what it really contains instead of pretending it is an MP3
+                ext = "m4a" if stream.subtype == "mp4" else stream.subtype
+                file_path = stream.download(output_path=output_dir, filename=f"{stream.default_filename.rsplit('.', 1)[0]}.{ext}")
+                self.log_message(f"Saved {stream.audio_codec} audio: {os.path.basename(file_path)}")
             else:
                 # Download video
                 self.log_message("Downloading video...")
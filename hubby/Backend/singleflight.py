@@ -0,0 +1,261 @@
+import os
+import uuid
+import shutil
+import logging
+import threading
+import cancellation
+import tracing
+
+logger = logging.getLogger("singleflight")
+
+SPOOL_DIR = os.path.join(os.getcwd(), 'flights')
+READ_SIZE = 64 * 1024
+
+class Flight:
+    """One in-progress fetch, spooled to disk only when more than one reader attached"""
+
+    def __init__(self, key):
+        self.key = key
+        self.spool_path = os.path.join(SPOOL_DIR, f"{uuid.uuid4()}.spool")
+        self.ready = threading.Event()
+        self.error = None
+        self.download_name = None
+        self.mimetype = None
+        self.content_length = None
+        self.bytes_written = 0
+        self.finished = False
+        self.failed = None
+        self.readers = 0
+        self.cond = threading.Condition()
+
+    def _wrote(self, count):
+        with self.cond:
+            self.bytes_written += count
+            self.cond.notify_all()
+
+    def _finish(self, failed=None):
+        with self.cond:
+            self.finished = True
+            self.failed = failed
+            self.cond.notify_all()
+
+    def pump(self, stream):
+        """Drain the upstream stream into the spool file (runs in its own thread)"""
+        try:
+            with open(self.spool_path, 'ab') as f:
+                for chunk in stream:
+                    f.write(chunk)
+                    f.flush()
+                    self._wrote(len(chunk))
+            self._finish()
+        except Exception as e:
+            logger.error(f"Shared transfer for {self.key} failed: {str(e)}")
+            self._finish(str(e))
+        finally:
+            close = getattr(stream, 'close', None)
+            if close:
+                close()
+            _land(self)
+
+    def release(self):
+        with _flights_lock:
+            self.readers -= 1
+            remove = self.finished and self.readers <= 0 and _flights.get(self.key) is not self
+        if remove:
+            _remove_spool(self)
+
+class SpoolReader:
+    """Iterates over a flight's spool file, waiting for the pump as needed"""
+
+    def __init__(self, flight, progress=None):
+        self.flight = flight
+        self.progress = progress
+        self.content_type = flight.mimetype
+        self.content_length = flight.content_length
+        self._released = False
+
+    def __iter__(self):
+        flight = self.flight
+        position = 0
+        completed = False
+        total = int(flight.content_length) if flight.content_length else None
+        if self.progress:
+            self.progress.set_stage('downloading')
+        try:
+            with open(flight.spool_path, 'rb') as f:
+                while True:
+                    with flight.cond:
+                        flight.cond.wait_for(lambda: flight.bytes_written > position or flight.finished)
+                        available = flight.bytes_written - position
+                        finished = flight.finished
+                        failed = flight.failed
+                    if available <= 0:
+                        if failed:
+                            raise IOError(f"Upstream transfer failed: {failed}")
+                        if finished:
+                            break
+                        continue
+                    while available > 0:
+                        chunk = f.read(min(READ_SIZE, available))
+                        if not chunk:
+                            break
+                        position += len(chunk)
+                        available -= len(chunk)
+                        if self.progress:
+                            self.progress.update(position, total)
+                        yield chunk
+            completed = True
+        finally:
+            if self.progress and not self.progress.finished:
+                self.progress.finish(None if completed else 'Transfer interrupted')
+            self.close()
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self.flight.release()
+
+class Attachment:
+    """What a caller gets back from run(): a reader plus the leader's metadata"""
+
+    def __init__(self, flight, progress=None, stream=None):
+        # An unshared leader reads the upstream directly; everyone else reads the spool
+        self.stream = stream if stream is not None else SpoolReader(flight, progress)
+        self.download_name = flight.download_name
+        self.mimetype = flight.mimetype
+        self.content_length = flight.content_length
+        self.leader = False
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+def _land(flight):
+    """Stop accepting new readers once the transfer is complete"""
+    with _flights_lock:
+        if _flights.get(flight.key) is flight:
+            del _flights[flight.key]
+        remove = flight.readers <= 0
+    if remove:
+        _remove_spool(flight)
+
+def _remove_spool(flight):
+    try:
+        if os.path.exists(flight.spool_path):
+            os.remove(flight.spool_path)
+    except OSError as e:
+        logger.warning(f"Error removing spool file: {str(e)}")
+
+def _abandon(flight, error):
+    """Fail a flight before it has a spool: wake its followers and let new callers start afresh"""
+    flight.error = error
+    with _flights_lock:
+        flight.readers -= 1
+        if _flights.get(flight.key) is flight:
+            del _flights[flight.key]
+    flight.ready.set()
+
+def _follower_error(error):
+    """A new exception for each follower, so they do not all re-raise (and mutate) the leader's"""
+    from pipelines import PipelineError, timed_out
+    if isinstance(error, cancellation.DeadlineExceeded):
+        fresh = timed_out()
+    else:
+        fresh = PipelineError(getattr(error, 'message', None) or str(error), getattr(error, 'status', 500))
+    fresh.__cause__ = error
+    return fresh
+
+def _discard(result):
+    close = getattr(result.stream, 'close', None)
+    if close:
+        close()
+    result.cleanup()
+
+def in_flight():
+    with _flights_lock:
+        return len(_flights)
+
+def run(key, fetch, progress=None):
+    """Run fetch() once per key; concurrent callers share its bytes
+
+    fetch must return an object with download_name, mimetype, content_length,
+    cleanup() and either a byte iterable in .stream or a file in .path.
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = Flight(key)
+            _flights[key] = flight
+        flight.readers += 1
+
+    if not leader:
+        logger.info(f"Attaching to in-flight download {key}")
+        if progress:
+            progress.set_stage('waiting for shared download')
+        # The leader may be slow; a follower only waits as long as its own deadline allows
+        with tracing.span('shared.wait'):
+            ready = flight.ready.wait(cancellation.remaining())
+        if not ready:
+            flight.release()
+            raise cancellation.DeadlineExceeded(cancellation.EXPIRED)
+        if flight.error is not None:
+            flight.release()
+            raise _follower_error(flight.error)
+        return Attachment(flight, progress)
+
+    try:
+        result = fetch()
+    except Exception as e:
+        _abandon(flight, e)
+        raise
+
+    flight.download_name = result.download_name
+    flight.mimetype = result.mimetype or getattr(result.stream, 'content_type', None)
+    flight.content_length = result.content_length or getattr(result.stream, 'content_length', None)
+
+    if result.stream is not None:
+        with _flights_lock:
+            shared = flight.readers > 1
+            if not shared:
+                # Nobody joined during extraction; later callers start their own flight
+                flight.readers -= 1
+                if _flights.get(key) is flight:
+                    del _flights[key]
+        if not shared:
+            flight.ready.set()
+            attachment = Attachment(flight, stream=result.stream)
+            attachment.leader = True
+            return attachment
+
+    try:
+        os.makedirs(SPOOL_DIR, exist_ok=True)
+        if result.stream is not None:
+            # Create the spool up front so readers can open it before the first chunk lands
+            open(flight.spool_path, 'wb').close()
+        else:
+            # A finished file is shared by linking it into the spool
+            try:
+                os.link(result.path, flight.spool_path)
+            except OSError:
+                shutil.copyfile(result.path, flight.spool_path)
+            flight.content_length = os.path.getsize(flight.spool_path)
+    except Exception as e:
+        logger.error(f"Could not spool shared download {key}: {str(e)}")
+        _discard(result)
+        _remove_spool(flight)
+        _abandon(flight, e)
+        raise
+
+    if result.stream is not None:
+        threading.Thread(target=flight.pump, args=(result.stream,), daemon=True, name='neobyte-flight').start()
+    else:
+        result.cleanup()
+        flight.bytes_written = flight.content_length
+        flight._finish()
+        _land(flight)
+
+    flight.ready.set()
+    # A streaming leader's tracker already follows the upstream transfer itself
+    attachment = Attachment(flight, progress if result.stream is None else None)
+    attachment.leader = True
+    return attachment
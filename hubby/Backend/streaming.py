@@ -0,0 +1,104 @@
+import time
+import logging
+import unicodedata
+import cancellation
+import http_pool
+import metrics
+import tracing
+from urllib.parse import quote
+from flask import Response, stream_with_context
+
+logger = logging.getLogger("streaming")
+
+# Relay chunk size; large enough to keep syscalls cheap, small enough for a quick first byte
+CHUNK_SIZE = 64 * 1024
+
+class UpstreamStream:
+    """Iterable over the body of an upstream HTTP response that always closes the connection"""
+
+    def __init__(self, response, chunk_size=CHUNK_SIZE, progress=None):
+        self.response = response
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.content_length = response.headers.get('content-length')
+        self.content_type = response.headers.get('content-type', 'application/octet-stream')
+        self.bytes_sent = 0
+
+    def __iter__(self):
+        total = int(self.content_length) if self.content_length else None
+        if self.progress:
+            self.progress.set_stage('downloading')
+        completed = False
+        try:
+            for chunk in self.response.iter_content(chunk_size=self.chunk_size):
+                if chunk:
+                    self.bytes_sent += len(chunk)
+                    metrics.UPSTREAM_BYTES.inc(len(chunk))
+                    if self.progress:
+                        self.progress.update(self.bytes_sent, total)
+                    yield chunk
+            completed = True
+        finally:
+            if self.progress and not self.progress.finished:
+                self.progress.finish(None if completed else 'Transfer interrupted')
+            self.close()
+
+    def close(self):
+        self.response.close()
+
+def open_upstream(url, headers=None, timeout=30, progress=None):
+    """Start fetching a direct media URL and return an UpstreamStream over its body
+
+    Connecting is capped by the current deadline; the read timeout stays at
+    its default since the body may be relayed long after the request is answered.
+    """
+    with tracing.span('upstream.open'):
+        response = http_pool.get(url, headers=headers, stream=True, timeout=(cancellation.timeout(timeout), timeout))
+    try:
+        response.raise_for_status()
+    except Exception:
+        response.close()
+        raise
+    return UpstreamStream(response, progress=progress)
+
+def content_disposition(download_name):
+    """Build an attachment Content-Disposition header the same way send_file does"""
+    try:
+        download_name.encode("ascii")
+        return f'attachment; filename="{download_name}"'
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize("NFKD", download_name).encode("ascii", "ignore").decode("ascii")
+        quoted = quote(download_name, safe="!#$&+^`|~")
+        return f"attachment; filename=\"{simple}\"; filename*=UTF-8''{quoted}"
+
+def _measured(stream):
+    """Pass chunks through, recording bytes sent and the transfer's throughput"""
+    started_at = time.time()
+    sent = 0
+    try:
+        for chunk in stream:
+            sent += len(chunk)
+            metrics.BYTES_SENT.inc(len(chunk), source='stream')
+            yield chunk
+    finally:
+        elapsed = time.time() - started_at
+        if sent and elapsed > 0:
+            metrics.TRANSFER_THROUGHPUT.observe(sent / elapsed)
+
+def stream_response(stream, download_name, mimetype=None, content_length=None):
+    """Wrap a byte iterator in a chunked Flask response sent as a file attachment"""
+    if mimetype is None:
+        mimetype = getattr(stream, 'content_type', None) or 'application/octet-stream'
+    if content_length is None:
+        content_length = getattr(stream, 'content_length', None)
+
+    response = Response(stream_with_context(_measured(stream)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = content_disposition(download_name)
+    if content_length:
+        response.headers['Content-Length'] = str(content_length)
+
+    # Make sure the upstream connection is released if the client disconnects early
+    close = getattr(stream, 'close', None)
+    if close:
+        response.call_on_close(close)
+    return response
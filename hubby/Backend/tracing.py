@@ -0,0 +1,133 @@
+import os
+import re
+import json
+import time
+import uuid
+import random
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger("trace")
+
+# Tracing settings (can be overridden through the environment)
+# Fraction of requests traced; admin requests sent with "X-Trace: 1" are always traced
+SAMPLE_RATE = float(os.environ.get('NEOBYTE_TRACE_SAMPLE_RATE', 1.0))
+
+class Span:
+    def __init__(self, name, start, end, error=None, thread=None):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.error = error
+        self.thread = thread
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+class Trace:
+    """Timed stages of one request, collected from every thread that works on it"""
+
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started_at = time.perf_counter()
+        self.wall_start = time.time()
+        self.spans = []
+        self.attrs = {}
+        self._lock = threading.Lock()
+        self._logged = False
+
+    def add(self, name, start, end, error=None):
+        span = Span(name, start, end, error, threading.current_thread().name)
+        with self._lock:
+            self.spans.append(span)
+
+    def server_timing(self):
+        """Server-Timing header value for the stages finished so far"""
+        with self._lock:
+            spans = list(self.spans)
+        entries = [f'{_token(span.name)};dur={span.duration * 1000:.1f}' for span in spans]
+        entries.append(f'total;dur={(time.perf_counter() - self.started_at) * 1000:.1f}')
+        return ', '.join(entries)
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        data = {
+            'trace_id': self.id,
+            'name': self.name,
+            'start': self.wall_start,
+            'total_ms': round((time.perf_counter() - self.started_at) * 1000, 1),
+            'spans': [],
+        }
+        data.update(self.attrs)
+        for span in spans:
+            entry = {
+                'name': span.name,
+                'offset_ms': round((span.start - self.started_at) * 1000, 1),
+                'duration_ms': round(span.duration * 1000, 1),
+                'thread': span.thread,
+            }
+            if span.error:
+                entry['error'] = span.error
+            data['spans'].append(entry)
+        return data
+
+    def finish(self, **attrs):
+        """Write the trace as a single JSON log line (only the first call logs)"""
+        with self._lock:
+            if self._logged:
+                return
+            self._logged = True
+        self.attrs.update(attrs)
+        logger.info(json.dumps(self.to_dict()))
+
+def _token(name):
+    # Server-Timing metric names must be HTTP tokens
+    return re.sub(r"[^A-Za-z0-9!#$%&'*+.^_`|~-]", '_', name)
+
+def start(name, force=False, sample_rate=None):
+    """Return a new Trace, or None if this request is not sampled"""
+    rate = SAMPLE_RATE if sample_rate is None else sample_rate
+    if force or (rate > 0 and random.random() < rate):
+        return Trace(name)
+    return None
+
+_local = threading.local()
+
+def current():
+    """The trace bound to the calling thread, if any"""
+    return getattr(_local, 'trace', None)
+
+def activate(trace):
+    """Bind trace to the calling thread until the next activate() call"""
+    _local.trace = trace
+
+@contextmanager
+def bind(trace):
+    """Make trace the current one for code running in this thread"""
+    previous = current()
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+@contextmanager
+def span(name):
+    """Time a stage of the current trace; costs next to nothing when nothing is traced"""
+    trace = current()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        trace.add(name, started, time.perf_counter(), error)
@@ -0,0 +1,369 @@
+import os
+import time
+import heapq
+import shutil
+import logging
+import itertools
+import threading
+import subprocess
+from contextlib import contextmanager
+import cancellation
+import formats
+import metrics
+import streaming
+import tracing
+from media_cache import TTLCache
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger("transcode")
+
+# Path to ffmpeg from the YoutubeDownloaderApp folder
+FFMPEG_PATH = os.path.join(os.getcwd(), 'YoutubeDownloaderApp', 'ffmpeg.exe')
+if not os.path.exists(FFMPEG_PATH):
+    FFMPEG_PATH = 'ffmpeg'  # Use system ffmpeg if not found
+
+CHUNK_SIZE = 64 * 1024
+# Give up on a URL input that stalls for this long
+NETWORK_TIMEOUT = 30
+
+# Scheduler settings (can be overridden through the environment)
+MAX_PROCESSES = int(os.environ.get('NEOBYTE_FFMPEG_WORKERS', os.cpu_count() or 2))
+# Work of unknown length queues behind anything shorter than an hour
+DEFAULT_PRIORITY = float(os.environ.get('NEOBYTE_FFMPEG_DEFAULT_PRIORITY', 3600))
+ACCOUNT_RETENTION = 24 * 3600
+
+def ffmpeg_available():
+    return os.path.exists(FFMPEG_PATH) or shutil.which(FFMPEG_PATH) is not None
+
+class Slot:
+    """One admitted (or waiting) ffmpeg run"""
+
+    def __init__(self, priority, label):
+        self.priority = DEFAULT_PRIORITY if priority is None else priority
+        self.label = label
+        self.queued_at = time.time()
+        self.started_at = None
+        self.cpu_time = 0.0
+
+class TranscodeScheduler:
+    """Caps concurrent ffmpeg processes and admits short jobs first
+
+    Priority is the media duration in seconds, so a 30 second clip waiting
+    behind a two hour film still gets the next free slot.
+    """
+
+    def __init__(self, max_processes=MAX_PROCESSES):
+        self.max_processes = max(1, max_processes)
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._running = 0
+        self._cond = threading.Condition()
+        self._accounts = TTLCache(ACCOUNT_RETENTION, 4096)
+        self.completed = 0
+        self.cpu_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self, priority=None, label=None, timeout=None):
+        """Wait for a free slot, raising TimeoutError after timeout seconds"""
+        slot = Slot(priority, label)
+        entry = (slot.priority, next(self._sequence), slot)
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+            try:
+                admitted = self._cond.wait_for(lambda: self._running < self.max_processes and self._waiting[0] is entry, timeout)
+                if not admitted:
+                    raise TimeoutError(f"No ffmpeg slot became free within {timeout:.1f}s")
+            except BaseException:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._waiting)
+            self._running += 1
+            slot.started_at = time.time()
+            waited = slot.started_at - slot.queued_at
+            self.wait_seconds += waited
+            self.max_wait = max(self.max_wait, waited)
+            # Another slot may be free for the next waiter
+            self._cond.notify_all()
+        metrics.FFMPEG_WAIT.observe(waited)
+        if waited > 1:
+            logger.info(f"ffmpeg job {label} waited {waited:.1f}s for a slot")
+        return slot
+
+    def release(self, slot):
+        with self._cond:
+            self._running -= 1
+            self.completed += 1
+            self.cpu_seconds += slot.cpu_time
+            self._cond.notify_all()
+        if slot.label:
+            self.charge(slot.label, slot.cpu_time)
+        elapsed = time.time() - slot.started_at
+        metrics.FFMPEG_RUN.observe(elapsed)
+        logger.info(f"ffmpeg job {slot.label} used {slot.cpu_time:.2f}s CPU in {elapsed:.1f}s")
+
+    @contextmanager
+    def slot(self, priority=None, label=None):
+        slot = self.acquire(priority, label)
+        try:
+            yield slot
+        finally:
+            self.release(slot)
+
+    def charge(self, label, seconds):
+        with self._cond:
+            self._accounts.set(label, (self._accounts.get(label) or 0.0) + seconds)
+
+    def cpu_time(self, label):
+        """Total ffmpeg CPU seconds spent on behalf of a download or job"""
+        return self._accounts.get(label) or 0.0
+
+    def stats(self):
+        with self._cond:
+            return {
+                'max_processes': self.max_processes,
+                'running': self._running,
+                'queued': len(self._waiting),
+                'completed': self.completed,
+                'cpu_seconds': self.cpu_seconds,
+                'avg_wait': self.wait_seconds / self.completed if self.completed else 0.0,
+                'max_wait': self.max_wait
+            }
+
+def reap(process):
+    """Wait for a child process and return its CPU time (None when the platform can't tell)"""
+    if hasattr(os, 'wait4') and process.returncode is None:
+        try:
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            return usage.ru_utime + usage.ru_stime
+        except ChildProcessError:
+            pass  # Already reaped by Popen itself
+    process.wait()
+    return None
+
+def _children_cpu():
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+class PostprocessorGate:
+    """yt-dlp postprocessor hook that runs its ffmpeg steps under the scheduler
+
+    Add gate.hook to 'postprocessor_hooks' and run the download inside
+    "with gate:" so a postprocessor that raises still gives its slot back.
+    """
+
+    def __init__(self, label=None, scheduler=None):
+        self.label = label
+        self.scheduler = scheduler or get_scheduler()
+        self._slot = None
+        self._cpu_start = None
+
+    def hook(self, d):
+        if not str(d.get('postprocessor', '')).startswith(('FFmpeg', 'Merger')):
+            return
+        if d.get('status') == 'started' and self._slot is None:
+            duration = (d.get('info_dict') or {}).get('duration')
+            self._slot = self.scheduler.acquire(duration, self.label, timeout=cancellation.timeout(None))
+            self._cpu_start = _children_cpu()
+        elif d.get('status') == 'finished':
+            self.release()
+
+    def release(self):
+        if self._slot is None:
+            return
+        # yt-dlp reaps ffmpeg itself, so the best available measure is the change in
+        # CPU used by all finished children, which can include overlapping transcodes
+        end = _children_cpu()
+        if end is not None and self._cpu_start is not None:
+            self._slot.cpu_time = max(0.0, end - self._cpu_start)
+        slot, self._slot = self._slot, None
+        self.scheduler.release(slot)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+        return False
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    """Return the process-wide ffmpeg scheduler, creating it on first use"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = TranscodeScheduler()
+        return _scheduler
+
+class TranscodeStream:
+    """Pipes a source byte stream through ffmpeg and iterates over its output
+
+    The source is written to ffmpeg's stdin from a feeder thread while stdout
+    is yielded as it is produced, so nothing is buffered on disk. Inputs that
+    must be combined (separate video and audio) are instead given as a list
+    of (url, headers) pairs which ffmpeg fetches itself.
+    """
+
+    def __init__(self, source, output_args, mimetype='application/octet-stream', progress=None, duration=None, label=None, inputs=None, chunk_size=CHUNK_SIZE):
+        self.source = source
+        self.inputs = list(inputs or [])
+        self.duration = duration
+        self.label = label or (progress.id if progress else None)
+        self.output_args = list(output_args)
+        self.content_type = mimetype
+        # The encoded size is not known up front, so the response is chunked
+        self.content_length = None
+        self.progress = progress
+        self.chunk_size = chunk_size
+        self.process = None
+        self.slot = None
+        # ffmpeg runs while the response is sent, so its span is added to the trace afterwards
+        self.trace = tracing.current()
+        self.started_at = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._closed = False
+        self._stderr = b''
+
+    def _command(self):
+        command = [FFMPEG_PATH, '-hide_banner', '-loglevel', 'error']
+        if self.source is not None:
+            command += ['-i', 'pipe:0']
+        for url, headers in self.inputs:
+            if headers:
+                command += ['-headers', ''.join(f"{key}: {value}\r\n" for key, value in headers.items())]
+            command += ['-rw_timeout', str(int(NETWORK_TIMEOUT * 1000000)), '-i', url]
+        return command + self.output_args + ['pipe:1']
+
+    def _feed(self):
+        total = getattr(self.source, 'content_length', None)
+        total = int(total) if total else None
+        try:
+            for chunk in self.source:
+                self.process.stdin.write(chunk)
+                self.bytes_in += len(chunk)
+                if self.progress:
+                    self.progress.update(self.bytes_in, total)
+        except (BrokenPipeError, ValueError, OSError):
+            # ffmpeg exited or the client went away; the reader side reports why
+            pass
+        except Exception as e:
+            logger.error(f"Error reading transcode source: {str(e)}")
+        finally:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+            close = getattr(self.source, 'close', None)
+            if close:
+                close()
+
+    def _drain_stderr(self):
+        # Keep only the tail so a chatty ffmpeg cannot fill memory
+        for line in self.process.stderr:
+            self._stderr = (self._stderr + line)[-4096:]
+
+    def admit(self):
+        """Wait for a scheduler slot, for no longer than the current deadline allows
+
+        open_plan() calls this before the response starts, so a request that
+        cannot get a slot in time still fails with a proper status.
+        """
+        if self.slot is not None:
+            return
+        if self.progress:
+            self.progress.set_stage('waiting for transcoder')
+        with tracing.span('ffmpeg.queue'):
+            self.slot = get_scheduler().acquire(self.duration, self.label, timeout=cancellation.timeout(None))
+
+    def __iter__(self):
+        self.admit()
+        if self.progress:
+            self.progress.set_stage('transcoding')
+
+        completed = False
+        try:
+            stdin = subprocess.PIPE if self.source is not None else subprocess.DEVNULL
+            self.started_at = time.perf_counter()
+            self.process = subprocess.Popen(self._command(), stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            if self.source is not None:
+                threading.Thread(target=self._feed, daemon=True, name='neobyte-transcode-feed').start()
+            threading.Thread(target=self._drain_stderr, daemon=True, name='neobyte-transcode-err').start()
+
+            while True:
+                chunk = self.process.stdout.read1(self.chunk_size) if hasattr(self.process.stdout, 'read1') else self.process.stdout.read(self.chunk_size)
+                if not chunk:
+                    break
+                self.bytes_out += len(chunk)
+                if self.progress and self.source is None:
+                    # Without a fed source, output bytes are the only measure of progress
+                    self.progress.update(self.bytes_out, None)
+                yield chunk
+            returncode = self._reap()
+            if returncode != 0 and not self._closed:
+                raise IOError(f"ffmpeg exited with status {returncode}: {self._stderr.decode('utf-8', 'replace').strip()}")
+            completed = True
+        finally:
+            if self.progress and not self.progress.finished:
+                self.progress.finish(None if completed else 'Transcode interrupted')
+            self.close()
+
+    def _reap(self):
+        cpu_time = reap(self.process)
+        if self.trace is not None and self.started_at is not None:
+            self.trace.add('ffmpeg', self.started_at, time.perf_counter())
+        if self.slot is not None:
+            self.slot.cpu_time = cpu_time or 0.0
+            slot, self.slot = self.slot, None
+            get_scheduler().release(slot)
+        return self.process.returncode
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self.process and self.process.returncode is None:
+            try:
+                self.process.kill()
+            except OSError:
+                pass
+            self._reap()
+        elif self.slot is not None:
+            slot, self.slot = self.slot, None
+            get_scheduler().release(slot)
+        close = getattr(self.source, 'close', None)
+        if close:
+            close()
+
+def open_plan(plan, progress=None):
+    """Open a byte stream that delivers a negotiated formats.Plan"""
+    if plan.action == formats.DIRECT:
+        source = plan.sources[0]
+        return streaming.open_upstream(source.url, headers=source.headers, progress=progress)
+
+    if len(plan.sources) == 1:
+        source = plan.sources[0]
+        upstream = streaming.open_upstream(source.url, headers=source.headers)
+        stream = TranscodeStream(upstream, plan.ffmpeg_args(), mimetype=plan.mimetype, progress=progress, duration=plan.duration)
+    else:
+        # Separate video and audio are fetched by ffmpeg itself so both can be read at once
+        inputs = [(source.url, source.headers) for source in plan.sources]
+        stream = TranscodeStream(None, plan.ffmpeg_args(), mimetype=plan.mimetype, progress=progress, duration=plan.duration, inputs=inputs)
+
+    try:
+        stream.admit()
+    except BaseException:
+        stream.close()
+        raise
+    return stream
@@ -0,0 +1,215 @@
+import os
+import time
+import uuid
+import shutil
+import logging
+import threading
+import singleflight
+
+logger = logging.getLogger("workspace")
+
+# Scratch space settings (can be overridden through the environment)
+WORKSPACE_ROOT = os.environ.get('NEOBYTE_WORKSPACE_DIR', os.path.join(os.getcwd(), 'workspaces'))
+SCRATCH_QUOTA = int(os.environ.get('NEOBYTE_SCRATCH_QUOTA', 10 * 1024 * 1024 * 1024))
+ORPHAN_MAX_AGE = float(os.environ.get('NEOBYTE_ORPHAN_MAX_AGE', 3 * 3600))
+JANITOR_INTERVAL = float(os.environ.get('NEOBYTE_JANITOR_INTERVAL', 300))
+# Disk set aside for every new workspace, so concurrent admissions cannot overrun the quota together
+RESERVATION = int(os.environ.get('NEOBYTE_WORKSPACE_RESERVATION', 256 * 1024 * 1024))
+
+# Directories used by older versions or other modules whose stale files the janitor also reaps
+LEGACY_DIRS = [os.path.join(os.getcwd(), 'downloads'), os.path.join(os.getcwd(), 'temp')]
+
+class QuotaExceededError(Exception):
+    """Raised when the scratch area is full and no new workspace can be handed out"""
+
+class Workspace:
+    """A private scratch directory for one download or job"""
+
+    def __init__(self, manager, workspace_id, reserved=0):
+        self.manager = manager
+        self.id = workspace_id
+        self.path = os.path.join(manager.root, workspace_id)
+        self.created_at = time.time()
+        self.released = False
+        # Bytes counted against the quota for this workspace, and what the janitor last measured in it
+        self.reserved = reserved
+        self.used = 0
+        os.makedirs(self.path, exist_ok=True)
+
+    def reserve(self, nbytes):
+        """Set aside more space, e.g. for another playlist entry; raises QuotaExceededError"""
+        self.manager._reserve(self, nbytes)
+
+    def unreserve(self, nbytes):
+        """Give back space set aside with reserve() that turned out not to be needed"""
+        self.manager._reserve(self, -min(nbytes, self.reserved), check=False)
+
+    def release(self):
+        """Delete the directory and everything in it"""
+        if self.released:
+            return
+        self.released = True
+        self.manager._forget(self)
+        shutil.rmtree(self.path, ignore_errors=True)
+
+def _dir_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+class WorkspaceManager:
+    """Hands out per-job scratch directories under a shared disk quota"""
+
+    def __init__(self, root=WORKSPACE_ROOT, quota=SCRATCH_QUOTA, max_age=ORPHAN_MAX_AGE, extra_dirs=(), reservation=RESERVATION):
+        self.root = root
+        self.quota = quota
+        self.max_age = max_age
+        self.extra_dirs = list(extra_dirs)
+        self.reservation = reservation
+        self._active = {}
+        self._lock = threading.Lock()
+        self._janitor = None
+        # Running totals, so admission never walks the tree: space reserved by active
+        # workspaces, what they use beyond that, and what else sits under the root
+        self._reserved = 0
+        self._overage = 0
+        os.makedirs(self.root, exist_ok=True)
+        self._baseline = _dir_size(self.root)
+
+    def usage(self):
+        """Bytes counted against the quota: reservations plus everything else measured on disk"""
+        with self._lock:
+            return self._baseline + self._reserved + self._overage
+
+    def _fits(self, nbytes):
+        return not self.quota or self._baseline + self._reserved + self._overage + nbytes <= self.quota
+
+    def create(self, workspace_id=None):
+        with self._lock:
+            fits = self._fits(self.reservation)
+        if not fits:
+            # Try to make room before refusing the request
+            self.sweep()
+        with self._lock:
+            if not self._fits(self.reservation):
+                raise QuotaExceededError("The server is out of scratch space, please try again later")
+            self._reserved += self.reservation
+            workspace = Workspace(self, workspace_id or str(uuid.uuid4()), self.reservation)
+            self._active[workspace.id] = workspace
+        return workspace
+
+    def _reserve(self, workspace, nbytes, check=True):
+        with self._lock:
+            if check and not self._fits(nbytes):
+                raise QuotaExceededError("The server is out of scratch space, please try again later")
+            if workspace.id in self._active:
+                self._reserved += nbytes
+                self._overage -= max(0, workspace.used - workspace.reserved)
+                workspace.reserved += nbytes
+                self._overage += max(0, workspace.used - workspace.reserved)
+
+    def _forget(self, workspace):
+        with self._lock:
+            if self._active.pop(workspace.id, None) is not None:
+                self._reserved -= workspace.reserved
+                self._overage -= max(0, workspace.used - workspace.reserved)
+
+    def active_count(self):
+        with self._lock:
+            return len(self._active)
+
+    def sweep(self):
+        """Remove orphaned workspaces and stale scratch files older than max_age"""
+        cutoff = time.time() - self.max_age
+        with self._lock:
+            active = set(self._active)
+        reaped = 0
+
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name in active:
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    if os.path.isdir(path):
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        os.remove(path)
+                    reaped += 1
+            except OSError:
+                pass
+
+        for directory in self.extra_dirs:
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                try:
+                    if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        reaped += 1
+                except OSError as e:
+                    logger.error(f"Error cleaning file {path}: {e}")
+
+        self._measure()
+        if reaped:
+            logger.info(f"Janitor reaped {reaped} orphaned scratch entries")
+        return reaped
+
+    def _measure(self):
+        """Re-measure the disk: active workspaces that outgrew their reservation and everything else"""
+        with self._lock:
+            active = dict(self._active)
+        sizes = {}
+        baseline = 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            size = _dir_size(path) if os.path.isdir(path) else _file_size(path)
+            if name in active:
+                sizes[name] = size
+            else:
+                baseline += size
+        with self._lock:
+            self._baseline = baseline
+            overage = 0
+            for workspace in self._active.values():
+                # Workspaces created after the listing keep their previous measurement
+                workspace.used = sizes.get(workspace.id, workspace.used)
+                overage += max(0, workspace.used - workspace.reserved)
+            self._overage = overage
+
+    def _janitor_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Janitor sweep failed: {str(e)}")
+
+    def start_janitor(self, interval=JANITOR_INTERVAL):
+        if self._janitor is None:
+            self._janitor = threading.Thread(target=self._janitor_loop, args=(interval,), daemon=True, name='neobyte-janitor')
+            self._janitor.start()
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_manager():
+    """Return the process-wide workspace manager, creating it on first use"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = WorkspaceManager(extra_dirs=LEGACY_DIRS + [singleflight.SPOOL_DIR])
+            _manager.start_janitor()
+        return _manager